@@ -1,35 +1,74 @@
-from fastapi import FastAPI, Request, Depends, HTTPException, status, Form, File, UploadFile
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, FileResponse
+from fastapi import APIRouter, FastAPI, Request, Depends, HTTPException, status
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, RedirectResponse, FileResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import create_engine, Column, Integer, String, Text, Float, DateTime, ForeignKey, and_, or_, desc
-from sqlalchemy.orm import sessionmaker, Session, relationship, declarative_base
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, Column, Integer, String, Text, Float, DateTime, ForeignKey, Index, UniqueConstraint, and_, bindparam, inspect, literal, or_, desc, func, select, text, tuple_
+from sqlalchemy import event
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.orm import sessionmaker, Session, relationship, declarative_base, joinedload, object_session
+from multipart.multipart import MultipartParser, parse_options_header
 from passlib.context import CryptContext
 from datetime import datetime, timedelta, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote as url_quote
 from jose import JWTError, jwt
-from typing import Optional
+from typing import NamedTuple, Optional
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+import asyncio
+import bisect
+import contextvars
+import functools
+import hashlib
+import html
+import json
+import mimetypes
 import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
 from werkzeug.utils import secure_filename
 
-# FastAPI app
-app = FastAPI()
+try:
+    import orjson
+except ImportError:  # 未安裝 orjson 時退回標準庫 json
+    orjson = None
 
-# CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+### 新增功能：快速 JSON 序列化 ###
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dump_json(content) -> bytes:
+    """序列化 API 回應；datetime 直接編碼為 ISO 8601（與 .isoformat() 相同）"""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(',', ':'),
+                      default=_json_default).encode('utf-8')
+
+class FastJSONResponse(JSONResponse):
+    """所有 API 路由共用的 JSON 回應類別"""
+    def render(self, content) -> bytes:
+        return dump_json(content)
+
+# 所有路由註冊在 router 上，由 create_app() 組裝成應用
+router = APIRouter()
 
 # Custom exception handler to match Flask's error format
-@app.exception_handler(HTTPException)
 async def custom_http_exception_handler(request: Request, exc: HTTPException):
-    return JSONResponse(
+    return FastJSONResponse(
         status_code=exc.status_code,
-        content={'error': exc.detail, 'success': False}
+        content={'error': exc.detail, 'success': False},
+        headers=getattr(exc, 'headers', None)
     )
 
 # Security
@@ -42,19 +81,277 @@ pwd_context = CryptContext(
     pbkdf2_sha256__default_rounds=260000  # werkzeug 默認值
 )
 
+class PasswordHashPool:
+    """專用於密碼哈希的有界線程池（bcrypt/pbkdf2/scrypt 計算時會釋放 GIL）
+    
+    排隊中加執行中的任務超過 max_pending 時直接回傳 503，避免登入高峰拖垮其他請求。
+    """
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pending = 0
+        self.rejected = 0  # 因佇列已滿回傳 503 的次數
+        self._lock = threading.Lock()
+    
+    @property
+    def pending(self):
+        """目前排隊中加執行中的任務數"""
+        return self._pending
+    
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+    
+    def submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, please try again later",
+                headers={'Retry-After': '1'}
+            )
+        with self._lock:
+            self._pending += 1
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._release)
+        return future
+    
+    def run(self, fn, *args):
+        """提交任務並等待結果（在路由的工作線程中呼叫）"""
+        return self.submit(fn, *args).result()
+
+password_hash_pool = PasswordHashPool(
+    workers=int(os.environ.get('PASSWORD_HASH_WORKERS', min(4, os.cpu_count() or 1))),
+    max_pending=int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 32))
+)
+
+# Real-time events
+# 由 serve.py 設定為 worker 數；大於 1 時事件與快取失效需經由數據庫在進程之間傳遞
+APP_WORKERS = int(os.environ.get('APP_WORKERS', 1))
+EVENT_RELAY_INTERVAL = float(os.environ.get('EVENT_RELAY_INTERVAL', 0.2))  # 秒
+EVENT_RELAY_KEEP = 10000  # event_relay 表保留的最近事件筆數
+
+class EventSubscriber:
+    def __init__(self, queue_size: int):
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+class EventBroker:
+    """進程內 pub/sub：每個訂閱者一個有界 asyncio.Queue
+    
+    publish 可以在任何線程呼叫（路由函數在線程池中執行），實際投遞交給事件循環。
+    消費太慢而塞滿佇列的訂閱者會被斷開，由客戶端（EventSource）自動重連。
+    relay=True 時另外寫入 event_relay 表，有訂閱者的 worker 定期讀取其他進程發佈的事件。
+    要改用外部 broker 時，替換 event_broker 為提供相同 subscribe/unsubscribe/publish 的物件即可。
+    """
+    def __init__(self, queue_size: int = 100, relay: bool = False):
+        self.queue_size = queue_size
+        self.relay = relay
+        self._channels = {}
+        self._loop = None
+        self._lock = threading.Lock()
+        self._origin = f'{os.getpid()}-{os.urandom(4).hex()}'
+        self._relay_task = None
+        self._relay_last_id = None
+    
+    def subscriber_count(self, channel: Optional[str] = None):
+        with self._lock:
+            if channel is not None:
+                return len(self._channels.get(channel, ()))
+            return sum(len(subs) for subs in self._channels.values())
+    
+    def subscribe(self, channel: str):
+        """在事件循環中呼叫"""
+        self._loop = asyncio.get_running_loop()
+        subscriber = EventSubscriber(self.queue_size)
+        with self._lock:
+            self._channels.setdefault(channel, set()).add(subscriber)
+        if self.relay and (self._relay_task is None or self._relay_task.done()):
+            self._relay_task = self._loop.create_task(self._poll_relay())
+        return subscriber
+    
+    def unsubscribe(self, channel: str, subscriber: EventSubscriber):
+        with self._lock:
+            subs = self._channels.get(channel)
+            if subs is not None:
+                subs.discard(subscriber)
+                if not subs:
+                    del self._channels[channel]
+    
+    def publish(self, channel: str, event_type: str, data: dict):
+        payload = f"event: {event_type}\ndata: {dump_json(data).decode()}\n\n"
+        if self.relay:
+            self._write_relay(channel, payload)
+        self._deliver(channel, payload)
+    
+    def _deliver(self, channel: str, payload: str):
+        with self._lock:
+            if not self._channels.get(channel):
+                return
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(self._dispatch, channel, payload)
+    
+    def _dispatch(self, channel: str, payload: Optional[str]):
+        with self._lock:
+            subs = list(self._channels.get(channel, ()))
+        for subscriber in subs:
+            try:
+                subscriber.queue.put_nowait(payload)
+            except asyncio.QueueFull:
+                # 清空佇列並放入 None，通知串流結束
+                while not subscriber.queue.empty():
+                    subscriber.queue.get_nowait()
+                subscriber.queue.put_nowait(None)
+                self.unsubscribe(channel, subscriber)
+    
+    def close_all(self):
+        """通知所有訂閱者結束串流；關機時讓 SSE 連線先關閉，客戶端會重連到其他 worker"""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        with self._lock:
+            channels = list(self._channels)
+        for channel in channels:
+            loop.call_soon_threadsafe(self._dispatch, channel, None)
+    
+    def _write_relay(self, channel: str, payload: str):
+        # 在路由 commit 之後呼叫：寫入失敗只影響其他 worker 的即時通知，不讓請求失敗
+        try:
+            with engine.begin() as conn:
+                event_id = conn.execute(EventRelay.__table__.insert().values(
+                    origin=self._origin, channel=channel, payload=payload
+                )).inserted_primary_key[0]
+                if event_id % 100 == 0:
+                    conn.execute(EventRelay.__table__.delete().where(EventRelay.id <= event_id - EVENT_RELAY_KEEP))
+        except OperationalError as e:
+            print(f"寫入 event_relay 失敗: {e}")
+    
+    def _read_relay(self):
+        with engine.connect() as conn:
+            if self._relay_last_id is None:
+                self._relay_last_id = conn.execute(select(func.coalesce(func.max(EventRelay.id), 0))).scalar()
+                return []
+            rows = conn.execute(
+                select(EventRelay.id, EventRelay.origin, EventRelay.channel, EventRelay.payload)
+                .where(EventRelay.id > self._relay_last_id)
+                .order_by(EventRelay.id)
+                .limit(500)
+            ).all()
+        if rows:
+            self._relay_last_id = rows[-1].id
+        return [(row.channel, row.payload) for row in rows if row.origin != self._origin]
+    
+    async def _poll_relay(self):
+        """有訂閱者時定期讀取其他 worker 寫入 event_relay 的事件"""
+        while self.subscriber_count():
+            try:
+                for channel, payload in await run_in_threadpool(self._read_relay):
+                    self._dispatch(channel, payload)
+            except OperationalError as e:
+                print(f"讀取 event_relay 失敗: {e}")
+            await asyncio.sleep(EVENT_RELAY_INTERVAL)
+
+event_broker = EventBroker(relay=APP_WORKERS > 1)
+SSE_HEARTBEAT_SECONDS = 15
+
+def publish_project_event(project_id: int, event_type: str, data: dict):
+    """向專案頻道發佈事件（在 db.commit() 之後呼叫）"""
+    event_broker.publish(f'project:{project_id}', event_type, dict(data, project_id=project_id))
+
 # Database
-DATABASE_URL = 'sqlite:///./instance/project_delegation.db'
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///./instance/project_delegation.db')
+
+# SQLite 連線設定檔：production 啟用 WAL 等效能設定，legacy 保持 SQLite 預設行為
+DB_PROFILES = {
+    'production': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,           # 毫秒
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64000,           # 負數代表 KiB，約 64MB
+        'temp_store': 'MEMORY',
+    },
+    'legacy': {},
+}
+DB_PROFILE = os.environ.get('DB_PROFILE', 'production')
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 30))
+DB_LOCK_RETRIES = int(os.environ.get('DB_LOCK_RETRIES', 5))
+DB_LOCK_BACKOFF = float(os.environ.get('DB_LOCK_BACKOFF', 0.05))  # 秒，每次重試加倍
+
+def create_db_engine(url: str, profile: str = DB_PROFILE):
+    """依設定檔建立數據庫引擎，並在每個新連線上套用 PRAGMA"""
+    pragmas = dict(DB_PROFILES[profile])
+    for name in list(pragmas):
+        override = os.environ.get(f'DB_{name.upper()}')
+        if override is not None:
+            pragmas[name] = override
+    
+    connect_args = {"check_same_thread": False}
+    if 'busy_timeout' in pragmas:
+        connect_args['timeout'] = int(pragmas['busy_timeout']) / 1000.0
+    
+    options = {}
+    if url.startswith('sqlite') and ':memory:' not in url and url != 'sqlite://':
+        options = {'pool_size': DB_POOL_SIZE, 'max_overflow': DB_MAX_OVERFLOW, 'pool_timeout': 30}
+    db_engine = create_engine(url, connect_args=connect_args, **options)
+    
+    if pragmas and url.startswith('sqlite'):
+        @event.listens_for(db_engine, 'connect')
+        def _set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+            cursor.close()
+    return db_engine
+
+def _is_lock_error(exc: OperationalError):
+    message = str(exc.orig).lower() if exc.orig is not None else str(exc).lower()
+    return 'database is locked' in message or 'database is busy' in message
+
+def retry_on_db_lock(func):
+    """寫入路由遇到 SQLite 鎖競爭時回滾並以指數退避重試"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        db = kwargs.get('db')
+        for attempt in range(DB_LOCK_RETRIES + 1):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as e:
+                if not _is_lock_error(e) or attempt == DB_LOCK_RETRIES:
+                    raise
+                if db is not None:
+                    db.rollback()
+                time.sleep(DB_LOCK_BACKOFF * (2 ** attempt) * (0.5 + random.random()))
+    return wrapper
+
+engine = create_db_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 # Templates and Static files
 templates = Jinja2Templates(directory="templates")
-app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# Ensure directories exist
-os.makedirs("uploads", exist_ok=True)
-os.makedirs("instance", exist_ok=True)
+# File uploads
+UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads')
+MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_SIZE', 256 * 1024 * 1024))  # 單檔上限（bytes）
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+BLOB_FOLDER = os.path.join(UPLOAD_FOLDER, 'blobs')  # 以 SHA-256 為鍵的內容定址存儲
+BLOB_GC_GRACE_SECONDS = 3600  # 未被引用的文件至少保留多久才回收，避免刪除尚未提交的上傳
+
+# Windows 等環境的 mimetypes 表可能缺少 Office 格式
+mimetypes.add_type('application/vnd.openxmlformats-officedocument.presentationml.presentation', '.pptx')
+mimetypes.add_type('application/vnd.openxmlformats-officedocument.wordprocessingml.document', '.docx')
+mimetypes.add_type('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', '.xlsx')
+
+def ensure_storage_dirs():
+    """建立上傳目錄與預設數據庫目錄（在 run_migrations() 與應用啟動時呼叫，匯入時不建立）"""
+    for path in (UPLOAD_FOLDER, BLOB_FOLDER, "instance"):
+        os.makedirs(path, exist_ok=True)
 
 # Database Models
 class User(Base):
@@ -77,11 +374,17 @@ class User(Base):
 
 class Project(Base):
     __tablename__ = 'project'
+    __table_args__ = (
+        Index('ix_project_delegator_status', 'delegator_id', 'status'),
+        Index('ix_project_delegate_status', 'delegate_id', 'status'),
+        Index('ix_project_status_deadline', 'status', 'deadline'),
+        Index('ix_project_status_created', 'status', 'created_at'),
+    )
     
     id = Column(Integer, primary_key=True)
     title = Column(String(200), nullable=False)
     description = Column(Text, nullable=False)
-    status = Column(String(20), default='pending')  # pending, active, completed, closed
+    status = Column(String(20), default='pending')  # pending, awaiting_selection, expired, active, completed, closed
     delegator_id = Column(Integer, ForeignKey('user.id'), nullable=False)
     delegate_id = Column(Integer, ForeignKey('user.id'), nullable=True)
     deadline = Column(DateTime, nullable=True)  # 提案截止期限
@@ -90,13 +393,18 @@ class Project(Base):
     
     delegator = relationship('User', foreign_keys=[delegator_id], back_populates='delegated_projects')
     delegate = relationship('User', foreign_keys=[delegate_id], back_populates='received_projects')
-    quotes = relationship('Quote', back_populates='project')
-    messages = relationship('Message', back_populates='project')
-    closure_files = relationship('ClosureFile', back_populates='project')
-    proposal_files = relationship('ProposalFile', back_populates='project')
+    # 刪除專案時一併刪除；文件記錄刪除後由 ORM 事件減少 file_blob 的引用計數，內容文件由背景工作回收
+    quotes = relationship('Quote', back_populates='project', cascade='all, delete-orphan')
+    messages = relationship('Message', back_populates='project', cascade='all, delete-orphan')
+    closure_files = relationship('ClosureFile', back_populates='project', cascade='all, delete-orphan')
+    proposal_files = relationship('ProposalFile', back_populates='project', cascade='all, delete-orphan')
 
 class Quote(Base):
     __tablename__ = 'quote'
+    __table_args__ = (
+        Index('ix_quote_project', 'project_id'),
+        Index('ix_quote_recipient_project', 'recipient_id', 'project_id'),
+    )
     
     id = Column(Integer, primary_key=True)
     project_id = Column(Integer, ForeignKey('project.id'), nullable=False)
@@ -104,14 +412,18 @@ class Quote(Base):
     amount = Column(Float, nullable=False)
     message = Column(Text)
     status = Column(String(20), default='pending')  # pending, accepted, rejected
+    shortlist_rank = Column(Integer, nullable=True)  # 截止後由排程工作預先計算的推薦名次（1 起算）
     created_at = Column(DateTime, default=datetime.utcnow)
     
     project = relationship('Project', back_populates='quotes')
     recipient = relationship('User', back_populates='quotes')
-    proposal_file = relationship('ProposalFile', back_populates='quote', uselist=False)
+    proposal_file = relationship('ProposalFile', back_populates='quote', uselist=False, cascade='all, delete-orphan')
 
 class Message(Base):
     __tablename__ = 'message'
+    __table_args__ = (
+        Index('ix_message_project_created', 'project_id', 'created_at'),
+    )
     
     id = Column(Integer, primary_key=True)
     project_id = Column(Integer, ForeignKey('project.id'), nullable=False)
@@ -126,6 +438,10 @@ class Message(Base):
 
 class ProposalFile(Base):
     __tablename__ = 'proposal_file'
+    __table_args__ = (
+        Index('ix_proposal_file_quote', 'quote_id'),
+        Index('ix_proposal_file_checksum', 'checksum'),  # 回收內容前確認沒有記錄仍引用
+    )
     
     id = Column(Integer, primary_key=True)
     quote_id = Column(Integer, ForeignKey('quote.id'), nullable=False)
@@ -133,6 +449,8 @@ class ProposalFile(Base):
     uploader_id = Column(Integer, ForeignKey('user.id'), nullable=False)
     filename = Column(String(255), nullable=False)
     original_filename = Column(String(255), nullable=False)
+    file_size = Column(Integer, nullable=True)
+    checksum = Column(String(64), nullable=True)  # SHA-256，對應 file_blob.sha256
     created_at = Column(DateTime, default=datetime.utcnow)
     
     quote = relationship('Quote', back_populates='proposal_file')
@@ -141,6 +459,11 @@ class ProposalFile(Base):
 
 class ClosureFile(Base):
     __tablename__ = 'closure_file'
+    __table_args__ = (
+        # 版本號在專案內唯一；並發上傳時由 add_closure_file 重新分配衝突的版本號
+        Index('ix_closure_file_project_version', 'project_id', 'version', unique=True),
+        Index('ix_closure_file_checksum', 'checksum'),
+    )
     
     id = Column(Integer, primary_key=True)
     project_id = Column(Integer, ForeignKey('project.id'), nullable=False)
@@ -148,15 +471,30 @@ class ClosureFile(Base):
     filename = Column(String(255), nullable=False)
     original_filename = Column(String(255), nullable=False)
     version = Column(Integer, default=1)  # 版本號
+    file_size = Column(Integer, nullable=True)
+    checksum = Column(String(64), nullable=True)  # SHA-256，對應 file_blob.sha256
     status = Column(String(20), default='pending')  # pending, accepted, returned
     created_at = Column(DateTime, default=datetime.utcnow)
     
     project = relationship('Project', back_populates='closure_files')
     uploader = relationship('User', back_populates='uploaded_files')
 
+### 新增功能：內容定址文件存儲 ###
+class FileBlob(Base):
+    __tablename__ = 'file_blob'
+    
+    sha256 = Column(String(64), primary_key=True)
+    size = Column(Integer, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)  # 引用此內容的 proposal_file / closure_file 行數
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 ### 新增功能：評價系統模型 ###
 class Review(Base):
     __tablename__ = 'review'
+    __table_args__ = (
+        Index('ix_review_reviewee_created', 'reviewee_id', 'created_at'),
+        Index('ix_review_project_reviewer', 'project_id', 'reviewer_id'),
+    )
     
     id = Column(Integer, primary_key=True)
     project_id = Column(Integer, ForeignKey('project.id'), nullable=False)
@@ -178,65 +516,57 @@ class Review(Base):
     reviewer = relationship('User', foreign_keys=[reviewer_id])
     reviewee = relationship('User', foreign_keys=[reviewee_id])
 
-
-# Create tables
-Base.metadata.create_all(bind=engine)
-
-# 數據庫遷移：添加 deadline 字段（如果不存在）
-def migrate_database():
-    """檢查並添加缺失的數據庫字段"""
-    from sqlalchemy import inspect, text
-    
-    inspector = inspect(engine)
-    
-    # 檢查 project 表是否存在 deadline 字段
-    if 'project' in inspector.get_table_names():
-        columns = [col['name'] for col in inspector.get_columns('project')]
-        if 'deadline' not in columns:
-            print("正在添加 deadline 字段到 project 表...")
-            try:
-                with engine.begin() as conn:
-                    conn.execute(text("ALTER TABLE project ADD COLUMN deadline DATETIME"))
-                print("✓ deadline 字段已添加")
-            except Exception as e:
-                print(f"添加 deadline 字段時出錯: {e}")
+### 新增功能：評價彙總表（避免每次查詢都掃描 review 表） ###
+class UserRatingSummary(Base):
+    __tablename__ = 'user_rating_summary'
+    
+    user_id = Column(Integer, ForeignKey('user.id'), primary_key=True)
+    review_count = Column(Integer, nullable=False, default=0)
+    rating_sum = Column(Float, nullable=False, default=0.0)  # average_rating 的總和
+    dimension_1_sum = Column(Integer, nullable=False, default=0)
+    dimension_2_sum = Column(Integer, nullable=False, default=0)
+    dimension_3_sum = Column(Integer, nullable=False, default=0)
+    recent_reviews = Column(Text, nullable=False, default='[]')  # 最近 5 則評論（JSON）
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
-    # 檢查 closure_file 表是否存在 version 字段
-    if 'closure_file' in inspector.get_table_names():
-        columns = [col['name'] for col in inspector.get_columns('closure_file')]
-        if 'version' not in columns:
-            print("正在添加 version 字段到 closure_file 表...")
-            try:
-                with engine.begin() as conn:
-                    conn.execute(text("ALTER TABLE closure_file ADD COLUMN version INTEGER DEFAULT 1"))
-                print("✓ version 字段已添加")
-            except Exception as e:
-                print(f"添加 version 字段時出錯: {e}")
+    user = relationship('User')
+
+### 新增功能：多 worker 部署時在進程之間共享的狀態 ###
+class EventRelay(Base):
+    """SSE 事件的跨進程轉送紀錄（只保留最近 EVENT_RELAY_KEEP 筆）"""
+    __tablename__ = 'event_relay'
     
-    # 檢查是否存在 proposal_file 表，如果不存在則創建
-    if 'proposal_file' not in inspector.get_table_names():
-        print("正在創建 proposal_file 表...")
-        try:
-            ProposalFile.__table__.create(bind=engine, checkfirst=True)
-            print("✓ proposal_file 表已創建")
-        except Exception as e:
-            print(f"創建 proposal_file 表時出錯: {e}")
+    id = Column(Integer, primary_key=True)
+    origin = Column(String(32), nullable=False)  # 發佈事件的進程，讀取時略過自己的事件
+    channel = Column(String(64), nullable=False)
+    payload = Column(Text, nullable=False)
 
-    # 檢查是否存在 review 表，如果不存在則創建
-    if 'review' not in inspector.get_table_names():
-        print("正在創建 review 表...")
-        try:
-            Review.__table__.create(bind=engine, checkfirst=True)
-            print("✓ review 表已創建")
-        except Exception as e:
-            print(f"創建 review 表時出錯: {e}")
+class CacheTagVersion(Base):
+    """回應快取的標籤版本；任一 worker 寫入後遞增，所有 worker 的對應快取隨之失效"""
+    __tablename__ = 'cache_tag_version'
+    
+    tag = Column(String(64), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
 
-# 執行遷移
-try:
-    migrate_database()
-except Exception as e:
-    print(f"數據庫遷移警告: {e}")
-    print("如果這是第一次運行，這是正常的。")
+### 新增功能：持久化的背景工作佇列 ###
+class ScheduledJob(Base):
+    """到 run_at 時執行的工作；每個 (kind, target_id) 只有一筆，重新排程時覆寫"""
+    __tablename__ = 'scheduled_job'
+    __table_args__ = (
+        UniqueConstraint('kind', 'target_id', name='uq_scheduled_job_target'),
+        Index('ix_scheduled_job_status_run_at', 'status', 'run_at'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(32), nullable=False)
+    target_id = Column(Integer, nullable=False)
+    run_at = Column(DateTime, nullable=False)
+    status = Column(String(20), nullable=False, default='queued')  # queued, running, done, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    locked_until = Column(DateTime, nullable=True)  # running 的工作超過此時間視為執行者已中斷，可被重新領取
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 # Dependency to get DB session
 def get_db():
@@ -247,28 +577,479 @@ def get_db():
         db.close()
 
 ### 新增功能：計算評價 Helper 函數 ###
-def get_user_rating_stats(user_id: int, db: Session):
-    """計算用戶收到的平均評價與取得最近評論"""
-    reviews = db.query(Review).filter(Review.reviewee_id == user_id).all()
-    if not reviews:
+RECENT_REVIEWS_LIMIT = 5
+
+def _review_snippet(review):
+    return {
+        'comment': review.comment,
+        'average': review.average_rating,
+        'created_at': review.created_at.isoformat()
+    }
+
+def _rating_stats_from_summary(summary):
+    if summary is None or not summary.review_count:
         return {'average': 0.0, 'count': 0, 'reviews': []}
-    
-    total_avg = sum(r.average_rating for r in reviews) / len(reviews)
-    
-    # 取得最近 5 則評論
-    recent_reviews = [{
-        'comment': r.comment,
-        'average': r.average_rating,
-        'created_at': r.created_at.isoformat()
-    } for r in sorted(reviews, key=lambda x: x.created_at, reverse=True)[:5]]
-    
     return {
-        'average': round(total_avg, 1),
-        'count': len(reviews),
-        'reviews': recent_reviews
+        'average': round(summary.rating_sum / summary.review_count, 1),
+        'count': summary.review_count,
+        'reviews': json.loads(summary.recent_reviews or '[]')
+    }
+
+def get_user_rating_stats(user_id: int, db: Session):
+    """取得用戶收到的平均評價與最近評論（讀取彙總表，O(1)）"""
+    return _rating_stats_from_summary(db.get(UserRatingSummary, user_id))
+
+def get_users_rating_stats(user_ids, db: Session):
+    """一次查詢取得多位用戶的評價數據，回傳 {user_id: stats}"""
+    user_ids = set(user_ids)
+    summaries = {}
+    if user_ids:
+        summaries = {
+            s.user_id: s
+            for s in db.query(UserRatingSummary).filter(UserRatingSummary.user_id.in_(user_ids)).all()
+        }
+    return {uid: _rating_stats_from_summary(summaries.get(uid)) for uid in user_ids}
+
+def quote_count_subquery():
+    """每個專案的報價數量（GROUP BY project_id），用於外連接避免逐筆載入 p.quotes"""
+    return select(
+        Quote.project_id,
+        func.count(Quote.id).label('quote_count')
+    ).group_by(Quote.project_id).subquery()
+
+def apply_review_to_summary(review: Review, db: Session):
+    """將新評價計入被評價者的彙總（與評價在同一交易中，由呼叫端 commit）"""
+    summary = db.get(UserRatingSummary, review.reviewee_id)
+    if summary is None:
+        summary = UserRatingSummary(
+            user_id=review.reviewee_id,
+            review_count=0,
+            rating_sum=0.0,
+            dimension_1_sum=0,
+            dimension_2_sum=0,
+            dimension_3_sum=0,
+            recent_reviews='[]'
+        )
+        db.add(summary)
+        db.flush()
+    
+    # 數值欄位以 SQL 表達式遞增，避免並發時覆蓋彼此的結果
+    summary.review_count = UserRatingSummary.review_count + 1
+    summary.rating_sum = UserRatingSummary.rating_sum + review.average_rating
+    summary.dimension_1_sum = UserRatingSummary.dimension_1_sum + review.dimension_1
+    summary.dimension_2_sum = UserRatingSummary.dimension_2_sum + review.dimension_2
+    summary.dimension_3_sum = UserRatingSummary.dimension_3_sum + review.dimension_3
+    
+    recent = json.loads(summary.recent_reviews or '[]')
+    recent.insert(0, _review_snippet(review))
+    summary.recent_reviews = json.dumps(recent[:RECENT_REVIEWS_LIMIT], ensure_ascii=False)
+    return summary
+
+def _compute_rating_summary(user_id: int, db: Session):
+    """直接從 review 表計算用戶的評價彙總"""
+    count, rating_sum, d1, d2, d3 = db.query(
+        func.count(Review.id),
+        func.coalesce(func.sum(Review.average_rating), 0.0),
+        func.coalesce(func.sum(Review.dimension_1), 0),
+        func.coalesce(func.sum(Review.dimension_2), 0),
+        func.coalesce(func.sum(Review.dimension_3), 0)
+    ).filter(Review.reviewee_id == user_id).one()
+    recent = db.query(Review).filter(Review.reviewee_id == user_id).order_by(
+        desc(Review.created_at), desc(Review.id)
+    ).limit(RECENT_REVIEWS_LIMIT).all()
+    return {
+        'review_count': count,
+        'rating_sum': float(rating_sum),
+        'dimension_1_sum': int(d1),
+        'dimension_2_sum': int(d2),
+        'dimension_3_sum': int(d3),
+        'recent_reviews': [_review_snippet(r) for r in recent]
+    }
+
+def rebuild_rating_summaries(db: Session, user_id: Optional[int] = None):
+    """從 review 表重建評價彙總（全部或指定用戶），回傳重建的用戶數"""
+    query = db.query(Review.reviewee_id).distinct()
+    if user_id is not None:
+        query = query.filter(Review.reviewee_id == user_id)
+    user_ids = [row[0] for row in query.all()]
+    
+    stale = db.query(UserRatingSummary)
+    if user_id is not None:
+        stale = stale.filter(UserRatingSummary.user_id == user_id)
+    stale.delete(synchronize_session=False)
+    
+    if user_id is None:
+        # 全部重建時以兩個集合查詢完成，而不是每位用戶各查詢兩次（大量匯入後的重建需要）
+        summaries = _compute_all_rating_summaries(db)
+    else:
+        summaries = {uid: _compute_rating_summary(uid, db) for uid in user_ids}
+    for uid, data in summaries.items():
+        data['recent_reviews'] = json.dumps(data['recent_reviews'], ensure_ascii=False)
+        db.add(UserRatingSummary(user_id=uid, **data))
+    db.commit()
+    return len(summaries)
+
+def _compute_all_rating_summaries(db: Session):
+    """所有被評價用戶的彙總：GROUP BY 計算總和，row_number() 取每人最近的評論"""
+    totals = db.query(
+        Review.reviewee_id,
+        func.count(Review.id),
+        func.sum(Review.average_rating),
+        func.sum(Review.dimension_1),
+        func.sum(Review.dimension_2),
+        func.sum(Review.dimension_3)
+    ).group_by(Review.reviewee_id).all()
+    summaries = {
+        uid: {
+            'review_count': count,
+            'rating_sum': float(rating_sum),
+            'dimension_1_sum': int(d1),
+            'dimension_2_sum': int(d2),
+            'dimension_3_sum': int(d3),
+            'recent_reviews': []
+        }
+        for uid, count, rating_sum, d1, d2, d3 in totals
+    }
+    ranked = select(
+        Review.id,
+        func.row_number().over(
+            partition_by=Review.reviewee_id, order_by=(desc(Review.created_at), desc(Review.id))
+        ).label('rank')
+    ).subquery()
+    recent = db.query(Review).join(ranked, ranked.c.id == Review.id).filter(
+        ranked.c.rank <= RECENT_REVIEWS_LIMIT
+    ).order_by(Review.reviewee_id, ranked.c.rank)
+    for review in recent:
+        summaries[review.reviewee_id]['recent_reviews'].append(_review_snippet(review))
+    return summaries
+
+def check_rating_summaries(db: Session):
+    """比對彙總表與 review 表，回傳不一致的用戶列表"""
+    user_ids = {row[0] for row in db.query(Review.reviewee_id).distinct().all()}
+    summaries = {s.user_id: s for s in db.query(UserRatingSummary).all()}
+    
+    mismatches = []
+    for uid in sorted(user_ids | set(summaries)):
+        expected = _compute_rating_summary(uid, db)
+        summary = summaries.get(uid)
+        actual = {
+            'review_count': summary.review_count,
+            'rating_sum': summary.rating_sum,
+            'dimension_1_sum': summary.dimension_1_sum,
+            'dimension_2_sum': summary.dimension_2_sum,
+            'dimension_3_sum': summary.dimension_3_sum,
+            'recent_reviews': json.loads(summary.recent_reviews or '[]')
+        } if summary else None
+        
+        if actual is None:
+            if expected['review_count']:
+                mismatches.append({'user_id': uid, 'expected': expected, 'actual': None})
+            continue
+        same = all(actual[k] == expected[k] for k in ('review_count', 'dimension_1_sum', 'dimension_2_sum', 'dimension_3_sum', 'recent_reviews'))
+        if not same or abs(actual['rating_sum'] - expected['rating_sum']) > 1e-6:
+            mismatches.append({'user_id': uid, 'expected': expected, 'actual': actual})
+    return mismatches
+
+### 新增功能：全文搜尋 (SQLite FTS5) ###
+# project_fts / message_fts 保存經 search_text() 處理過的文字，並附上權限過濾用的欄位
+# （狀態、甲方、乙方、專案 id），由下方的 ORM 事件在同一交易中同步
+SEARCH_PAGE_DEFAULT = 20
+SEARCH_PAGE_MAX = 50
+SEARCH_MAX_TERMS = 10
+search_enabled = None  # 由 search_index_ready() 檢查 FTS5 表是否存在後設定
+
+# unicode61 分詞器不會切開連續的中日韓文字：索引前在每個字前後加上零寬空白（分詞器視為分隔符），
+# 查詢時再以片語比對相鄰的字；顯示 snippet 前移除零寬空白即可還原原文
+CJK_CHAR_RE = re.compile(r'([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af])')
+CJK_SEPARATOR = '\u200b'
+
+SEARCH_TABLES = {
+    'project_fts': "CREATE VIRTUAL TABLE project_fts USING fts5(title, description, status, delegator_id, delegate_id)",
+    'message_fts': "CREATE VIRTUAL TABLE message_fts USING fts5(body, project_id)",
+}
+
+def search_text(value):
+    return CJK_CHAR_RE.sub(CJK_SEPARATOR + r'\1' + CJK_SEPARATOR, value or '')
+
+def build_match_query(q: str):
+    """把使用者輸入轉成 FTS5 查詢：每個詞都是一個片語，詞與詞之間為 AND"""
+    phrases = []
+    for term in q.split()[:SEARCH_MAX_TERMS]:
+        if re.search(r'[^\W_]', term):
+            phrases.append('"' + search_text(term).replace('"', '""') + '"')
+    return ' '.join(phrases)
+
+def render_snippet(value):
+    """FTS5 snippet 以控制字元標記命中詞；移除零寬空白並轉義 HTML 後換成 <mark>"""
+    value = (value or '').replace(CJK_SEPARATOR, '').replace('\x03\x02', '')
+    return html.escape(value).replace('\x02', '<mark>').replace('\x03', '</mark>')
+
+def _project_search_row(project):
+    return {
+        'id': project.id,
+        'title': search_text(project.title),
+        'description': search_text(project.description),
+        'status': project.status or 'pending',
+        'delegator_id': project.delegator_id,
+        'delegate_id': project.delegate_id,
     }
 
+@event.listens_for(Project, 'after_insert')
+@event.listens_for(Project, 'after_update')
+def _index_project(mapper, connection, target):
+    if not search_index_ready(connection):
+        return
+    connection.execute(text("DELETE FROM project_fts WHERE rowid = :id"), {'id': target.id})
+    connection.execute(text(
+        "INSERT INTO project_fts(rowid, title, description, status, delegator_id, delegate_id) "
+        "VALUES (:id, :title, :description, :status, :delegator_id, :delegate_id)"
+    ), _project_search_row(target))
+
+@event.listens_for(Project, 'after_delete')
+def _unindex_project(mapper, connection, target):
+    if search_index_ready(connection):
+        connection.execute(text("DELETE FROM project_fts WHERE rowid = :id"), {'id': target.id})
+
+@event.listens_for(Message, 'after_insert')
+@event.listens_for(Message, 'after_update')
+def _index_message(mapper, connection, target):
+    if not search_index_ready(connection):
+        return
+    connection.execute(text("DELETE FROM message_fts WHERE rowid = :id"), {'id': target.id})
+    connection.execute(text(
+        "INSERT INTO message_fts(rowid, body, project_id) VALUES (:id, :body, :project_id)"
+    ), {'id': target.id, 'body': search_text(target.content), 'project_id': target.project_id})
+
+@event.listens_for(Message, 'after_delete')
+def _unindex_message(mapper, connection, target):
+    if search_index_ready(connection):
+        connection.execute(text("DELETE FROM message_fts WHERE rowid = :id"), {'id': target.id})
+
+def delete_project_messages(db: Session, project_id: int):
+    """以兩條語句刪除專案的所有訊息與其全文索引（ORM 串聯會逐筆載入並刪除）；在 db.delete(project) 之前呼叫"""
+    if search_index_ready(db.connection()):
+        db.execute(text("DELETE FROM message_fts WHERE rowid IN (SELECT id FROM message WHERE project_id = :p)"),
+                   {'p': project_id})
+    db.execute(Message.__table__.delete().where(Message.project_id == project_id))
+
+def create_search_tables(conn):
+    """建立缺少的 FTS5 表，回傳新建立的表名；SQLite 未啟用 FTS5 時拋出 OperationalError"""
+    existing_tables = set(inspect(conn).get_table_names())
+    missing = [name for name in SEARCH_TABLES if name not in existing_tables]
+    with conn.begin_nested():
+        for name in missing:
+            conn.execute(text(SEARCH_TABLES[name]))
+    return missing
+
+def rebuild_search_index(db: Session):
+    """從 project / message 表重建全文索引（缺少的 FTS5 表會先建立），回傳 (專案數, 訊息數)"""
+    global search_enabled
+    # 在這個連線上註冊 search_text，讓重建以單一 INSERT ... SELECT 完成
+    connection = db.connection()
+    create_search_tables(connection)
+    connection.connection.driver_connection.create_function('search_text', 1, search_text, deterministic=True)
+    connection.execute(text("DELETE FROM project_fts"))
+    connection.execute(text(
+        "INSERT INTO project_fts(rowid, title, description, status, delegator_id, delegate_id) "
+        "SELECT id, search_text(title), search_text(description), coalesce(status, 'pending'), delegator_id, delegate_id FROM project"
+    ))
+    connection.execute(text("DELETE FROM message_fts"))
+    connection.execute(text(
+        "INSERT INTO message_fts(rowid, body, project_id) SELECT id, search_text(content), project_id FROM message"
+    ))
+    connection.execute(text("INSERT INTO project_fts(project_fts) VALUES ('optimize')"))
+    connection.execute(text("INSERT INTO message_fts(message_fts) VALUES ('optimize')"))
+    db.commit()
+    search_enabled = True
+    return (
+        db.execute(text("SELECT count(*) FROM project_fts")).scalar(),
+        db.execute(text("SELECT count(*) FROM message_fts")).scalar(),
+    )
+
+def search_index_ready(connection=None):
+    """FTS5 表是否已由遷移建立；首次使用時查詢 sqlite_master，結果在進程內快取"""
+    global search_enabled
+    if search_enabled is None:
+        stmt = text("SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name IN :names").bindparams(
+            bindparam('names', expanding=True))
+        params = {'names': list(SEARCH_TABLES)}
+        if connection is not None:
+            count = connection.execute(stmt, params).scalar()
+        else:
+            with engine.connect() as conn:
+                count = conn.execute(stmt, params).scalar()
+        search_enabled = count == len(SEARCH_TABLES)
+    return search_enabled
+
+### 新增功能：版本化數據庫遷移 ###
+# 匯入 app 不會連線數據庫；部署時執行一次 python manage.py migrate（serve.py 與 python app.py 會自動執行）。
+# 每個步驟都可以在舊數據庫上重複執行（先檢查表或欄位是否存在），
+# 因此沒有 schema_version 表的舊數據庫會從第 1 步開始補齊。
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+    
+    version = Column(Integer, primary_key=True)
+    name = Column(String(100), nullable=False)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
+def _create_tables(conn, *models):
+    for model in models:
+        model.__table__.create(bind=conn, checkfirst=True)
+
+def _add_column(conn, table_name: str, column_name: str, column_type: str):
+    if column_name not in {col['name'] for col in inspect(conn).get_columns(table_name)}:
+        conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}"))
+
+def _migrate_initial_schema(conn):
+    _create_tables(conn, User, Project, Quote, Message, ClosureFile)
+
+def _migrate_project_deadline(conn):
+    _add_column(conn, 'project', 'deadline', 'DATETIME')
+
+def _migrate_closure_file_version(conn):
+    _add_column(conn, 'closure_file', 'version', 'INTEGER DEFAULT 1')
+
+def _migrate_proposal_file(conn):
+    _create_tables(conn, ProposalFile)
+
+def _migrate_review(conn):
+    _create_tables(conn, Review)
+
+def _migrate_blob_store(conn):
+    for table_name in ('proposal_file', 'closure_file'):
+        _add_column(conn, table_name, 'file_size', 'INTEGER')
+        _add_column(conn, table_name, 'checksum', 'VARCHAR(64)')
+    _create_tables(conn, FileBlob)
+
+def _migrate_rating_summary(conn):
+    _create_tables(conn, UserRatingSummary)
+    # 彙總表為空但已有評價時，從 review 表回填
+    with Session(bind=conn) as db:
+        if db.query(UserRatingSummary).first() is None and db.query(Review).first() is not None:
+            rebuilt = rebuild_rating_summaries(db)
+            print(f"  已回填 {rebuilt} 位用戶的評價彙總")
+
+def _migrate_indexes(conn):
+    # 為熱門查詢的過濾條件建立缺少的索引（模型上宣告的索引）
+    # 唯一索引以非唯一索引建立：舊數據可能違反唯一性，由之後的遷移修正數據後再改為唯一（例如第 12 步）
+    existing_tables = set(inspect(conn).get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name in existing_tables:
+            for index in table.indexes:
+                if index.unique:
+                    columns = ', '.join(f'"{column.name}"' for column in index.columns)
+                    conn.execute(text(f'CREATE INDEX IF NOT EXISTS "{index.name}" ON "{table.name}" ({columns})'))
+                else:
+                    index.create(bind=conn, checkfirst=True)
+
+def _migrate_search_index(conn):
+    # 沒有 FTS5 時這一步仍記錄為已套用（不阻擋之後的遷移）；之後由 manage.py rebuild-search 建立
+    global search_enabled
+    try:
+        missing = create_search_tables(conn)
+    except OperationalError as e:
+        print(f"  無法建立全文索引（SQLite 可能未啟用 FTS5），搜尋功能已停用；"
+              f"SQLite 支援 FTS5 後執行 python manage.py rebuild-search 建立: {e}")
+        search_enabled = False
+        return
+    search_enabled = True
+    if missing:
+        with Session(bind=conn) as db:
+            projects, messages = rebuild_search_index(db)
+        print(f"  全文索引已建立（{projects} 個專案、{messages} 則訊息）")
+
+def _migrate_worker_state(conn):
+    _create_tables(conn, EventRelay, CacheTagVersion)
+
+def _migrate_scheduled_jobs(conn):
+    _add_column(conn, 'quote', 'shortlist_rank', 'INTEGER')
+    _create_tables(conn, ScheduledJob)
+    # 已過期的專案在排程器啟動後立即處理
+    queued = schedule_pending_deadlines(conn)
+    if queued:
+        print(f"  已為 {queued} 個有截止期限的專案建立排程")
+
+def _migrate_closure_version_unique(conn):
+    # 舊版本在並發上傳時可能產生重複的版本號：有重複（或缺少版本號）的專案依原順序重新編號
+    renumbered = conn.execute(text("""
+        SELECT id, row_number() OVER (
+            PARTITION BY project_id ORDER BY coalesce(version, 0), created_at, id
+        ) AS version FROM closure_file
+        WHERE project_id IN (
+            SELECT project_id FROM closure_file GROUP BY project_id HAVING count(*) != count(DISTINCT version)
+        )
+    """)).all()
+    conn.execute(text("DROP INDEX IF EXISTS ix_closure_file_project_version"))
+    if renumbered:
+        conn.execute(text("UPDATE closure_file SET version = :version WHERE id = :id"),
+                     [{'id': row.id, 'version': row.version} for row in renumbered])
+        print(f"  已重新編號 {len(renumbered)} 個結案文件的版本")
+    for index in ClosureFile.__table__.indexes:
+        index.create(bind=conn, checkfirst=True)
+
+def _migrate_file_checksum_indexes(conn):
+    for model in (ProposalFile, ClosureFile):
+        for index in model.__table__.indexes:
+            index.create(bind=conn, checkfirst=True)
+
+# (版本, 名稱, 步驟)：只能在尾端新增，已發佈的步驟不可修改順序
+MIGRATIONS = [
+    (1, 'initial schema', _migrate_initial_schema),
+    (2, 'project.deadline', _migrate_project_deadline),
+    (3, 'closure_file.version', _migrate_closure_file_version),
+    (4, 'proposal_file table', _migrate_proposal_file),
+    (5, 'review table', _migrate_review),
+    (6, 'content-addressed blob store', _migrate_blob_store),
+    (7, 'user rating summaries', _migrate_rating_summary),
+    (8, 'hot query indexes', _migrate_indexes),
+    (9, 'full-text search index', _migrate_search_index),
+    (10, 'cross-worker event relay and cache versions', _migrate_worker_state),
+    (11, 'scheduled jobs and quote shortlist', _migrate_scheduled_jobs),
+    (12, 'unique closure_file versions', _migrate_closure_version_unique),
+    (13, 'file checksum indexes', _migrate_file_checksum_indexes),
+]
+LATEST_SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def current_schema_version(conn):
+    if not inspect(conn).has_table(SchemaVersion.__tablename__):
+        return 0
+    return conn.execute(select(func.coalesce(func.max(SchemaVersion.version), 0))).scalar()
+
+def pending_migrations():
+    """回傳尚未套用的 [(版本, 名稱)]"""
+    with engine.connect() as conn:
+        current = current_schema_version(conn)
+    return [(version, name) for version, name, _ in MIGRATIONS if version > current]
+
+def run_migrations(target: Optional[int] = None):
+    """依序套用尚未執行的遷移，每一步在自己的交易中完成並記錄到 schema_version，回傳套用的步驟數
+    
+    每一步先取得寫入鎖再確認版本，多個進程同時執行時後到者會等待並略過已完成的步驟。
+    """
+    ensure_storage_dirs()
+    with engine.begin() as conn:
+        conn.execute(CreateTable(SchemaVersion.__table__, if_not_exists=True))
+    applied = 0
+    for version, name, step in MIGRATIONS:
+        if target is not None and version > target:
+            break
+        with engine.begin() as conn:
+            conn.execute(SchemaVersion.__table__.update().where(SchemaVersion.version < 0).values(name=''))
+            if current_schema_version(conn) >= version:
+                continue
+            print(f"正在套用遷移 {version:04d} {name}...")
+            step(conn)
+            conn.execute(SchemaVersion.__table__.insert().values(
+                version=version, name=name, applied_at=datetime.utcnow()))
+        print(f"✓ 遷移 {version:04d} 已完成")
+        applied += 1
+    return applied
+
 # Helper functions
+async def get_json_body(request: Request) -> dict:
+    """在事件循環中讀取 JSON 請求體，讓同步路由函數可在線程池中執行數據庫操作"""
+    return await request.json()
+
 def verify_password(plain_password, hashed_password):
     """驗證密碼"""
     try:
@@ -280,10 +1061,419 @@ def verify_password(plain_password, hashed_password):
         except Exception:
             return False
 
+def verify_and_update_password(plain_password, hashed_password):
+    """驗證密碼，若哈希格式已過時（含舊的 werkzeug 哈希）則一併回傳新哈希
+    
+    回傳 (是否正確, 新哈希或 None)
+    """
+    try:
+        return pwd_context.verify_and_update(plain_password, hashed_password)
+    except Exception:
+        if verify_password(plain_password, hashed_password):
+            return True, pwd_context.hash(plain_password)
+        return False, None
+
 def get_password_hash(password):
     """生成密碼哈希"""
     return pwd_context.hash(password)
 
+def blob_path(checksum: str):
+    """內容在 uploads/ 下的相對路徑，例如 blobs/ab/abcdef..."""
+    return os.path.join('blobs', checksum[:2], checksum)
+
+MULTIPART_OVERHEAD = 64 * 1024  # 邊界與欄位標頭的容許量：Content-Length 超過 MAX_UPLOAD_SIZE 加上此值時直接拒絕
+
+class ReceivedUpload(NamedTuple):
+    path: str  # uploads/ 下的臨時文件，請求結束後刪除
+    size: int
+    checksum: str  # SHA-256
+    filename: str
+    content_type: Optional[str]
+
+class _MultipartFileReceiver:
+    """multipart 解析器的回呼：只保留名為 file 的文件欄位，其他欄位的內容直接丟棄
+    
+    回呼在事件循環中執行，只把數據放進緩衝區；寫入磁盤與計算 SHA-256 由 flush() 在線程池中完成。
+    """
+    def __init__(self):
+        self.path = None
+        self.size = 0
+        self.filename = None
+        self.content_type = None
+        self.finished = False
+        self._digest = hashlib.sha256()
+        self._file = None
+        self._buffer = bytearray()
+        self._headers = {}
+        self._field = b''
+        self._value = b''
+        self._capturing = False
+    
+    @property
+    def callbacks(self):
+        return {
+            'on_part_begin': self._on_part_begin,
+            'on_header_field': self._on_header_field,
+            'on_header_value': self._on_header_value,
+            'on_header_end': self._on_header_end,
+            'on_headers_finished': self._on_headers_finished,
+            'on_part_data': self._on_part_data,
+            'on_part_end': self._on_part_end,
+        }
+    
+    @property
+    def pending(self):
+        return len(self._buffer)
+    
+    def _on_part_begin(self):
+        self._headers = {}
+    
+    def _on_header_field(self, data, start, end):
+        self._field += data[start:end]
+    
+    def _on_header_value(self, data, start, end):
+        self._value += data[start:end]
+    
+    def _on_header_end(self):
+        self._headers[self._field.lower()] = self._value
+        self._field, self._value = b'', b''
+    
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b'content-disposition', b''))
+        self._capturing = (self.path is None and options.get(b'name') == b'file' and b'filename' in options)
+        if self._capturing:
+            self.filename = options[b'filename'].decode('utf-8', 'replace')
+            content_type = self._headers.get(b'content-type')
+            self.content_type = content_type.decode('latin-1') if content_type else None
+            fd, self.path = tempfile.mkstemp(dir=UPLOAD_FOLDER, prefix='.upload_', suffix='.tmp')
+            self._file = os.fdopen(fd, 'wb')
+    
+    def _on_part_data(self, data, start, end):
+        if self._capturing:
+            self._buffer += data[start:end]
+            self.size += end - start
+    
+    def _on_part_end(self):
+        if self._capturing:
+            self._capturing = False
+            self.finished = True
+    
+    def flush(self):
+        """把緩衝區寫入臨時文件（在線程池中呼叫）"""
+        if self._buffer:
+            self._digest.update(self._buffer)
+            self._file.write(self._buffer)
+            self._buffer.clear()
+        if self.finished and not self._file.closed:
+            self._file.close()
+    
+    def result(self):
+        return ReceivedUpload(self.path, self.size, self._digest.hexdigest(), self.filename, self.content_type)
+    
+    def discard(self):
+        if self._file is not None and not self._file.closed:
+            self._file.close()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+async def receive_upload(request: Request):
+    """FastAPI 依賴：邊接收 multipart 請求主體邊把 file 欄位寫入 uploads/ 下的臨時文件並計算 SHA-256
+    
+    不經過 Starlette 的表單解析（它會先把整個主體暫存到另一個臨時文件），文件只寫入磁盤一次。
+    Content-Length 或已接收的文件大小超過 MAX_UPLOAD_SIZE 時立即回傳 413，不再讀取剩餘的主體。
+    放在身分驗證的依賴之後，未授權的請求不會接收主體。請求結束後刪除臨時文件。
+    """
+    length = request.headers.get('content-length', '')
+    if length.isdigit() and int(length) > MAX_UPLOAD_SIZE + MULTIPART_OVERHEAD:
+        raise HTTPException(status_code=413, detail="File too large")
+    content_type, options = parse_options_header(request.headers.get('content-type', ''))
+    if content_type != b'multipart/form-data' or b'boundary' not in options:
+        raise HTTPException(status_code=400, detail="Expected multipart/form-data")
+    
+    receiver = _MultipartFileReceiver()
+    parser = MultipartParser(options[b'boundary'], receiver.callbacks)
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if receiver.size > MAX_UPLOAD_SIZE:
+                raise HTTPException(status_code=413, detail="File too large")
+            if receiver.pending >= UPLOAD_CHUNK_SIZE or receiver.finished:
+                await run_in_threadpool(receiver.flush)
+        parser.finalize()
+        if receiver.path is None:
+            raise HTTPException(status_code=400, detail="No file selected")
+        if not receiver.finished:
+            raise HTTPException(status_code=400, detail="Incomplete upload")
+        await run_in_threadpool(receiver.flush)
+        yield receiver.result()
+    finally:
+        receiver.discard()
+
+def _place_blob(tmp_path: str, checksum: str, keep_source: bool = False):
+    """將臨時文件放入內容存儲；相同內容已存在時直接丟棄臨時文件
+    
+    keep_source 時以硬連結放入並保留臨時文件（鎖競爭重試時會再次使用，由 receive_upload 刪除）。
+    """
+    target = os.path.join(UPLOAD_FOLDER, blob_path(checksum))
+    if os.path.exists(target):
+        if not keep_source:
+            os.remove(tmp_path)
+        os.utime(target)  # 更新修改時間，避免被垃圾回收的寬限期判斷為過期
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if not keep_source:
+            os.replace(tmp_path, target)
+        else:
+            try:
+                os.link(tmp_path, target)
+            except OSError:
+                # 不支援硬連結的文件系統
+                shutil.copyfile(tmp_path, target)
+    return blob_path(checksum)
+
+def acquire_blob(db: Session, checksum: str, size: int):
+    """增加內容的引用計數（與文件記錄在同一交易中，由呼叫端 commit）
+    
+    以單一 upsert 完成：並發上傳相同內容時不需要 SAVEPOINT 重試。pysqlite 在還沒有交易時
+    執行 SAVEPOINT，RELEASE 會直接 commit，之後的回滾就無法撤銷這筆引用。
+    """
+    stmt = sqlite_insert(FileBlob.__table__).values(sha256=checksum, size=size, ref_count=1,
+                                                    created_at=datetime.utcnow())
+    db.execute(stmt.on_conflict_do_update(index_elements=['sha256'],
+                                          set_={'ref_count': FileBlob.__table__.c.ref_count + 1}))
+
+def release_blob(db: Session, checksum: Optional[str]):
+    """減少內容的引用計數；文件本身由 reap_unreferenced_blobs 工作回收（呼叫端以 schedule_blob_reaper 排程）"""
+    if not checksum:
+        return
+    db.query(FileBlob).filter(FileBlob.sha256 == checksum).update(
+        {'ref_count': FileBlob.ref_count - 1}, synchronize_session=False
+    )
+
+def remove_legacy_file(db: Session, filename: Optional[str]):
+    """刪除內容定址存儲之前的舊文件（checksum 為 NULL 的記錄）；在 commit 之後呼叫，仍有記錄指向同一路徑時保留"""
+    if not filename or filename.startswith('blobs' + os.sep):
+        return
+    if (db.query(ProposalFile.id).filter(ProposalFile.filename == filename).first() or
+            db.query(ClosureFile.id).filter(ClosureFile.filename == filename).first()):
+        return
+    try:
+        os.remove(os.path.join(UPLOAD_FOLDER, filename))
+    except FileNotFoundError:
+        pass
+
+@event.listens_for(ProposalFile, 'after_delete')
+@event.listens_for(ClosureFile, 'after_delete')
+def _release_deleted_file_blob(mapper, connection, target):
+    # 與刪除文件記錄在同一交易中減少引用計數（刪除專案的串聯刪除與保留期限清理都會經過這裡）
+    if target.checksum:
+        table = FileBlob.__table__
+        connection.execute(table.update().where(table.c.sha256 == target.checksum).values(
+            ref_count=table.c.ref_count - 1))
+
+def store_upload(upload: ReceivedUpload, db: Session):
+    """把已接收的上傳文件放入內容定址存儲並增加引用計數（與文件記錄在同一交易中，由呼叫端 commit）
+    
+    先寫入引用計數取得數據庫寫入鎖，再把文件放入存儲：放置到 commit 之間，
+    其他請求無法引用或清除相同的內容。回傳 (uploads/ 下的相對路徑, 文件大小, SHA-256)
+    """
+    acquire_blob(db, upload.checksum, upload.size)
+    filename = _place_blob(upload.path, upload.checksum, keep_source=True)
+    return filename, upload.size, upload.checksum
+
+def discard_blob(checksum: str):
+    """上傳的交易回滾後，刪除沒有任何已提交記錄引用的內容文件"""
+    table = FileBlob.__table__
+    with engine.begin() as conn:
+        # 先以 UPDATE 取得寫入鎖：並發上傳相同內容的請求要等到這裡完成才會放置文件
+        conn.execute(table.update().where(table.c.sha256 == checksum).values(ref_count=table.c.ref_count))
+        ref_count = conn.execute(select(table.c.ref_count).where(table.c.sha256 == checksum)).scalar()
+        path = os.path.join(UPLOAD_FOLDER, blob_path(checksum))
+        if not ref_count and os.path.exists(path):
+            os.remove(path)
+
+@contextmanager
+def stored_upload(upload: ReceivedUpload, db: Session):
+    """上傳文件與文件記錄作為同一個工作單元：在區塊內新增記錄並 commit
+    
+    任何一步失敗時回滾交易，並清除這次放入而沒有其他記錄引用的內容文件（臨時文件由 receive_upload 清除）。
+    """
+    filename, size, checksum = store_upload(upload, db)
+    try:
+        yield filename, size, checksum
+    except BaseException:
+        db.rollback()
+        discard_blob(checksum)
+        raise
+
+CLOSURE_VERSION_RETRIES = 5
+
+def add_closure_file(db: Session, project_id: int, **fields):
+    """以專案內下一個版本號新增結案文件；版本號與其他交易衝突（唯一索引）時重新分配
+    
+    在 store_upload 已開始（並持有寫入鎖）的交易中呼叫，SQLite 上版本號不會衝突；重試是給其他數據庫的保險。
+    """
+    for _ in range(CLOSURE_VERSION_RETRIES):
+        current = db.query(func.max(ClosureFile.version)).filter(ClosureFile.project_id == project_id).scalar()
+        closure_file = ClosureFile(project_id=project_id, version=(current or 0) + 1, **fields)
+        try:
+            with db.begin_nested():
+                db.add(closure_file)
+            return closure_file
+        except IntegrityError:
+            continue
+    raise HTTPException(status_code=409, detail="Could not allocate a closure file version, please retry")
+
+def collect_garbage_blobs(db: Session, grace_seconds: int = BLOB_GC_GRACE_SECONDS):
+    """回收不再被引用的內容文件與殘留的臨時文件，回傳 (刪除文件數, 釋放的 bytes)"""
+    cutoff = time.time() - grace_seconds
+    referenced = {row[0] for row in db.query(ProposalFile.checksum).filter(ProposalFile.checksum.isnot(None)).all()}
+    referenced |= {row[0] for row in db.query(ClosureFile.checksum).filter(ClosureFile.checksum.isnot(None)).all()}
+    
+    # 引用計數歸零的記錄（再次確認沒有文件記錄仍指向它）
+    for blob in db.query(FileBlob).filter(FileBlob.ref_count <= 0).all():
+        if blob.sha256 not in referenced:
+            db.delete(blob)
+    db.commit()
+    known = {row[0] for row in db.query(FileBlob.sha256).all()}
+    
+    removed, freed = 0, 0
+    for root, _dirs, files in os.walk(BLOB_FOLDER):
+        for name in files:
+            path = os.path.join(root, name)
+            if name in known or name in referenced or os.path.getmtime(path) > cutoff:
+                continue
+            freed += os.path.getsize(path)
+            os.remove(path)
+            removed += 1
+    for name in os.listdir(UPLOAD_FOLDER):
+        path = os.path.join(UPLOAD_FOLDER, name)
+        if name.startswith('.upload_') and os.path.getmtime(path) <= cutoff:
+            freed += os.path.getsize(path)
+            os.remove(path)
+            removed += 1
+    return removed, freed
+
+def migrate_uploads_to_blobs(db: Session):
+    """將舊的 proposal_*/closure_* 文件併入內容定址存儲，回傳 (遷移記錄數, 釋放的 bytes)"""
+    migrated, freed = 0, 0
+    blob_prefix = 'blobs' + os.sep
+    for model in (ProposalFile, ClosureFile):
+        for record in db.query(model).all():
+            if record.filename.startswith(blob_prefix):
+                continue
+            path = os.path.join(UPLOAD_FOLDER, record.filename)
+            if not os.path.exists(path):
+                print(f"✗ 找不到文件，略過: {record.filename}")
+                continue
+            
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+            checksum = digest.hexdigest()
+            size = os.path.getsize(path)
+            
+            if os.path.exists(os.path.join(UPLOAD_FOLDER, blob_path(checksum))):
+                freed += size
+            record.filename = _place_blob(path, checksum)
+            record.file_size = size
+            record.checksum = checksum
+            acquire_blob(db, checksum, size)
+            db.commit()
+            migrated += 1
+    return migrated, freed
+
+def detect_media_type(filepath: str, original_filename: str):
+    """依原始文件名判斷 Content-Type，無法判斷時檢查文件開頭的魔數"""
+    media_type = mimetypes.guess_type(original_filename)[0]
+    if media_type:
+        return media_type
+    with open(filepath, 'rb') as f:
+        head = f.read(8)
+    if head.startswith(b'%PDF'):
+        return 'application/pdf'
+    if head.startswith(b'PK\x03\x04'):
+        return 'application/zip'
+    return 'application/octet-stream'
+
+def parse_range_header(range_header: str, size: int):
+    """解析單一區段的 Range 標頭，回傳 (start, end)（含 end）
+    
+    不是 bytes 單位或包含多個區段時回傳 None（改為回傳完整文件）；無法滿足時拋出 416。
+    """
+    unit, _, spec = range_header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    start_str, _, end_str = spec.strip().partition('-')
+    try:
+        if start_str:
+            start = int(start_str)
+            end = int(end_str) if end_str else size - 1
+        else:
+            # bytes=-N 表示最後 N 個 bytes
+            length = int(end_str)
+            if length <= 0:
+                raise ValueError
+            start, end = max(0, size - length), size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={'Content-Range': f'bytes */{size}'}
+        )
+    return start, min(end, size - 1)
+
+def _iter_file_range(filepath: str, start: int, end: int):
+    with open(filepath, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(UPLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+MESSAGE_PAGE_MAX = 200  # 單次訊息分頁的上限
+
+def encode_message_cursor(message: Message):
+    """訊息分頁游標：(created_at, id)"""
+    return f"{message.created_at.isoformat()}_{message.id}"
+
+def decode_message_cursor(cursor: str):
+    try:
+        created_at, _, message_id = cursor.rpartition('_')
+        return datetime.fromisoformat(created_at), int(message_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+AVAILABLE_PROJECTS_PAGE_DEFAULT = 50  # 市場列表預設每頁筆數
+AVAILABLE_PROJECTS_PAGE_MAX = 200
+AVAILABLE_PROJECTS_SORTS = ('newest', 'deadline')
+
+def encode_project_cursor(project: Project, sort: str):
+    """市場列表分頁游標：newest 為 (created_at, id)，deadline 為 (deadline, id)，無期限時 deadline 留空"""
+    value = project.created_at if sort == 'newest' else project.deadline
+    return f"{value.isoformat() if value else ''}_{project.id}"
+
+def decode_project_cursor(cursor: str):
+    try:
+        value, _, project_id = cursor.rpartition('_')
+        return (datetime.fromisoformat(value) if value else None), int(project_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def parse_datetime_param(value: Optional[str], name: str):
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name} format")
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -294,57 +1484,1094 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(request: Request, db: Session = Depends(get_db)):
-    token = request.cookies.get("access_token")
-    if not token:
-        return None
+### 新增功能：已驗證用戶快取 ###
+AUTH_CACHE_TTL = float(os.environ.get('AUTH_CACHE_TTL', 60))  # 秒，0 表示停用快取
+AUTH_CACHE_SIZE = int(os.environ.get('AUTH_CACHE_SIZE', 10000))
+# 啟用後直接信任 token 內簽名的 username / role，不查數據庫；角色變更要等 token 過期才生效
+AUTH_TRUST_TOKEN_CLAIMS = os.environ.get('AUTH_TRUST_TOKEN_CLAIMS', '0') == '1'
+
+class UserPrincipal(NamedTuple):
+    """已驗證用戶的輕量表示；路由只使用 id、username 與 role"""
+    id: int
+    username: str
+    role: str
+
+class TTLCache:
+    """執行緒安全的 TTL + LRU 快取"""
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+    
+    def set(self, key, value, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._items[key] = (value, time.monotonic() + ttl)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+    
+    def pop(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+    
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+    
+    def __len__(self):
+        return len(self._items)
+
+token_cache = TTLCache(AUTH_CACHE_TTL, AUTH_CACHE_SIZE)  # token -> 已驗證的 payload
+principal_cache = TTLCache(AUTH_CACHE_TTL, AUTH_CACHE_SIZE)  # user_id -> UserPrincipal
+
+def invalidate_user(user_id: int):
+    """用戶資料或角色變更時清除快取（只影響目前的進程，其他進程最多延遲 AUTH_CACHE_TTL 秒）"""
+    principal_cache.pop(user_id)
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _invalidate_cached_user(mapper, connection, target):
+    # flush 時先清除；commit 之前其他請求仍會讀到舊的行並重新快取，所以 commit 之後再清除一次
+    invalidate_user(target.id)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('changed_user_ids', set()).add(target.id)
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed_users(session):
+    for user_id in session.info.pop('changed_user_ids', ()):
+        invalidate_user(user_id)
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changed_users(session):
+    session.info.pop('changed_user_ids', None)
+
+def decode_access_token(token: str):
+    """驗證並解碼 JWT，結果依 token 快取到其過期時間為止"""
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: int = payload.get("user_id")
-        if user_id is None:
-            return None
     except JWTError:
         return None
-    user = db.query(User).filter(User.id == user_id).first()
-    return user
+    expires_in = payload.get('exp', 0) - time.time()
+    token_cache.set(token, payload, ttl=expires_in)
+    return payload
+
+def load_user_principal(user_id: int):
+    """從數據庫讀取用戶並放入快取（使用短暫的 session，快取命中時不需要連線）"""
+    db = SessionLocal()
+    try:
+        row = db.query(User.id, User.username, User.role).filter(User.id == user_id).first()
+    finally:
+        db.close()
+    if row is None:
+        return None
+    principal = UserPrincipal(*row)
+    principal_cache.set(user_id, principal)
+    return principal
 
-def require_auth(current_user: Optional[User] = Depends(get_current_user)):
+async def get_current_user(request: Request):
+    token = request.cookies.get("access_token")
+    if not token:
+        return None
+    payload = decode_access_token(token)
+    if payload is None:
+        return None
+    user_id = payload.get("user_id")
+    if user_id is None:
+        return None
+    if AUTH_TRUST_TOKEN_CLAIMS and payload.get("username") and payload.get("role"):
+        return UserPrincipal(user_id, payload["username"], payload["role"])
+    principal = principal_cache.get(user_id)
+    if principal is None:
+        principal = await run_in_threadpool(load_user_principal, user_id)
+    return principal
+
+# 以下依賴不做 I/O，宣告為 async 以免每個請求多一次線程切換
+async def require_auth(current_user: Optional[UserPrincipal] = Depends(get_current_user)):
     if current_user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
     return current_user
 
 def require_role(role: str):
-    def role_checker(current_user: User = Depends(require_auth)):
+    async def role_checker(current_user: UserPrincipal = Depends(require_auth)):
         if current_user.role != role:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
         return current_user
     return role_checker
 
+### 新增功能：列表路由的回應快取 ###
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 5000))  # 0 表示停用
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+class LocalCacheBackend:
+    """進程內的快取後端：LRU，依筆數與總位元組數淘汰
+    
+    共享後端（例如 Redis）只需提供相同的 get / set / versions / bump 方法。
+    每個標籤有一個版本號，寫入時遞增；快取項目記錄建立時的標籤版本，版本不同即視為失效。
+    """
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._versions = {}
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            self._entries.move_to_end(key)
+            return item[0]
+    
+    def set(self, key, value, size: int):
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+    
+    def versions(self, tags):
+        with self._lock:
+            return tuple(self._versions.get(tag, 0) for tag in tags)
+    
+    def bump(self, tags):
+        with self._lock:
+            for tag in tags:
+                self._versions[tag] = self._versions.get(tag, 0) + 1
+    
+    def stats(self):
+        return {'entries': len(self._entries), 'bytes': self._bytes, 'evictions': self.evictions}
+
+class ResponseCache:
+    """以 (路由, 用戶, 參數) 為鍵快取已序列化的 JSON 與其 ETag，並記錄命中率"""
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.invalidations = 0
+    
+    def get(self, key, tags):
+        entry = self.backend.get(key)
+        if entry is not None and entry['versions'] == self.backend.versions(tags):
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+    
+    def versions(self, tags):
+        return self.backend.versions(tags)
+    
+    def store(self, key, versions, body: bytes):
+        entry = {
+            'versions': versions,
+            'body': body,
+            'etag': '"{}"'.format(hashlib.blake2b(body, digest_size=16).hexdigest())
+        }
+        self.backend.set(key, entry, len(body))
+        return entry
+    
+    def invalidate(self, *tags):
+        self.invalidations += 1
+        self.backend.bump(tags)
+    
+    def stats(self):
+        return dict(self.backend.stats(), hits=self.hits, misses=self.misses,
+                    not_modified=self.not_modified, invalidations=self.invalidations)
+
+class SharedVersionCacheBackend(LocalCacheBackend):
+    """多 worker 部署用：快取內容仍在各進程記憶體中，標籤版本改存 cache_tag_version 表
+    
+    每次命中多一次主鍵查詢，但任一 worker 寫入後，所有 worker 都不會再回傳舊內容。
+    """
+    def versions(self, tags):
+        with engine.connect() as conn:
+            rows = dict(conn.execute(
+                select(CacheTagVersion.tag, CacheTagVersion.version).where(CacheTagVersion.tag.in_(tags))
+            ).all())
+        return tuple(rows.get(tag, 0) for tag in tags)
+    
+    def bump(self, tags):
+        if not tags:
+            return
+        stmt = sqlite_insert(CacheTagVersion).values([{'tag': tag, 'version': 1} for tag in tags])
+        stmt = stmt.on_conflict_do_update(index_elements=['tag'], set_={'version': CacheTagVersion.version + 1})
+        with engine.begin() as conn:
+            conn.execute(stmt)
+
+response_cache = ResponseCache(
+    (SharedVersionCacheBackend if APP_WORKERS > 1 else LocalCacheBackend)(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_MAX_BYTES)
+)
+
+def user_lists_tag(user_id: int):
+    """用戶自己的列表：/api/projects、/api/my_projects、/api/history"""
+    return f'user:{user_id}'
+
+def closure_files_tag(project_id: int):
+    return f'project:{project_id}:closure_files'
+
+def invalidate_project_responses(project_id: int, user_ids):
+    """專案或其相關數據變更後（commit 之後呼叫）清除相關用戶列表與結案文件列表的快取"""
+    tags = [closure_files_tag(project_id)]
+    tags.extend(user_lists_tag(uid) for uid in user_ids if uid)
+    response_cache.invalidate(*tags)
+
+def etag_matches(if_none_match: Optional[str], etag: str):
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+
+def cached_json_response(request: Request, key: str, tags, build):
+    """回傳快取的 JSON；未命中時呼叫 build() 產生內容。ETag 相符時直接回傳 304，不需序列化"""
+    entry = response_cache.get(key, tags)
+    if entry is None:
+        # 先取版本再查詢：查詢期間若有寫入，版本不符，下次請求會重新產生
+        versions = response_cache.versions(tags)
+        body = dump_json(build())
+        entry = response_cache.store(key, versions, body)
+    headers = {'ETag': entry['etag'], 'Cache-Control': 'private, no-cache'}
+    if etag_matches(request.headers.get('if-none-match'), entry['etag']):
+        response_cache.not_modified += 1
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry['body'], media_type='application/json', headers=headers)
+
+### 新增功能：Prometheus 格式的監控指標 ###
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # 設定後 /metrics 需要 Authorization: Bearer <token>
+METRICS_DIR = os.environ.get('METRICS_DIR')  # 多 worker 時由 serve.py 設定，各 worker 把快照寫到這裡彙總
+METRICS_FLUSH_INTERVAL = 5  # 秒
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+class MetricsRegistry:
+    """輕量的指標登錄表：counter / gauge / histogram，輸出 Prometheus 文字格式
+    
+    標籤以固定順序的 tuple 傳入；histogram 保存各 bucket 的非累計次數，輸出時才累加。
+    """
+    def __init__(self):
+        self._meta = {}  # 名稱 -> (類型, 說明, 標籤名稱, buckets)
+        self._values = {}  # 名稱 -> {標籤值: 數值 或 [各 bucket 次數..., 總和, 次數]}
+        self._lock = threading.Lock()
+    
+    def define(self, kind: str, name: str, help_text: str, labels=(), buckets=None):
+        self._meta[name] = (kind, help_text, tuple(labels), buckets)
+        self._values[name] = {}
+    
+    def inc(self, name: str, labels=(), amount=1):
+        with self._lock:
+            values = self._values[name]
+            values[labels] = values.get(labels, 0) + amount
+    
+    def kind(self, name: str):
+        return self._meta[name][0] if name in self._meta else None
+    
+    def set(self, name: str, labels=(), value=0):
+        with self._lock:
+            self._values[name][labels] = value
+    
+    def observe(self, name: str, labels, value):
+        buckets = self._meta[name][3]
+        with self._lock:
+            values = self._values[name]
+            series = values.get(labels)
+            if series is None:
+                series = values[labels] = [0] * (len(buckets) + 3)
+            series[bisect.bisect_left(buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+    
+    def snapshot(self):
+        with self._lock:
+            return {name: [[list(labels), value if isinstance(value, (int, float)) else list(value)]
+                           for labels, value in values.items()]
+                    for name, values in self._values.items()}
+    
+    def render(self, snapshots):
+        """合併多個快照（各 worker）並輸出 Prometheus 文字格式；gauge 與 counter 都以加總合併"""
+        merged = {}
+        for snapshot in snapshots:
+            for name, series in snapshot.items():
+                if name not in self._meta:
+                    continue
+                target = merged.setdefault(name, {})
+                for labels, value in series:
+                    key = tuple(labels)
+                    if isinstance(value, list):
+                        current = target.setdefault(key, [0] * len(value))
+                        for i, v in enumerate(value):
+                            current[i] += v
+                    else:
+                        target[key] = target.get(key, 0) + value
+        lines = []
+        for name, (kind, help_text, label_names, buckets) in self._meta.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in sorted(merged.get(name, {}).items()):
+                pairs = [f'{k}="{_escape_label(v)}"' for k, v in zip(label_names, labels)]
+                if kind != 'histogram':
+                    lines.append(f'{name}{_format_labels(pairs)} {_format_number(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(buckets) + ['+Inf'], value[:-2]):
+                    cumulative += count
+                    le = 'le="{}"'.format(bound if bound == '+Inf' else _format_number(bound))
+                    lines.append(f'{name}_bucket{_format_labels(pairs + [le])} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(pairs)} {_format_number(value[-2])}')
+                lines.append(f'{name}_count{_format_labels(pairs)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(pairs):
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+metrics = MetricsRegistry()
+metrics.define('counter', 'http_requests_total', 'HTTP requests by route and status', ('method', 'route', 'status'))
+metrics.define('histogram', 'http_request_duration_seconds', 'HTTP request latency', ('method', 'route'), LATENCY_BUCKETS)
+metrics.define('gauge', 'http_requests_in_flight', 'HTTP requests currently being handled')
+metrics.define('counter', 'http_request_body_bytes_total', 'Request body bytes received (uploads on the upload routes)', ('route',))
+metrics.define('counter', 'http_response_body_bytes_total', 'Response body bytes sent (downloads on /api/files/{file_id}/download)', ('route',))
+metrics.define('histogram', 'http_request_db_queries', 'Database queries per request', ('route',), DB_QUERY_BUCKETS)
+metrics.define('histogram', 'http_request_db_seconds', 'Database time per request', ('route',), LATENCY_BUCKETS)
+metrics.define('counter', 'db_queries_total', 'Database queries executed')
+metrics.define('counter', 'db_query_seconds_total', 'Time spent executing database queries')
+metrics.define('gauge', 'password_hash_pool_pending', 'Password hash tasks queued or running')
+metrics.define('gauge', 'password_hash_pool_workers', 'Password hash worker threads')
+metrics.define('counter', 'password_hash_rejected_total', 'Password hash tasks rejected with 503 because the pool was full')
+metrics.define('gauge', 'sse_subscribers', 'Open Server-Sent Events streams')
+metrics.define('gauge', 'auth_cache_entries', 'Cached authenticated users')
+metrics.define('counter', 'response_cache_requests_total', 'Response cache lookups by result', ('result',))
+metrics.define('gauge', 'response_cache_bytes', 'Bytes held by the response cache')
+
+class RequestStats:
+    __slots__ = ('db_queries', 'db_seconds')
+    
+    def __init__(self):
+        self.db_queries = 0
+        self.db_seconds = 0.0
+
+# 目前請求的數據庫統計；線程池會複製 context，路由中的查詢也會記到同一個物件
+current_request_stats = contextvars.ContextVar('current_request_stats', default=None)
+
+@event.listens_for(engine, 'before_cursor_execute')
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    if METRICS_ENABLED or QUERY_TRACE or query_captures:
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(engine, 'after_cursor_execute')
+def _record_query_time(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    if METRICS_ENABLED:
+        metrics.inc('db_queries_total')
+        metrics.inc('db_query_seconds_total', (), elapsed)
+        stats = current_request_stats.get()
+        if stats is not None:
+            stats.db_queries += 1
+            stats.db_seconds += elapsed
+    if QUERY_TRACE or query_captures:
+        trace_query(statement, elapsed)
+
+@event.listens_for(engine, 'handle_error')
+def _discard_query_timer(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_started'):
+        connection.info['query_started'].pop()
+
+class MetricsMiddleware:
+    """ASGI middleware：記錄每個路由的請求數、延遲、進行中請求數、傳輸位元組與數據庫查詢"""
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = current_request_stats.set(stats)
+        status_code = 500
+        received = 0
+        sent = 0
+        
+        async def receive_wrapper():
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+            return message
+        
+        async def send_wrapper(message):
+            nonlocal status_code, sent
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            elif message['type'] == 'http.response.body':
+                sent += len(message.get('body', b''))
+            await send(message)
+        
+        metrics.inc('http_requests_in_flight')
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            metrics.inc('http_requests_in_flight', (), -1)
+            current_request_stats.reset(token)
+            route = scope.get('route')
+            if route is not None:
+                path = route.path
+            elif scope['path'].startswith('/static/'):
+                path = '/static'
+            else:
+                path = 'unmatched'  # 不以原始路徑作為標籤，避免標籤數量無限增長
+            method = scope['method']
+            metrics.inc('http_requests_total', (method, path, str(status_code)))
+            metrics.observe('http_request_duration_seconds', (method, path), duration)
+            metrics.observe('http_request_db_queries', (path,), stats.db_queries)
+            metrics.observe('http_request_db_seconds', (path,), stats.db_seconds)
+            if received:
+                metrics.inc('http_request_body_bytes_total', (path,), received)
+            if sent:
+                metrics.inc('http_response_body_bytes_total', (path,), sent)
+
+def collect_runtime_metrics():
+    """在輸出前更新由其他元件維護的數值"""
+    metrics.set('password_hash_pool_pending', (), password_hash_pool.pending)
+    metrics.set('password_hash_pool_workers', (), password_hash_pool.workers)
+    metrics.set('password_hash_rejected_total', (), password_hash_pool.rejected)
+    metrics.set('sse_subscribers', (), event_broker.subscriber_count())
+    metrics.set('auth_cache_entries', (), len(principal_cache))
+    cache_stats = response_cache.stats()
+    for result in ('hits', 'misses', 'not_modified'):
+        metrics.set('response_cache_requests_total', (result,), cache_stats[result])
+    metrics.set('response_cache_bytes', (), cache_stats['bytes'])
+
+def write_metrics_snapshot():
+    """把本進程的指標寫到 METRICS_DIR/<pid>.json（先寫臨時文件再改名，讀取端不會看到寫一半的文件）"""
+    collect_runtime_metrics()
+    path = os.path.join(METRICS_DIR, f'{os.getpid()}.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(metrics.snapshot(), f)
+    os.replace(path + '.tmp', path)
+
+def _pid_alive(pid: int):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def gather_metrics_snapshots():
+    """單進程時只有自己的快照；多 worker 時讀取所有 worker 的快照。
+    
+    已結束的 worker 只保留 counter 與 histogram（總數不倒退），gauge 只計入仍在運行的 worker。
+    """
+    if not METRICS_DIR:
+        collect_runtime_metrics()
+        return [metrics.snapshot()]
+    write_metrics_snapshot()
+    snapshots = []
+    for filename in os.listdir(METRICS_DIR):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, filename)) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if not _pid_alive(int(filename[:-5])):
+            snapshot = {name: series for name, series in snapshot.items() if metrics.kind(name) != 'gauge'}
+        snapshots.append(snapshot)
+    return snapshots
+
+async def flush_metrics_periodically():
+    """多 worker 時定期寫出快照，讓其他 worker 回應 /metrics 時包含本進程的數據"""
+    while True:
+        await asyncio.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            await run_in_threadpool(write_metrics_snapshot)
+        except OSError as e:
+            print(f"寫入指標快照失敗: {e}")
+
+### 新增功能：慢查詢與 N+1 查詢偵測 ###
+# QUERY_TRACE=1 記錄慢查詢與疑似 N+1；QUERY_TRACE=debug 另外在回應加上 X-Query-Trace 摘要標頭
+QUERY_TRACE = os.environ.get('QUERY_TRACE', '0') in ('1', 'debug')
+QUERY_TRACE_HEADER = os.environ.get('QUERY_TRACE') == 'debug'
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 5))  # 同一請求中同一語句執行幾次視為 N+1
+
+_IN_LIST_PATTERN = re.compile(r'\(\?(?:, \?)*\)')
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+
+def statement_shape(statement):
+    """語句的形狀：參數已是佔位符，再把 IN (?, ?, ...) 與空白正規化，只差參數的查詢視為同一形狀"""
+    return _WHITESPACE_PATTERN.sub(' ', _IN_LIST_PATTERN.sub('(?)', statement)).strip()
+
+class QueryTrace:
+    """一段期間（一個請求或一個 capture_queries 區塊）內執行的語句"""
+    def __init__(self, name=None, scope=None):
+        self.name = name
+        self.scope = scope
+        self.queries = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+        self.slow = []
+    
+    def record(self, shape, elapsed):
+        self.queries += 1
+        self.seconds += elapsed
+        self.shapes[shape] += 1
+        if elapsed * 1000 >= SLOW_QUERY_MS:
+            self.slow.append((shape, elapsed))
+    
+    @property
+    def label(self):
+        """請求的路由樣板（如 GET /api/projects/{project_id}）；路由匹配前則用原始路徑"""
+        if self.scope is None:
+            return self.name
+        route = self.scope.get('route')
+        return f"{self.scope['method']} {route.path if route is not None else self.scope['path']}"
+    
+    def repeated(self, threshold=None):
+        """疑似 N+1 的語句：[(shape, 次數)]，次數多的在前"""
+        threshold = N_PLUS_ONE_THRESHOLD if threshold is None else threshold
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+    
+    def summary(self):
+        max_repeat = self.shapes.most_common(1)[0][1] if self.shapes else 0
+        return f'queries={self.queries}, db_ms={self.seconds * 1000:.1f}, max_repeat={max_repeat}, slow={len(self.slow)}'
+    
+    def report(self):
+        """列出執行次數最多的語句，供斷言失敗時顯示"""
+        lines = [self.summary()]
+        lines += [f'  {count} × {shape[:200]}' for shape, count in self.shapes.most_common(10)]
+        return '\n'.join(lines)
+
+# 目前請求的追蹤（由 QueryTraceMiddleware 設定）與 capture_queries 開啟中的收集器
+current_query_trace = contextvars.ContextVar('current_query_trace', default=None)
+query_captures = []
+
+def trace_query(statement, elapsed):
+    shape = statement_shape(statement)
+    trace = current_query_trace.get()
+    if trace is not None:
+        trace.record(shape, elapsed)
+    for capture in query_captures:
+        capture.record(shape, elapsed)
+    if QUERY_TRACE and elapsed * 1000 >= SLOW_QUERY_MS:
+        label = trace.label if trace is not None else '-'
+        print(f"慢查詢 {elapsed * 1000:.1f}ms [{label}] {shape[:500]}")
+
+@contextmanager
+def capture_queries():
+    """收集區塊內所有線程執行的語句（TestClient 在另一個線程執行應用，所以不依賴 contextvar）
+    
+    with capture_queries() as trace:
+        client.get('/api/projects')
+    print(trace.queries, trace.repeated())
+    """
+    trace = QueryTrace('capture')
+    query_captures.append(trace)
+    try:
+        yield trace
+    finally:
+        query_captures.remove(trace)
+
+@contextmanager
+def assert_max_queries(limit):
+    """區塊內的查詢數超過 limit 時拋出 AssertionError，訊息列出最常執行的語句"""
+    with capture_queries() as trace:
+        yield trace
+    if trace.queries > limit:
+        raise AssertionError(f'預期最多 {limit} 個查詢，實際執行 {trace.queries} 個\n{trace.report()}')
+
+class QueryTraceMiddleware:
+    """ASGI middleware：每個請求一個 QueryTrace，結束時記錄疑似 N+1 的語句"""
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        trace = QueryTrace(scope=scope)
+        token = current_query_trace.set(trace)
+        
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start' and QUERY_TRACE_HEADER:
+                # 串流回應在標頭送出之後的查詢不會計入標頭，但仍會記錄在日誌
+                message['headers'] = list(message.get('headers', [])) + [
+                    (b'x-query-trace', trace.summary().encode('latin-1'))]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_query_trace.reset(token)
+            for shape, count in trace.repeated():
+                print(f"疑似 N+1 查詢 [{trace.label}] 同一語句執行 {count} 次: {shape[:300]}")
+
+### 新增功能：截止期限的背景工作排程 ###
+# 專案到期時由排程工作把狀態改為 awaiting_selection（已有報價）或 expired（沒有報價），
+# 並預先計算報價的推薦名單；列表與搜尋只需過濾有索引的 status，不必在每個請求比較 deadline。
+# 工作保存在 scheduled_job 表，與專案在同一交易中寫入，進程重啟後不會遺失。
+JOB_SCHEDULER_ENABLED = os.environ.get('JOB_SCHEDULER', '1') == '1'  # 設為 0 時改由 python manage.py run-jobs 執行
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 30))  # 秒，沒有更早到期的工作時最長的等待時間
+JOB_LEASE_SECONDS = 60  # 領取後超過此時間仍未完成的工作視為執行者已中斷，可被重新領取
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_BACKOFF = 5  # 秒，每次失敗後加倍
+JOB_BATCH_SIZE = 100
+SHORTLIST_SIZE = int(os.environ.get('SHORTLIST_SIZE', 3))
+DEADLINE_JOB = 'project_deadline'
+
+def schedule_job(db, kind: str, target_id: int, run_at: Optional[datetime]):
+    """建立或覆寫工作（在呼叫端的交易中執行，commit 之後再呼叫 job_scheduler.wake()）；run_at 為 None 時取消"""
+    table = ScheduledJob.__table__
+    if run_at is None:
+        db.execute(table.delete().where(table.c.kind == kind, table.c.target_id == target_id))
+        return
+    now = datetime.utcnow()
+    stmt = sqlite_insert(table).values(kind=kind, target_id=target_id, run_at=run_at, status='queued',
+                                       attempts=0, created_at=now, updated_at=now)
+    db.execute(stmt.on_conflict_do_update(index_elements=['kind', 'target_id'], set_={
+        'run_at': run_at, 'status': 'queued', 'attempts': 0, 'locked_until': None, 'last_error': None, 'updated_at': now
+    }))
+
+def schedule_pending_deadlines(conn):
+    """為尚未排程、有截止期限的 pending 專案建立工作（遷移與批次匯入後使用），回傳新增的筆數"""
+    now = datetime.utcnow()
+    rows = select(
+        literal(DEADLINE_JOB), Project.id, Project.deadline, literal('queued'), literal(0),
+        literal(now, DateTime), literal(now, DateTime)
+    ).where(Project.status == 'pending', Project.deadline.isnot(None))
+    stmt = sqlite_insert(ScheduledJob.__table__).from_select(
+        ['kind', 'target_id', 'run_at', 'status', 'attempts', 'created_at', 'updated_at'], rows
+    ).on_conflict_do_nothing(index_elements=['kind', 'target_id'])
+    return conn.execute(stmt).rowcount
+
+def _due_job_condition(now: datetime):
+    table = ScheduledJob.__table__
+    return or_(
+        and_(table.c.status == 'queued', table.c.run_at <= now),
+        and_(table.c.status == 'running', table.c.locked_until < now),
+    )
+
+def claim_due_jobs(limit: int = JOB_BATCH_SIZE):
+    """以單一條件式 UPDATE 領取到期的工作；多個進程同時領取時每筆工作只會被其中一個取得"""
+    table = ScheduledJob.__table__
+    now = datetime.utcnow()
+    due = select(table.c.id).where(_due_job_condition(now)).order_by(table.c.run_at).limit(limit)
+    with engine.begin() as conn:
+        return conn.execute(
+            table.update().where(table.c.id.in_(due.scalar_subquery()), _due_job_condition(now)).values(
+                status='running', attempts=table.c.attempts + 1,
+                locked_until=now + timedelta(seconds=JOB_LEASE_SECONDS), updated_at=now
+            ).returning(table.c.id, table.c.kind, table.c.target_id, table.c.run_at, table.c.attempts)
+        ).all()
+
+def _finish_job(job, error: Optional[Exception]):
+    # 執行期間工作被重新排程（run_at 改變）或取消時不覆寫
+    table = ScheduledJob.__table__
+    now = datetime.utcnow()
+    values = {'status': 'done', 'locked_until': None, 'last_error': None, 'updated_at': now}
+    if error is not None:
+        values.update(last_error=f'{type(error).__name__}: {error}'[:1000], locked_until=None)
+        if job.attempts >= JOB_MAX_ATTEMPTS:
+            values['status'] = 'failed'
+        else:
+            values.update(status='queued', run_at=now + timedelta(seconds=JOB_RETRY_BACKOFF * 2 ** (job.attempts - 1)))
+    with engine.begin() as conn:
+        conn.execute(table.update().where(
+            table.c.id == job.id, table.c.status == 'running', table.c.run_at == job.run_at
+        ).values(**values))
+
+def run_job(job):
+    handler = JOB_HANDLERS.get(job.kind)
+    error = None
+    db = SessionLocal()
+    try:
+        if handler is None:
+            raise LookupError(f"Unknown job kind {job.kind}")
+        handler(db, job.target_id)
+    except Exception as e:
+        db.rollback()
+        error = e
+        print(f"背景工作 {job.kind} #{job.target_id} 失敗（第 {job.attempts} 次）: {e}")
+    finally:
+        db.close()
+    _finish_job(job, error)
+    return error is None
+
+def run_due_jobs(limit: int = JOB_BATCH_SIZE):
+    """執行所有已到期的工作，回傳執行的筆數"""
+    count = 0
+    while True:
+        jobs = claim_due_jobs(limit)
+        for job in jobs:
+            run_job(job)
+        count += len(jobs)
+        if len(jobs) < limit:
+            return count
+
+def seconds_until_next_job(max_wait: float = JOB_POLL_INTERVAL):
+    table = ScheduledJob.__table__
+    with engine.connect() as conn:
+        next_run = conn.execute(select(func.min(table.c.run_at)).where(table.c.status == 'queued')).scalar()
+        lease_end = conn.execute(select(func.min(table.c.locked_until)).where(table.c.status == 'running')).scalar()
+    wait = max_wait
+    for moment in (next_run, lease_end):
+        if moment is not None:
+            wait = min(wait, (moment - datetime.utcnow()).total_seconds())
+    return max(0.0, wait)
+
+def rank_quotes(quotes, db: Session):
+    """推薦順序：乙方評價高者優先，同分時金額低、較早提交者優先"""
+    ratings = get_users_rating_stats((q.recipient_id for q in quotes), db)
+    return sorted(quotes, key=lambda q: (-ratings[q.recipient_id]['average'], q.amount, q.created_at, q.id))
+
+def expire_project_deadline(db: Session, project_id: int):
+    """截止期限到達：有報價的專案等待甲方選擇受託人，沒有報價的專案標記為過期；重複執行不會有副作用"""
+    # 先以條件式 UPDATE 取得寫入鎖，避免與同時選擇受託人的請求互相覆寫
+    claimed = db.execute(Project.__table__.update().where(
+        Project.id == project_id, Project.status == 'pending', Project.deadline.isnot(None)
+    ).values(updated_at=datetime.utcnow())).rowcount
+    if not claimed:
+        return
+    project = db.query(Project).filter(Project.id == project_id).first()
+    if project.deadline > datetime.utcnow():
+        # 期限已被延後（例如直接修改數據庫）：依新的期限重新排程
+        schedule_job(db, DEADLINE_JOB, project_id, project.deadline)
+        db.commit()
+        return
+    
+    quotes = db.query(Quote).filter(Quote.project_id == project_id).all()
+    shortlist = [q.id for q in rank_quotes(quotes, db)[:SHORTLIST_SIZE]]
+    for quote in quotes:
+        quote.shortlist_rank = shortlist.index(quote.id) + 1 if quote.id in shortlist else None
+    project.status = 'awaiting_selection' if quotes else 'expired'
+    new_status, delegator_id = project.status, project.delegator_id
+    db.commit()
+    
+    # 甲方與所有報價的乙方
+    invalidate_project_responses(project_id, [delegator_id] + [q.recipient_id for q in quotes])
+    publish_project_event(project_id, 'project.deadline_passed', {
+        'status': new_status, 'quote_count': len(quotes), 'shortlist': shortlist
+    })
+
+### 新增功能：刪除專案後的存儲回收與保留期限 ###
+# 刪除專案時串聯刪除報價、訊息與文件記錄，引用計數在同一交易中減少（_release_deleted_file_blob）；
+# 內容文件由背景工作分批回收，請求不需要等待刪除文件。
+BLOB_REAP_BATCH_SIZE = 500
+REAP_BLOBS_JOB = 'reap_blobs'
+CLOSURE_RETENTION_DAYS = int(os.environ.get('CLOSURE_RETENTION_DAYS', 0))  # 0 為停用
+CLOSURE_RETENTION_INTERVAL = timedelta(days=1)
+RETENTION_JOB = 'closure_retention'
+
+def schedule_blob_reaper(db):
+    """在呼叫端的交易中排程內容回收（commit 之後再呼叫 job_scheduler.wake()）"""
+    schedule_job(db, REAP_BLOBS_JOB, 0, datetime.utcnow())
+
+def reap_unreferenced_blobs(db: Session, _target_id: int = 0):
+    """刪除一批引用計數歸零的內容記錄與文件，還有剩餘時重新排程自己；回傳 (刪除文件數, 釋放的 bytes)
+    
+    每批是一個短的寫入交易：記錄刪除後、commit 之前移除文件，並發上傳相同內容的請求會等到 commit 後
+    重新建立記錄並放置文件。
+    """
+    table = FileBlob.__table__
+    batch = db.execute(select(table.c.sha256).where(table.c.ref_count <= 0).limit(BLOB_REAP_BATCH_SIZE)).scalars().all()
+    if not batch:
+        return 0, 0
+    proposal_refs = select(func.count()).where(ProposalFile.checksum == table.c.sha256).scalar_subquery()
+    closure_refs = select(func.count()).where(ClosureFile.checksum == table.c.sha256).scalar_subquery()
+    reaped = db.execute(table.delete().where(
+        table.c.sha256.in_(batch), table.c.ref_count <= 0, proposal_refs == 0, closure_refs == 0
+    ).returning(table.c.sha256, table.c.size)).all()
+    removed, freed = 0, 0
+    for checksum, size in reaped:
+        try:
+            os.remove(os.path.join(UPLOAD_FOLDER, blob_path(checksum)))
+        except FileNotFoundError:
+            continue
+        removed += 1
+        freed += size
+    # 引用計數與記錄不一致（仍被引用）的內容依實際引用數修正，下一批不會再選到
+    kept = set(batch) - {row.sha256 for row in reaped}
+    if kept:
+        db.execute(table.update().where(table.c.sha256.in_(kept)).values(ref_count=proposal_refs + closure_refs))
+    if len(batch) == BLOB_REAP_BATCH_SIZE:
+        schedule_blob_reaper(db)
+    db.commit()
+    return removed, freed
+
+def superseded_closure_files(db: Session, days: int):
+    """超過保留天數、已被新版本取代的結案文件（保留每個專案的最新版本與已接受的版本）"""
+    latest = select(ClosureFile.project_id, func.max(ClosureFile.version).label('version')).group_by(
+        ClosureFile.project_id).subquery()
+    return db.query(ClosureFile).join(latest, latest.c.project_id == ClosureFile.project_id).filter(
+        ClosureFile.version < latest.c.version,
+        ClosureFile.status != 'accepted',
+        ClosureFile.created_at < datetime.utcnow() - timedelta(days=days),
+    )
+
+def apply_closure_retention(db: Session, days: int, dry_run: bool = False):
+    """刪除過期的舊版本結案文件並排程內容回收，回傳 (刪除記錄數, 記錄的 bytes)"""
+    files = superseded_closure_files(db, days).all()
+    total = sum(f.file_size or 0 for f in files)
+    if dry_run or not files:
+        return len(files), total
+    project_ids = {f.project_id for f in files}
+    for closure_file in files:
+        db.delete(closure_file)
+    schedule_blob_reaper(db)
+    db.commit()
+    for project_id in project_ids:
+        invalidate_project_responses(project_id, [])
+    job_scheduler.wake()
+    return len(files), total
+
+def ensure_retention_job():
+    """啟用保留期限時確保每日工作存在；已排程的不會被提前，已結束或失敗的重新排入"""
+    if CLOSURE_RETENTION_DAYS <= 0:
+        return
+    table = ScheduledJob.__table__
+    now = datetime.utcnow()
+    stmt = sqlite_insert(table).values(kind=RETENTION_JOB, target_id=0, run_at=now, status='queued',
+                                       attempts=0, created_at=now, updated_at=now)
+    with engine.begin() as conn:
+        conn.execute(stmt.on_conflict_do_update(
+            index_elements=['kind', 'target_id'],
+            set_={'run_at': now, 'status': 'queued', 'attempts': 0, 'last_error': None, 'updated_at': now},
+            where=table.c.status.in_(['done', 'failed']),
+        ))
+
+def run_closure_retention(db: Session, _target_id: int = 0):
+    """每日執行的保留期限清理；停用（CLOSURE_RETENTION_DAYS=0）後不再重新排程"""
+    if CLOSURE_RETENTION_DAYS <= 0:
+        return
+    apply_closure_retention(db, CLOSURE_RETENTION_DAYS)
+    schedule_job(db, RETENTION_JOB, 0, datetime.utcnow() + CLOSURE_RETENTION_INTERVAL)
+    db.commit()
+
+JOB_HANDLERS = {
+    DEADLINE_JOB: expire_project_deadline,
+    REAP_BLOBS_JOB: reap_unreferenced_blobs,
+    RETENTION_JOB: run_closure_retention,
+}
+
+class JobScheduler:
+    """進程內排程器：等到最早的 run_at（最長 poll_interval 秒，或被 wake() 提前喚醒），再到線程池執行到期的工作
+    
+    多 worker 時每個 worker 都會執行排程器；領取工作是條件式 UPDATE，同一筆工作只會執行一次。
+    """
+    def __init__(self, poll_interval: float = JOB_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self._loop = None
+        self._wakeup = None
+        self._task = None
+    
+    def start(self):
+        """在事件循環中呼叫"""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+    
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+    
+    def wake(self):
+        """有新的或提前的工作時呼叫；可以在任何線程呼叫（路由函數在線程池中執行）"""
+        loop = self._loop
+        if self._task is None or loop is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(self._wakeup.set)
+    
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                await run_in_threadpool(run_due_jobs)
+                delay = await run_in_threadpool(seconds_until_next_job, self.poll_interval)
+            except OperationalError as e:
+                print(f"執行背景工作失敗: {e}")
+                delay = self.poll_interval
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+job_scheduler = JobScheduler()
+
+### 各模型回應格式的序列化函數（datetime 保持原樣，由 FastJSONResponse 編碼） ###
+def serialize_project_summary(p: Project, quote_count: int):
+    """甲方的專案列表"""
+    return {
+        'id': p.id,
+        'title': p.title,
+        'description': p.description,
+        'status': p.status,
+        'delegate_id': p.delegate_id,
+        'delegate_name': p.delegate.username if p.delegate else None,
+        'deadline': p.deadline,
+        'created_at': p.created_at,
+        'quote_count': quote_count
+    }
+
+def serialize_project_detail(p: Project):
+    return {
+        'id': p.id,
+        'title': p.title,
+        'description': p.description,
+        'status': p.status,
+        'deadline': p.deadline
+    }
+
+def serialize_market_project(p: Project, delegator_rating, has_quoted: bool, quote_count: int):
+    """乙方可報價的專案"""
+    return {
+        'id': p.id,
+        'title': p.title,
+        'description': p.description,
+        'delegator_name': p.delegator.username,
+        'delegator_rating': delegator_rating, # 評價數據
+        'deadline': p.deadline,
+        'created_at': p.created_at,
+        'has_quoted': has_quoted,
+        'quote_count': quote_count
+    }
+
+def serialize_assigned_project(p: Project):
+    """乙方承接的專案"""
+    return {
+        'id': p.id,
+        'title': p.title,
+        'description': p.description,
+        'status': p.status,
+        'delegator_name': p.delegator.username,
+        'created_at': p.created_at
+    }
+
+def serialize_history_project(p: Project):
+    return {
+        'id': p.id,
+        'title': p.title,
+        'description': p.description,
+        'status': p.status,
+        'delegate_name': p.delegate.username if p.delegate else None,
+        'delegator_name': p.delegator.username,
+        'created_at': p.created_at,
+        'completed_at': p.updated_at
+    }
+
+def serialize_proposal_file(f: ProposalFile):
+    return {
+        'id': f.id,
+        'original_filename': f.original_filename,
+        'filename': f.filename,
+        'created_at': f.created_at
+    }
+
+def serialize_quote(q: Quote, recipient_rating):
+    return {
+        'id': q.id,
+        'recipient_name': q.recipient.username,
+        'recipient_id': q.recipient_id,
+        'recipient_rating': recipient_rating,  # 評價數據
+        'amount': q.amount,
+        'message': q.message,
+        'status': q.status,
+        'shortlist_rank': q.shortlist_rank,
+        'created_at': q.created_at,
+        'proposal_file': serialize_proposal_file(q.proposal_file) if q.proposal_file else None
+    }
+
+def serialize_closure_file(f: ClosureFile):
+    return {
+        'id': f.id,
+        'filename': f.filename,
+        'original_filename': f.original_filename,
+        'version': f.version if f.version is not None else 1,
+        'status': f.status,
+        'uploader_name': f.uploader.username if f.uploader else '未知',
+        'created_at': f.created_at or datetime.utcnow()
+    }
+
+def serialize_message(m: Message):
+    return {
+        'id': m.id,
+        'sender_name': m.sender.username,
+        'sender_id': m.sender_id,
+        'content': m.content,
+        'created_at': m.created_at
+    }
+
 # Routes
-@app.get("/", response_class=HTMLResponse)
+@router.get("/", response_class=HTMLResponse)
 async def index(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
-@app.get("/register", response_class=HTMLResponse)
+@router.get("/register", response_class=HTMLResponse)
 async def register_page(request: Request):
     return templates.TemplateResponse("register.html", {"request": request})
 
-@app.post("/register")
-async def register(request: Request, db: Session = Depends(get_db)):
-    data = await request.json()
+@router.post("/register")
+@retry_on_db_lock
+def register(data: dict = Depends(get_json_body), db: Session = Depends(get_db)):
     username = data.get('username')
     email = data.get('email')
     password = data.get('password')
     role = data.get('role')
     
     if db.query(User).filter(User.username == username).first():
-        return JSONResponse(
+        return FastJSONResponse(
             status_code=400,
             content={'success': False, 'message': 'Username already exists'}
         )
     
     if db.query(User).filter(User.email == email).first():
-        return JSONResponse(
+        return FastJSONResponse(
             status_code=400,
             content={'success': False, 'message': 'Email already exists'}
         )
@@ -352,29 +2579,36 @@ async def register(request: Request, db: Session = Depends(get_db)):
     user = User(
         username=username,
         email=email,
-        password_hash=get_password_hash(password),
+        password_hash=password_hash_pool.run(get_password_hash, password),
         role=role
     )
     db.add(user)
     db.commit()
     
-    return JSONResponse(content={'success': True, 'message': 'Registration successful'})
+    return FastJSONResponse(content={'success': True, 'message': 'Registration successful'})
 
-@app.get("/login", response_class=HTMLResponse)
+@router.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request):
     return templates.TemplateResponse("login.html", {"request": request})
 
-@app.post("/login")
-async def login(request: Request, db: Session = Depends(get_db)):
-    data = await request.json()
+@router.post("/login")
+def login(data: dict = Depends(get_json_body), db: Session = Depends(get_db)):
     username = data.get('username')
     password = data.get('password')
     
     user = db.query(User).filter(User.username == username).first()
     
-    if user and verify_password(password, user.password_hash):
-        access_token = create_access_token(data={"user_id": user.id})
-        response = JSONResponse(content={
+    verified, new_hash = False, None
+    if user:
+        verified, new_hash = password_hash_pool.run(verify_and_update_password, password, user.password_hash)
+    
+    if verified:
+        # 舊格式哈希在登入成功時升級為目前設定的格式
+        if new_hash:
+            user.password_hash = new_hash
+            db.commit()
+        access_token = create_access_token(data={"user_id": user.id, "username": user.username, "role": user.role})
+        response = FastJSONResponse(content={
             'success': True,
             'message': 'Login successful',
             'user': {
@@ -386,44 +2620,40 @@ async def login(request: Request, db: Session = Depends(get_db)):
         response.set_cookie(key="access_token", value=access_token, httponly=True, max_age=86400)
         return response
     
-    return JSONResponse(
+    return FastJSONResponse(
         status_code=401,
         content={'success': False, 'message': 'Invalid username or password'}
     )
 
-@app.get("/logout")
+@router.get("/logout")
 async def logout():
     response = RedirectResponse(url="/")
     response.delete_cookie(key="access_token")
     return response
 
-@app.get("/dashboard", response_class=HTMLResponse)
-async def dashboard(request: Request, current_user: User = Depends(require_auth)):
+@router.get("/dashboard", response_class=HTMLResponse)
+async def dashboard(request: Request, current_user: UserPrincipal = Depends(require_auth)):
     if current_user.role == 'delegator':
         return templates.TemplateResponse("delegator_dashboard.html", {"request": request})
     else:
         return templates.TemplateResponse("recipient_dashboard.html", {"request": request})
 
 # API Routes for Delegators
-@app.get("/api/projects")
-async def get_projects(current_user: User = Depends(require_role("delegator")), db: Session = Depends(get_db)):
-    projects = db.query(Project).filter(Project.delegator_id == current_user.id).all()
-    return [{
-        'id': p.id,
-        'title': p.title,
-        'description': p.description,
-        'status': p.status,
-        'delegate_id': p.delegate_id,
-        'delegate_name': p.delegate.username if p.delegate else None,
-        'deadline': p.deadline.isoformat() if p.deadline else None,
-        'created_at': p.created_at.isoformat(),
-        'quote_count': len(p.quotes)
-    } for p in projects]
+@router.get("/api/projects")
+def get_projects(request: Request, current_user: UserPrincipal = Depends(require_role("delegator")), db: Session = Depends(get_db)):
+    return cached_json_response(request, f'projects:{current_user.id}', [user_lists_tag(current_user.id)],
+                                lambda: _list_projects(current_user, db))
 
-@app.post("/api/projects")
-async def create_project(request: Request, current_user: User = Depends(require_role("delegator")), db: Session = Depends(get_db)):
-    data = await request.json()
-    
+def _list_projects(current_user: UserPrincipal, db: Session):
+    counts = quote_count_subquery()
+    rows = db.query(Project, func.coalesce(counts.c.quote_count, 0)).outerjoin(
+        counts, counts.c.project_id == Project.id
+    ).options(joinedload(Project.delegate)).filter(Project.delegator_id == current_user.id).all()
+    return [serialize_project_summary(p, quote_count) for p, quote_count in rows]
+
+@router.post("/api/projects")
+@retry_on_db_lock
+def create_project(data: dict = Depends(get_json_body), current_user: UserPrincipal = Depends(require_role("delegator")), db: Session = Depends(get_db)):
     # 解析截止日期
     deadline = None
     if data.get('deadline'):
@@ -451,38 +2681,38 @@ async def create_project(request: Request, current_user: User = Depends(require_
         deadline=deadline
     )
     db.add(project)
+    db.flush()
+    if deadline:
+        schedule_job(db, DEADLINE_JOB, project.id, deadline)
     db.commit()
     db.refresh(project)
-    return JSONResponse(content={'success': True, 'project_id': project.id})
+    invalidate_project_responses(project.id, [current_user.id])
+    job_scheduler.wake()
+    return FastJSONResponse(content={'success': True, 'project_id': project.id})
 
-@app.get("/api/projects/{project_id}")
-async def get_project(project_id: int, current_user: User = Depends(require_role("delegator")), db: Session = Depends(get_db)):
+@router.get("/api/projects/{project_id}")
+def get_project(project_id: int, current_user: UserPrincipal = Depends(require_role("delegator")), db: Session = Depends(get_db)):
     project = db.query(Project).filter(Project.id == project_id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     if project.delegator_id != current_user.id:
         raise HTTPException(status_code=403, detail="Forbidden")
     
-    return {
-        'id': project.id,
-        'title': project.title,
-        'description': project.description,
-        'status': project.status,
-        'deadline': project.deadline.isoformat() if project.deadline else None
-    }
+    return FastJSONResponse(content=serialize_project_detail(project))
 
-@app.put("/api/projects/{project_id}")
-async def update_project(project_id: int, request: Request, current_user: User = Depends(require_role("delegator")), db: Session = Depends(get_db)):
+@router.put("/api/projects/{project_id}")
+@retry_on_db_lock
+def update_project(project_id: int, data: dict = Depends(get_json_body), current_user: UserPrincipal = Depends(require_role("delegator")), db: Session = Depends(get_db)):
     project = db.query(Project).filter(Project.id == project_id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     if project.delegator_id != current_user.id:
         raise HTTPException(status_code=403, detail="Forbidden")
     
-    if project.status != 'pending':
+    # 沒有報價而過期的專案可以修改期限後重新開放
+    if project.status not in ('pending', 'expired'):
         raise HTTPException(status_code=400, detail="Cannot modify project that is not pending")
     
-    data = await request.json()
     project.title = data.get('title', project.title)
     project.description = data.get('description', project.description)
     
@@ -507,66 +2737,73 @@ async def update_project(project_id: int, request: Request, current_user: User =
                 raise HTTPException(status_code=400, detail=f"Invalid deadline format: {str(e)}")
         else:
             project.deadline = None
+        if project.status == 'expired' and (project.deadline is None or project.deadline > datetime.utcnow()):
+            project.status = 'pending'
+        if project.status == 'pending':
+            schedule_job(db, DEADLINE_JOB, project.id, project.deadline)
     
     db.commit()
-    return JSONResponse(content={'success': True})
+    invalidate_project_responses(project_id, [project.delegator_id, project.delegate_id])
+    job_scheduler.wake()
+    return FastJSONResponse(content={'success': True})
 
-@app.delete("/api/projects/{project_id}")
-async def delete_project(project_id: int, current_user: User = Depends(require_role("delegator")), db: Session = Depends(get_db)):
+@router.delete("/api/projects/{project_id}")
+@retry_on_db_lock
+def delete_project(project_id: int, current_user: UserPrincipal = Depends(require_role("delegator")), db: Session = Depends(get_db)):
     project = db.query(Project).filter(Project.id == project_id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     if project.delegator_id != current_user.id:
         raise HTTPException(status_code=403, detail="Forbidden")
     
-    db.delete(project)
+    # 報價的乙方也會在列表中看到這個專案
+    participants = {project.delegator_id, project.delegate_id} | {q.recipient_id for q in project.quotes}
+    has_files = bool(project.closure_files or project.proposal_files)
+    schedule_job(db, DEADLINE_JOB, project_id, None)
+    delete_project_messages(db, project_id)
+    db.delete(project)  # 串聯刪除報價與文件記錄
+    if has_files:
+        schedule_blob_reaper(db)
     db.commit()
-    return JSONResponse(content={'success': True})
+    invalidate_project_responses(project_id, participants)
+    if has_files:
+        job_scheduler.wake()
+    return FastJSONResponse(content={'success': True})
 
-@app.get("/api/projects/{project_id}/quotes")
-async def get_quotes(project_id: int, current_user: User = Depends(require_role("delegator")), db: Session = Depends(get_db)):
+@router.get("/api/projects/{project_id}/quotes")
+def get_quotes(project_id: int, current_user: UserPrincipal = Depends(require_role("delegator")), db: Session = Depends(get_db)):
     project = db.query(Project).filter(Project.id == project_id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     if project.delegator_id != current_user.id:
         raise HTTPException(status_code=403, detail="Forbidden")
     
-    quotes = db.query(Quote).filter(Quote.project_id == project_id).all()
+    # 截止後預先計算的推薦名單排在前面
+    quotes = db.query(Quote).options(
+        joinedload(Quote.recipient),
+        joinedload(Quote.proposal_file)
+    ).filter(Quote.project_id == project_id).order_by(
+        Quote.shortlist_rank.is_(None), Quote.shortlist_rank, Quote.id
+    ).all()
     
     ### 新增功能：注入乙方評價數據 ###
-    result = []
-    for q in quotes:
-        stats = get_user_rating_stats(q.recipient_id, db)
-        result.append({
-            'id': q.id,
-            'recipient_name': q.recipient.username,
-            'recipient_id': q.recipient_id,
-            'recipient_rating': stats,  # 評價數據
-            'amount': q.amount,
-            'message': q.message,
-            'status': q.status,
-            'created_at': q.created_at.isoformat(),
-            'proposal_file': {
-                'id': q.proposal_file.id,
-                'original_filename': q.proposal_file.original_filename,
-                'filename': q.proposal_file.filename,
-                'created_at': q.proposal_file.created_at.isoformat()
-            } if q.proposal_file else None
-        })
-    return result
+    ratings = get_users_rating_stats((q.recipient_id for q in quotes), db)
+    return FastJSONResponse(content=[serialize_quote(q, ratings[q.recipient_id]) for q in quotes])
 
-@app.post("/api/projects/{project_id}/select_delegate")
-async def select_delegate(project_id: int, request: Request, current_user: User = Depends(require_role("delegator")), db: Session = Depends(get_db)):
+@router.post("/api/projects/{project_id}/select_delegate")
+@retry_on_db_lock
+def select_delegate(project_id: int, data: dict = Depends(get_json_body), current_user: UserPrincipal = Depends(require_role("delegator")), db: Session = Depends(get_db)):
     project = db.query(Project).filter(Project.id == project_id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     if project.delegator_id != current_user.id:
         raise HTTPException(status_code=403, detail="Forbidden")
+    if project.status not in ('pending', 'awaiting_selection'):
+        raise HTTPException(status_code=400, detail="Project is not open for selection")
     
     if project.deadline and datetime.utcnow() < project.deadline:
         raise HTTPException(status_code=400, detail="Cannot select delegate before deadline")
     
-    data = await request.json()
     quote_id = data.get('quote_id')
     quote = db.query(Quote).filter(Quote.id == quote_id).first()
     if not quote:
@@ -582,10 +2819,17 @@ async def select_delegate(project_id: int, request: Request, current_user: User
     db.query(Quote).filter(and_(Quote.project_id == project_id, Quote.id != quote_id)).update({'status': 'rejected'}, synchronize_session=False)
     
     db.commit()
-    return JSONResponse(content={'success': True})
+    invalidate_project_responses(project_id, [project.delegator_id, project.delegate_id])
+    publish_project_event(project_id, 'delegate.selected', {'quote_id': quote.id, 'delegate_id': project.delegate_id})
+    return FastJSONResponse(content={'success': True})
 
-@app.get("/api/projects/{project_id}/closure_files")
-async def get_closure_files(project_id: int, current_user: User = Depends(require_auth), db: Session = Depends(get_db)):
+@router.get("/api/projects/{project_id}/closure_files")
+def get_closure_files(project_id: int, request: Request, current_user: UserPrincipal = Depends(require_auth), db: Session = Depends(get_db)):
+    # 權限檢查在 _list_closure_files 中；快取以用戶區分，專案變更時一併失效
+    return cached_json_response(request, f'closure_files:{project_id}:{current_user.id}', [closure_files_tag(project_id)],
+                                lambda: _list_closure_files(project_id, current_user, db))
+
+def _list_closure_files(project_id: int, current_user: UserPrincipal, db: Session):
     project = db.query(Project).filter(Project.id == project_id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
@@ -599,23 +2843,14 @@ async def get_closure_files(project_id: int, current_user: User = Depends(requir
     else:
         raise HTTPException(status_code=403, detail="Forbidden")
     
-    from sqlalchemy import func
-    files = db.query(ClosureFile).filter(ClosureFile.project_id == project_id).order_by(
+    files = db.query(ClosureFile).options(joinedload(ClosureFile.uploader)).filter(ClosureFile.project_id == project_id).order_by(
         desc(func.coalesce(ClosureFile.version, 0)),
         desc(ClosureFile.created_at)
     ).all()
-    return [{
-        'id': f.id,
-        'filename': f.filename,
-        'original_filename': f.original_filename,
-        'version': f.version if f.version is not None else 1,
-        'status': f.status,
-        'uploader_name': f.uploader.username if f.uploader else '未知',
-        'created_at': f.created_at.isoformat() if f.created_at else datetime.utcnow().isoformat()
-    } for f in files]
+    return [serialize_closure_file(f) for f in files]
 
-@app.get("/api/files/{file_id}/download")
-async def download_file(file_id: int, file_type: str = "closure", current_user: User = Depends(require_auth), db: Session = Depends(get_db)):
+@router.get("/api/files/{file_id}/download")
+def download_file(file_id: int, request: Request, file_type: str = "closure", current_user: UserPrincipal = Depends(require_auth), db: Session = Depends(get_db)):
     if file_type == "proposal":
         file_record = db.query(ProposalFile).filter(ProposalFile.id == file_id).first()
         if not file_record:
@@ -635,18 +2870,72 @@ async def download_file(file_id: int, file_type: str = "closure", current_user:
         if current_user.id != file_record.uploader_id and (current_user.role != 'delegator' or project.delegator_id != current_user.id):
             raise HTTPException(status_code=403, detail="Forbidden")
     
-    filepath = os.path.join("uploads", file_record.filename)
+    filepath = os.path.join(UPLOAD_FOLDER, file_record.filename)
     if not os.path.exists(filepath):
         raise HTTPException(status_code=404, detail="File not found on server")
     
+    stat_result = os.stat(filepath)
+    size = stat_result.st_size
+    # 內容定址的文件以 SHA-256 作為強 ETag；舊文件退回以修改時間與大小產生
+    if file_record.checksum:
+        etag = f'"{file_record.checksum}"'
+    else:
+        etag = '"{}"'.format(hashlib.md5(f'{stat_result.st_mtime}-{size}'.encode()).hexdigest())
+    modified_at = file_record.created_at.replace(tzinfo=timezone.utc) if file_record.created_at else \
+        datetime.fromtimestamp(stat_result.st_mtime, tz=timezone.utc)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': formatdate(modified_at.timestamp(), usegmt=True),
+        'Accept-Ranges': 'bytes',
+        # 允許瀏覽器緩存，但每次都要帶驗證標頭回來重新檢查權限
+        'Cache-Control': 'private, no-cache'
+    }
+    
+    if_none_match = request.headers.get('if-none-match')
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_none_match:
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+    elif if_modified_since:
+        try:
+            if modified_at.replace(microsecond=0) <= parsedate_to_datetime(if_modified_since):
+                return Response(status_code=304, headers=headers)
+        except (TypeError, ValueError):
+            pass
+    
+    media_type = detect_media_type(filepath, file_record.original_filename)
+    range_header = request.headers.get('range')
+    if_range = request.headers.get('if-range')
+    byte_range = None
+    if range_header and (not if_range or if_range.strip() == etag):
+        byte_range = parse_range_header(range_header, size)
+    
+    if byte_range:
+        start, end = byte_range
+        quoted_filename = url_quote(file_record.original_filename)
+        headers.update({
+            'Content-Range': f'bytes {start}-{end}/{size}',
+            'Content-Length': str(end - start + 1),
+            'Content-Disposition': f"attachment; filename*=utf-8''{quoted_filename}"
+        })
+        return StreamingResponse(
+            _iter_file_range(filepath, start, end),
+            status_code=206,
+            media_type=media_type,
+            headers=headers
+        )
+    
     return FileResponse(
         path=filepath,
         filename=file_record.original_filename,
-        media_type='application/pdf'
+        media_type=media_type,
+        headers=headers,
+        stat_result=stat_result
     )
 
-@app.post("/api/projects/{project_id}/close")
-async def close_project(project_id: int, request: Request, current_user: User = Depends(require_auth), db: Session = Depends(get_db)):
+@router.post("/api/projects/{project_id}/close")
+@retry_on_db_lock
+def close_project(project_id: int, data: dict = Depends(get_json_body), current_user: UserPrincipal = Depends(require_auth), db: Session = Depends(get_db)):
     project = db.query(Project).filter(Project.id == project_id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
@@ -654,7 +2943,6 @@ async def close_project(project_id: int, request: Request, current_user: User =
     if current_user.role == 'delegator' and project.delegator_id != current_user.id:
         raise HTTPException(status_code=403, detail="Forbidden")
     
-    data = await request.json()
     action = data.get('action')
     file_id = data.get('file_id')
     
@@ -675,11 +2963,18 @@ async def close_project(project_id: int, request: Request, current_user: User =
             db.query(ClosureFile).filter(and_(ClosureFile.project_id == project_id, ClosureFile.status == 'pending')).update({'status': 'returned'}, synchronize_session=False)
     
     db.commit()
-    return JSONResponse(content={'success': True})
+    invalidate_project_responses(project_id, [project.delegator_id, project.delegate_id])
+    publish_project_event(project_id, 'project.closed' if action == 'accept' else 'closure_file.returned', {
+        'action': action,
+        'file_id': file_id,
+        'status': project.status
+    })
+    return FastJSONResponse(content={'success': True})
 
 ### 新增功能：提交評價 API ###
-@app.post("/api/projects/{project_id}/review")
-async def submit_review(project_id: int, request: Request, current_user: User = Depends(require_auth), db: Session = Depends(get_db)):
+@router.post("/api/projects/{project_id}/review")
+@retry_on_db_lock
+def submit_review(project_id: int, data: dict = Depends(get_json_body), current_user: UserPrincipal = Depends(require_auth), db: Session = Depends(get_db)):
     project = db.query(Project).filter(Project.id == project_id).first()
     if not project or project.status != 'closed':
         raise HTTPException(status_code=400, detail="Project must be closed to submit review")
@@ -703,7 +2998,6 @@ async def submit_review(project_id: int, request: Request, current_user: User =
     if existing:
         raise HTTPException(status_code=400, detail="You have already reviewed this project")
     
-    data = await request.json()
     dim1 = int(data.get('dimension_1', 5))
     dim2 = int(data.get('dimension_2', 5))
     dim3 = int(data.get('dimension_3', 5))
@@ -722,39 +3016,101 @@ async def submit_review(project_id: int, request: Request, current_user: User =
         comment=comment
     )
     db.add(review)
+    db.flush()
+    apply_review_to_summary(review, db)
     db.commit()
-    return JSONResponse(content={'success': True})
+    invalidate_project_responses(project_id, [project.delegator_id, project.delegate_id])
+    return FastJSONResponse(content={'success': True})
 
 # API Routes for Recipients
-@app.get("/api/available_projects")
-async def available_projects(current_user: User = Depends(require_role("recipient")), db: Session = Depends(get_db)):
-    now = datetime.utcnow()
-    projects = db.query(Project).filter(
-        Project.status == 'pending'
-    ).filter(
-        or_(Project.deadline.is_(None), Project.deadline > now)
-    ).all()
-    user_quotes = {q.project_id for q in db.query(Quote).filter(Quote.recipient_id == current_user.id).all()}
+@router.get("/api/available_projects")
+def available_projects(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    sort: str = 'newest',
+    deadline_after: Optional[str] = None,
+    deadline_before: Optional[str] = None,
+    min_rating: Optional[float] = None,
+    not_quoted: bool = False,
+    current_user: UserPrincipal = Depends(require_role("recipient")),
+    db: Session = Depends(get_db)
+):
+    """可報價的專案列表（分頁）
+    
+    - sort：newest（發布時間由新到舊，預設）或 deadline（截止期限由近到遠，無期限者排最後）
+    - deadline_after / deadline_before：截止期限區間（ISO 格式，會排除無期限的專案）
+    - min_rating：甲方平均評價下限；not_quoted：只顯示自己尚未報價的專案
+    - 每頁 limit 筆，還有下一頁時以 X-Next-Cursor 標頭回傳 cursor
+    """
+    if sort not in AVAILABLE_PROJECTS_SORTS:
+        raise HTTPException(status_code=400, detail="Invalid sort")
+    page_size = max(1, min(limit or AVAILABLE_PROJECTS_PAGE_DEFAULT, AVAILABLE_PROJECTS_PAGE_MAX))
+    after = parse_datetime_param(deadline_after, 'deadline_after')
+    before = parse_datetime_param(deadline_before, 'deadline_before')
+    
+    # 到期的專案已由排程工作移出 pending，不需要再比較 deadline
+    query = db.query(Project).options(joinedload(Project.delegator)).filter(Project.status == 'pending')
+    if after is not None:
+        query = query.filter(Project.deadline >= after)
+    if before is not None:
+        query = query.filter(Project.deadline <= before)
+    if min_rating is not None:
+        query = query.join(UserRatingSummary, UserRatingSummary.user_id == Project.delegator_id).filter(
+            UserRatingSummary.review_count > 0,
+            UserRatingSummary.rating_sum >= min_rating * UserRatingSummary.review_count
+        )
+    if not_quoted:
+        query = query.filter(~select(Quote.id).where(
+            Quote.recipient_id == current_user.id, Quote.project_id == Project.id
+        ).exists())
+    
+    position = decode_project_cursor(cursor) if cursor else None
+    if sort == 'newest':
+        if position:
+            query = query.filter(tuple_(Project.created_at, Project.id) < position)
+        projects = query.order_by(desc(Project.created_at), desc(Project.id)).limit(page_size + 1).all()
+    else:
+        # 先依期限排列有期限的專案，不足一頁時再接上無期限的專案（兩段查詢都能使用索引排序）
+        projects = []
+        if position is None or position[0] is not None:
+            dated = query.filter(Project.deadline.isnot(None))
+            if position:
+                dated = dated.filter(tuple_(Project.deadline, Project.id) > position)
+            projects = dated.order_by(Project.deadline, Project.id).limit(page_size + 1).all()
+        if len(projects) <= page_size and after is None and before is None:
+            undated = query.filter(Project.deadline.is_(None))
+            if position and position[0] is None:
+                undated = undated.filter(Project.id > position[1])
+            projects += undated.order_by(Project.id).limit(page_size + 1 - len(projects)).all()
+    
+    headers = {}
+    if len(projects) > page_size:
+        projects = projects[:page_size]
+        headers['X-Next-Cursor'] = encode_project_cursor(projects[-1], sort)
+    
+    # 報價數與是否已報價只針對本頁的專案做彙總查詢
+    page_ids = [p.id for p in projects]
+    quote_counts = {}
+    user_quotes = set()
+    if page_ids:
+        quote_counts = dict(db.query(Quote.project_id, func.count(Quote.id)).filter(
+            Quote.project_id.in_(page_ids)
+        ).group_by(Quote.project_id).all())
+        user_quotes = {row[0] for row in db.query(Quote.project_id).filter(
+            Quote.recipient_id == current_user.id, Quote.project_id.in_(page_ids)
+        ).all()}
     
     ### 新增功能：注入甲方評價數據 ###
-    result = []
-    for p in projects:
-        stats = get_user_rating_stats(p.delegator_id, db)
-        result.append({
-            'id': p.id,
-            'title': p.title,
-            'description': p.description,
-            'delegator_name': p.delegator.username,
-            'delegator_rating': stats, # 評價數據
-            'deadline': p.deadline.isoformat() if p.deadline else None,
-            'created_at': p.created_at.isoformat(),
-            'has_quoted': p.id in user_quotes,
-            'quote_count': len(p.quotes)
-        })
-    return result
+    ratings = get_users_rating_stats((p.delegator_id for p in projects), db)
+    result = [
+        serialize_market_project(p, ratings[p.delegator_id], p.id in user_quotes, quote_counts.get(p.id, 0))
+        for p in projects
+    ]
+    return FastJSONResponse(content=result, headers=headers)
 
-@app.post("/api/projects/{project_id}/quote")
-async def submit_quote(project_id: int, request: Request, current_user: User = Depends(require_role("recipient")), db: Session = Depends(get_db)):
+@router.post("/api/projects/{project_id}/quote")
+@retry_on_db_lock
+def submit_quote(project_id: int, data: dict = Depends(get_json_body), current_user: UserPrincipal = Depends(require_role("recipient")), db: Session = Depends(get_db)):
     project = db.query(Project).filter(Project.id == project_id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
@@ -768,7 +3124,6 @@ async def submit_quote(project_id: int, request: Request, current_user: User = D
     if existing:
         raise HTTPException(status_code=400, detail="You have already submitted a quote for this project")
     
-    data = await request.json()
     quote = Quote(
         project_id=project_id,
         recipient_id=current_user.id,
@@ -778,13 +3133,17 @@ async def submit_quote(project_id: int, request: Request, current_user: User = D
     db.add(quote)
     db.commit()
     db.refresh(quote)
-    return JSONResponse(content={'success': True, 'quote_id': quote.id})
+    # 甲方列表中的報價數改變
+    invalidate_project_responses(project_id, [project.delegator_id])
+    publish_project_event(project_id, 'quote.submitted', {'quote_id': quote.id, 'recipient_id': current_user.id})
+    return FastJSONResponse(content={'success': True, 'quote_id': quote.id})
 
-@app.post("/api/quotes/{quote_id}/upload_proposal")
-async def upload_proposal_file(
+@router.post("/api/quotes/{quote_id}/upload_proposal")
+@retry_on_db_lock
+def upload_proposal_file(
     quote_id: int,
-    file: UploadFile = File(...),
-    current_user: User = Depends(require_role("recipient")),
+    current_user: UserPrincipal = Depends(require_role("recipient")),
+    file: ReceivedUpload = Depends(receive_upload),
     db: Session = Depends(get_db)
 ):
     quote = db.query(Quote).filter(Quote.id == quote_id).first()
@@ -810,53 +3169,54 @@ async def upload_proposal_file(
     if content_type and content_type != 'application/pdf':
         raise HTTPException(status_code=400, detail="Only PDF files are allowed")
     
-    timestamp = datetime.now().timestamp()
     original_filename = secure_filename(file.filename)
-    safe_filename = f"proposal_{quote_id}_{current_user.id}_{timestamp}_{original_filename}"
-    filepath = os.path.join("uploads", safe_filename)
-    
-    with open(filepath, "wb") as buffer:
-        content = await file.read()
-        buffer.write(content)
-    
-    existing_file = db.query(ProposalFile).filter(ProposalFile.quote_id == quote_id).first()
-    if existing_file:
-        existing_file.filename = safe_filename
-        existing_file.original_filename = original_filename
-        existing_file.created_at = datetime.utcnow()
-        db.commit()
-        db.refresh(existing_file)
-        return JSONResponse(content={'success': True, 'file_id': existing_file.id})
-    else:
-        proposal_file = ProposalFile(
-            quote_id=quote_id,
-            project_id=quote.project_id,
-            uploader_id=current_user.id,
-            filename=safe_filename,
-            original_filename=original_filename
-        )
-        db.add(proposal_file)
+    with stored_upload(file, db) as (stored_filename, file_size, checksum):
+        proposal_file = db.query(ProposalFile).filter(ProposalFile.quote_id == quote_id).first()
+        replaced = proposal_file is not None and proposal_file.checksum not in (None, checksum)
+        # 舊文件沒有引用計數，不會被回收工作刪除：commit 之後直接刪除
+        legacy_filename = proposal_file.filename if proposal_file is not None and proposal_file.checksum is None else None
+        if proposal_file:
+            release_blob(db, proposal_file.checksum)
+            if replaced:
+                schedule_blob_reaper(db)
+            proposal_file.filename = stored_filename
+            proposal_file.original_filename = original_filename
+            proposal_file.file_size = file_size
+            proposal_file.checksum = checksum
+            proposal_file.created_at = datetime.utcnow()
+        else:
+            proposal_file = ProposalFile(
+                quote_id=quote_id,
+                project_id=quote.project_id,
+                uploader_id=current_user.id,
+                filename=stored_filename,
+                original_filename=original_filename,
+                file_size=file_size,
+                checksum=checksum
+            )
+            db.add(proposal_file)
         db.commit()
-        db.refresh(proposal_file)
-        return JSONResponse(content={'success': True, 'file_id': proposal_file.id})
+    if replaced:
+        job_scheduler.wake()
+    remove_legacy_file(db, legacy_filename)
+    db.refresh(proposal_file)
+    return FastJSONResponse(content={'success': True, 'file_id': proposal_file.id})
 
-@app.get("/api/my_projects")
-async def my_projects(current_user: User = Depends(require_role("recipient")), db: Session = Depends(get_db)):
-    projects = db.query(Project).filter(Project.delegate_id == current_user.id).all()
-    return [{
-        'id': p.id,
-        'title': p.title,
-        'description': p.description,
-        'status': p.status,
-        'delegator_name': p.delegator.username,
-        'created_at': p.created_at.isoformat()
-    } for p in projects]
+@router.get("/api/my_projects")
+def my_projects(request: Request, current_user: UserPrincipal = Depends(require_role("recipient")), db: Session = Depends(get_db)):
+    return cached_json_response(request, f'my_projects:{current_user.id}', [user_lists_tag(current_user.id)],
+                                lambda: _list_my_projects(current_user, db))
 
-@app.post("/api/projects/{project_id}/upload_closure")
-async def upload_closure_file(
+def _list_my_projects(current_user: UserPrincipal, db: Session):
+    projects = db.query(Project).options(joinedload(Project.delegator)).filter(Project.delegate_id == current_user.id).all()
+    return [serialize_assigned_project(p) for p in projects]
+
+@router.post("/api/projects/{project_id}/upload_closure")
+@retry_on_db_lock
+def upload_closure_file(
     project_id: int,
-    file: UploadFile = File(...),
-    current_user: User = Depends(require_role("recipient")),
+    current_user: UserPrincipal = Depends(require_role("recipient")),
+    file: ReceivedUpload = Depends(receive_upload),
     db: Session = Depends(get_db)
 ):
     project = db.query(Project).filter(Project.id == project_id).first()
@@ -868,39 +3228,43 @@ async def upload_closure_file(
     if not file.filename:
         raise HTTPException(status_code=400, detail="No file selected")
     
-    max_version = db.query(ClosureFile).filter(
-        ClosureFile.project_id == project_id,
-        ClosureFile.uploader_id == current_user.id
-    ).order_by(ClosureFile.version.desc()).first()
-    
-    version = (max_version.version + 1) if max_version else 1
-    
-    timestamp = datetime.now().timestamp()
     original_filename = secure_filename(file.filename)
-    safe_filename = f"closure_{project_id}_{current_user.id}_v{version}_{timestamp}_{original_filename}"
-    filepath = os.path.join("uploads", safe_filename)
-    
-    with open(filepath, "wb") as buffer:
-        content = await file.read()
-        buffer.write(content)
-    
-    closure_file = ClosureFile(
-        project_id=project_id,
-        uploader_id=current_user.id,
-        filename=safe_filename,
-        original_filename=original_filename,
-        version=version,
-        status='pending'
-    )
-    db.add(closure_file)
-    db.commit()
-    db.refresh(closure_file)
+    with stored_upload(file, db) as (stored_filename, file_size, checksum):
+        closure_file = add_closure_file(
+            db, project_id,
+            uploader_id=current_user.id,
+            filename=stored_filename,
+            original_filename=original_filename,
+            file_size=file_size,
+            checksum=checksum,
+            status='pending'
+        )
+        # 在 commit 前取值：commit 之後不再重新載入，session 不會佔住連線直到請求結束
+        file_id, version = closure_file.id, closure_file.version
+        participants = [project.delegator_id, project.delegate_id]
+        db.commit()
+    invalidate_project_responses(project_id, participants)
+    publish_project_event(project_id, 'closure_file.uploaded', {'file_id': file_id, 'version': version})
     
-    return JSONResponse(content={'success': True, 'file_id': closure_file.id, 'version': version})
+    return FastJSONResponse(content={'success': True, 'file_id': file_id, 'version': version})
 
 # Communication Routes
-@app.get("/api/projects/{project_id}/messages")
-async def get_messages(project_id: int, current_user: User = Depends(require_auth), db: Session = Depends(get_db)):
+@router.get("/api/projects/{project_id}/messages")
+def get_messages(
+    project_id: int,
+    since_id: Optional[int] = None,
+    before: Optional[str] = None,
+    limit: Optional[int] = None,
+    current_user: UserPrincipal = Depends(require_auth),
+    db: Session = Depends(get_db)
+):
+    """專案訊息（依 created_at, id 遞增排列）
+    
+    - 不帶參數：回傳全部訊息（與舊版相同）
+    - since_id：只回傳此訊息之後的新訊息，最多 limit 筆
+    - limit / before：回傳最近（或 before 游標之前）的 limit 筆；
+      還有更早的訊息時以 X-Next-Cursor 標頭回傳下一頁的 before 游標
+    """
     project = db.query(Project).filter(Project.id == project_id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
@@ -912,17 +3276,38 @@ async def get_messages(project_id: int, current_user: User = Depends(require_aut
         if project.delegate_id != current_user.id:
             raise HTTPException(status_code=403, detail="Forbidden")
     
-    messages = db.query(Message).filter(Message.project_id == project_id).order_by(Message.created_at).all()
-    return [{
-        'id': m.id,
-        'sender_name': m.sender.username,
-        'sender_id': m.sender_id,
-        'content': m.content,
-        'created_at': m.created_at.isoformat()
-    } for m in messages]
+    if limit is not None:
+        limit = max(1, min(limit, MESSAGE_PAGE_MAX))
+    
+    query = db.query(Message).options(joinedload(Message.sender)).filter(Message.project_id == project_id)
+    key = tuple_(Message.created_at, Message.id)
+    headers = {}
+    if since_id is not None:
+        anchor = db.query(Message.created_at, Message.id).filter(
+            Message.project_id == project_id, Message.id == since_id
+        ).first()
+        if anchor:
+            query = query.filter(key > tuple(anchor))
+        else:
+            query = query.filter(Message.id > since_id)
+        messages = query.order_by(Message.created_at, Message.id).limit(limit or MESSAGE_PAGE_MAX).all()
+    elif limit is not None or before is not None:
+        if before is not None:
+            query = query.filter(key < decode_message_cursor(before))
+        page_size = limit or MESSAGE_PAGE_MAX
+        messages = query.order_by(desc(Message.created_at), desc(Message.id)).limit(page_size + 1).all()
+        if len(messages) > page_size:
+            messages = messages[:page_size]
+            headers['X-Next-Cursor'] = encode_message_cursor(messages[-1])
+        messages.reverse()
+    else:
+        messages = query.order_by(Message.created_at, Message.id).all()
+    
+    return FastJSONResponse(content=[serialize_message(m) for m in messages], headers=headers)
 
-@app.post("/api/projects/{project_id}/messages")
-async def create_message(project_id: int, request: Request, current_user: User = Depends(require_auth), db: Session = Depends(get_db)):
+@router.post("/api/projects/{project_id}/messages")
+@retry_on_db_lock
+def create_message(project_id: int, data: dict = Depends(get_json_body), current_user: UserPrincipal = Depends(require_auth), db: Session = Depends(get_db)):
     project = db.query(Project).filter(Project.id == project_id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
@@ -939,7 +3324,6 @@ async def create_message(project_id: int, request: Request, current_user: User =
     if not receiver_id:
         raise HTTPException(status_code=400, detail="No delegate assigned to project")
     
-    data = await request.json()
     message = Message(
         project_id=project_id,
         sender_id=current_user.id,
@@ -949,32 +3333,222 @@ async def create_message(project_id: int, request: Request, current_user: User =
     db.add(message)
     db.commit()
     db.refresh(message)
-    return JSONResponse(content={'success': True, 'message_id': message.id})
+    publish_project_event(project_id, 'message.created', {
+        'id': message.id,
+        'sender_name': current_user.username,
+        'sender_id': message.sender_id,
+        'content': message.content,
+        'created_at': message.created_at
+    })
+    return FastJSONResponse(content={'success': True, 'message_id': message.id})
+
+# Real-time event stream (Server-Sent Events)
+def _authorize_project_events(current_user: UserPrincipal, project_id: int):
+    """確認訂閱者是專案的甲方或乙方；使用短暫的 session，避免長連線佔用連線池"""
+    db = SessionLocal()
+    try:
+        project = db.query(Project).filter(Project.id == project_id).first()
+        if not project:
+            raise HTTPException(status_code=404, detail="Project not found")
+        if current_user.id not in (project.delegator_id, project.delegate_id):
+            raise HTTPException(status_code=403, detail="Forbidden")
+    finally:
+        db.close()
+
+@router.get("/api/projects/{project_id}/events")
+async def project_events(project_id: int, request: Request):
+    current_user = await get_current_user(request)
+    if current_user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
+    await run_in_threadpool(_authorize_project_events, current_user, project_id)
+    
+    channel = f'project:{project_id}'
+    subscriber = event_broker.subscribe(channel)
+    
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    payload = await asyncio.wait_for(subscriber.queue.get(), timeout=SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if payload is None:
+                    break
+                yield payload
+        finally:
+            event_broker.unsubscribe(channel, subscriber)
+    
+    return StreamingResponse(stream(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+# Metrics
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint(request: Request):
+    """Prometheus 文字格式的監控指標；設定 METRICS_TOKEN 時需要 Bearer token"""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if METRICS_TOKEN and request.headers.get('authorization') != f'Bearer {METRICS_TOKEN}':
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
+    return PlainTextResponse(metrics.render(gather_metrics_snapshots()),
+                             media_type='text/plain; version=0.0.4')
 
 # History Routes
-@app.get("/api/history")
-async def project_history(current_user: User = Depends(require_auth), db: Session = Depends(get_db)):
+@router.get("/api/history")
+def project_history(request: Request, current_user: UserPrincipal = Depends(require_auth), db: Session = Depends(get_db)):
+    return cached_json_response(request, f'history:{current_user.id}', [user_lists_tag(current_user.id)],
+                                lambda: _list_history(current_user, db))
+
+def _list_history(current_user: UserPrincipal, db: Session):
+    query = db.query(Project).options(joinedload(Project.delegate), joinedload(Project.delegator))
     if current_user.role == 'delegator':
-        projects = db.query(Project).filter(
+        projects = query.filter(
             Project.delegator_id == current_user.id,
             Project.status.in_(['completed', 'closed'])
         ).all()
     else:
-        projects = db.query(Project).filter(
+        projects = query.filter(
             Project.delegate_id == current_user.id,
             Project.status.in_(['completed', 'closed'])
         ).all()
     
-    return [{
-        'id': p.id,
-        'title': p.title,
-        'description': p.description,
-        'status': p.status,
-        'delegate_name': p.delegate.username if p.delegate else None,
-        'delegator_name': p.delegator.username,
-        'created_at': p.created_at.isoformat(),
-        'completed_at': p.updated_at.isoformat()
-    } for p in projects]
+    return [serialize_history_project(p) for p in projects]
+
+
+@router.get("/api/search")
+def search(
+    q: str,
+    scope: str = 'projects',
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    current_user: UserPrincipal = Depends(require_auth),
+    db: Session = Depends(get_db)
+):
+    """全文搜尋專案（標題、描述）或訊息，依相關度排序
+    
+    權限與列表路由相同：甲方只搜尋自己的專案與其訊息；乙方搜尋可報價的專案、
+    自己承接的專案，以及自己承接專案中的訊息。下一頁的 cursor 以 X-Next-Cursor 標頭回傳。
+    """
+    if not search_index_ready(db.connection()):
+        raise HTTPException(status_code=503, detail="Search is not available")
+    if scope not in ('projects', 'messages'):
+        raise HTTPException(status_code=400, detail="Invalid scope")
+    match = build_match_query(q)
+    if not match:
+        raise HTTPException(status_code=400, detail="Search query is empty")
+    page_size = max(1, min(limit or SEARCH_PAGE_DEFAULT, SEARCH_PAGE_MAX))
+    try:
+        offset = max(0, int(cursor)) if cursor else 0
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    params = {'limit': page_size + 1, 'offset': offset}
+    if scope == 'projects':
+        # 權限條件放進 MATCH，讓 FTS5 直接取交集而不是先取出所有命中再過濾
+        if current_user.role == 'delegator':
+            match = f"{{title description}} : ({match}) AND delegator_id : {current_user.id}"
+        else:
+            match = f"{{title description}} : ({match}) AND (status : pending OR delegate_id : {current_user.id})"
+        sql = """
+            SELECT p.id, p.title, p.status, p.deadline AS deadline, u.username,
+                   snippet(project_fts, 0, char(2), char(3), '…', 12) AS title_snippet,
+                   snippet(project_fts, 1, char(2), char(3), '…', 24) AS snippet
+            FROM project_fts
+            JOIN project p ON p.id = project_fts.rowid
+            JOIN user u ON u.id = p.delegator_id
+            WHERE project_fts MATCH :match
+            ORDER BY bm25(project_fts, 10.0, 1.0, 0.0, 0.0, 0.0)
+            LIMIT :limit OFFSET :offset
+        """
+        rows = db.execute(text(sql).columns(deadline=DateTime), dict(params, match=match)).all()
+        results = [{
+            'id': row.id,
+            'title': row.title,
+            'status': row.status,
+            'deadline': row.deadline,
+            'delegator_name': row.username,
+            'title_snippet': render_snippet(row.title_snippet),
+            'snippet': render_snippet(row.snippet)
+        } for row in rows]
+    else:
+        # 只搜尋自己參與的專案：在 SQL 中以 project 的參與者欄位過濾，不把所有專案 id 展開進 MATCH
+        participant = 'delegator_id' if current_user.role == 'delegator' else 'delegate_id'
+        sql = f"""
+            SELECT m.id, m.project_id, p.title, u.username, m.created_at AS created_at,
+                   snippet(message_fts, 0, char(2), char(3), '…', 24) AS snippet
+            FROM message_fts
+            JOIN message m ON m.id = message_fts.rowid
+            JOIN project p ON p.id = m.project_id
+            JOIN user u ON u.id = m.sender_id
+            WHERE message_fts MATCH :match AND p.{participant} = :user_id
+            ORDER BY bm25(message_fts, 1.0, 0.0)
+            LIMIT :limit OFFSET :offset
+        """
+        rows = db.execute(text(sql).columns(created_at=DateTime),
+                          dict(params, match=f"body : ({match})", user_id=current_user.id)).all()
+        results = [{
+            'id': row.id,
+            'project_id': row.project_id,
+            'project_title': row.title,
+            'sender_name': row.username,
+            'created_at': row.created_at,
+            'snippet': render_snippet(row.snippet)
+        } for row in rows]
+    
+    headers = {}
+    if len(results) > page_size:
+        results = results[:page_size]
+        headers['X-Next-Cursor'] = str(offset + page_size)
+    return FastJSONResponse(content=results, headers=headers)
+
+# App factory
+@asynccontextmanager
+async def lifespan(application: FastAPI):
+    """啟動時建立上傳目錄，並在數據庫尚未遷移到最新版本時提示（不會自動遷移）；數據庫已是最新版本時啟動背景工作排程器"""
+    def check_storage_and_schema():
+        ensure_storage_dirs()
+        pending = pending_migrations()
+        if pending:
+            print(f"⚠ 數據庫有 {len(pending)} 個遷移尚未套用（最新版本 {LATEST_SCHEMA_VERSION}），"
+                  f"請執行 python manage.py migrate")
+        return not pending
+    schema_ready = await run_in_threadpool(check_storage_and_schema)
+    flusher = None
+    if METRICS_ENABLED and METRICS_DIR:
+        flusher = asyncio.create_task(flush_metrics_periodically())
+    if JOB_SCHEDULER_ENABLED and schema_ready:
+        await run_in_threadpool(ensure_retention_job)
+        job_scheduler.start()
+    yield
+    await job_scheduler.stop()
+    if flusher is not None:
+        flusher.cancel()
+        await run_in_threadpool(write_metrics_snapshot)
+
+def create_app():
+    """組裝 FastAPI 應用；不連線數據庫、不建立目錄，匯入 app 模組沒有副作用"""
+    application = FastAPI(default_response_class=FastJSONResponse, lifespan=lifespan)
+    application.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    if QUERY_TRACE:
+        application.add_middleware(QueryTraceMiddleware)
+    if METRICS_ENABLED:
+        application.add_middleware(MetricsMiddleware)
+    application.add_exception_handler(HTTPException, custom_http_exception_handler)
+    application.mount("/static", StaticFiles(directory="static"), name="static")
+    # 直接沿用 router 上已建立的路由；include_router 會重新建立每個路由並再分析一次依賴
+    application.router.routes.extend(router.routes)
+    return application
+
+app = create_app()
 
 if __name__ == '__main__':
     import uvicorn
@@ -1012,6 +3586,8 @@ if __name__ == '__main__':
             print("Could not find an available port. Please free up a port and try again.")
             sys.exit(1)
     
+    run_migrations()
+    
     print("=" * 50)
     print("Starting FastAPI server...")
     print("=" * 50)
@@ -1020,6 +3596,7 @@ if __name__ == '__main__':
     print(f"✓ Access from browser: http://localhost:{port}")
     print("-" * 50)
     print("Press Ctrl+C to stop the server")
+    print("Development server (reload=True); use `python serve.py` in production")
     print("=" * 50)
     print()
     
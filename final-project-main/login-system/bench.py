@@ -0,0 +1,773 @@
+"""並發效能測試：在負載下量測 API 延遲 (p50/p95/p99)
+
+使用獨立的臨時 SQLite 數據庫與上傳目錄，不會影響 instance/ 與 uploads/ 中的數據。
+需要額外安裝 httpx:  pip install httpx
+
+用法:
+    python bench.py [--scenario mixed] [--concurrency 50] [--requests 2000]
+    python bench.py --scenario download [--file-size-mb 50] [--repeat 20]
+    python bench.py --scenario auth [--repeat 1000]    # 驗證快取命中 / 未命中時的請求延遲
+    python bench.py --scenario poll [--repeat 500]     # 列表輪詢：完整回應與 ETag 重新驗證 (304)
+    RESPONSE_CACHE_MAX_ENTRIES=0 python bench.py --scenario poll   # 停用回應快取作為對照
+    python bench.py --scenario serialize [--rows 10000]  # 各模型 10k 筆的序列化成本：舊路徑 vs FastJSONResponse
+    python bench.py --scenario serve [--workers 1,4]     # 經由 serve.py 啟動真正的伺服器，以 HTTP 執行 mixed 負載
+    DB_PROFILE=legacy python bench.py --scenario write   # 與預設的 production 設定檔比較
+    python bench.py --scenario upload-race [--uploads 300] [--target http --workers 4]
+        # 同一個專案同時上傳大量結案文件，之後檢查版本號、引用計數與存儲目錄是否一致（不一致時結束碼為 1）
+
+委託流程情境（數據庫另外加入報價提案、結案文件版本、已結案專案與評價）:
+    python bench.py --scenario login      # 登入風暴：每個請求都驗證一次 bcrypt 密碼
+    python bench.py --scenario browse     # 市場瀏覽：可報價專案的排序與篩選、搜尋、報價列表、歷史
+    python bench.py --scenario quote      # 報價提交與上傳提案 PDF
+    python bench.py --scenario chat       # 聊天輪詢 (since_id) 與發送訊息
+    python bench.py --scenario transfer [--transfer-mb 5]   # 結案文件的上傳與下載
+    python bench.py --scenario suite      # 依序執行 mixed 與以上五個情境
+    python bench.py --scenario suite --target http   # 改為經由 serve.py 啟動的 uvicorn（--workers 的第一個值）
+
+基準線（mixed / write / serve 與委託流程情境）:
+    python bench.py --scenario suite --save-baseline baseline.json
+    python bench.py --scenario suite --compare baseline.json [--tolerance 0.25]
+    比較時任一列的 p95 變慢或 rps 下降超過 tolerance 即列為退步，並以結束碼 1 離開。
+    數據庫內容由 --seed 與規模參數決定；比較前請使用相同的參數與機器。
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+
+BENCH_DIR = tempfile.mkdtemp(prefix="bench_")
+BENCH_DB = os.path.join(BENCH_DIR, "bench.db")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{BENCH_DB}")
+os.environ.setdefault("UPLOAD_FOLDER", os.path.join(BENCH_DIR, "uploads"))
+
+import httpx  # noqa: E402
+
+import app as webapp  # noqa: E402
+
+webapp.run_migrations()
+
+# 預先計算一次密碼哈希，避免 seed 時重複執行昂貴的 bcrypt
+SEED_PASSWORD = "benchmark"
+
+
+def seed(delegators=5, recipients=20, projects=200, messages_per_project=20):
+    """建立測試數據，回傳 (delegator_ids, recipient_ids, [(project_id, delegator_id, delegate_id), ...])"""
+    db = webapp.SessionLocal()
+    try:
+        password_hash = webapp.get_password_hash(SEED_PASSWORD)
+        users = []
+        for i in range(delegators):
+            users.append(webapp.User(username=f"bench_d{i}", email=f"bench_d{i}@example.com",
+                                     password_hash=password_hash, role="delegator"))
+        for i in range(recipients):
+            users.append(webapp.User(username=f"bench_r{i}", email=f"bench_r{i}@example.com",
+                                     password_hash=password_hash, role="recipient"))
+        db.add_all(users)
+        db.flush()
+        delegator_ids = [u.id for u in users if u.role == "delegator"]
+        recipient_ids = [u.id for u in users if u.role == "recipient"]
+
+        active = []
+        for i in range(projects):
+            delegator_id = random.choice(delegator_ids)
+            is_active = i % 2 == 0
+            project = webapp.Project(
+                title=f"Bench project {i}",
+                description="Synthetic project for benchmarking",
+                delegator_id=delegator_id,
+                delegate_id=random.choice(recipient_ids) if is_active else None,
+                status="active" if is_active else "pending",
+            )
+            db.add(project)
+            db.flush()
+            for recipient_id in random.sample(recipient_ids, 3):
+                db.add(webapp.Quote(project_id=project.id, recipient_id=recipient_id, amount=100.0))
+            if is_active:
+                active.append((project.id, delegator_id, project.delegate_id))
+                for j in range(messages_per_project):
+                    sender, receiver = (delegator_id, project.delegate_id) if j % 2 == 0 else (project.delegate_id, delegator_id)
+                    db.add(webapp.Message(project_id=project.id, sender_id=sender,
+                                          receiver_id=receiver, content=f"message {j}"))
+        db.commit()
+        return delegator_ids, recipient_ids, active
+    finally:
+        db.close()
+
+
+def write_blob(data):
+    """把內容直接放入內容存儲，回傳 (存儲路徑, checksum)"""
+    fd, tmp_path = webapp.tempfile.mkstemp(dir=webapp.UPLOAD_FOLDER, prefix=".upload_", suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    checksum = webapp.hashlib.sha256(data).hexdigest()
+    return webapp._place_blob(tmp_path, checksum), checksum
+
+
+def seed_workflow(recipient_ids, active, transfer_mb, proposal_ratio=0.3, closure_projects=5, closure_versions=2, closed_projects=20):
+    """在 seed() 的數據上加入委託流程的其餘部分，回傳各情境使用的 id
+
+    - 約 proposal_ratio 的報價附有 64KB 的提案 PDF
+    - closure_projects 個進行中的專案各有 closure_versions 個 transfer_mb 大小的結案文件版本
+    - 最後 closed_projects 個進行中的專案改為已結案，雙方互相評價
+    """
+    db = webapp.SessionLocal()
+    try:
+        for quote in db.query(webapp.Quote).order_by(webapp.Quote.id).all():
+            if random.random() >= proposal_ratio:
+                continue
+            data = random.randbytes(64 * 1024)
+            filename, checksum = write_blob(data)
+            webapp.acquire_blob(db, checksum, len(data))
+            db.add(webapp.ProposalFile(quote_id=quote.id, project_id=quote.project_id, uploader_id=quote.recipient_id,
+                                       filename=filename, original_filename="proposal.pdf",
+                                       file_size=len(data), checksum=checksum))
+
+        closure_files = []
+        for project_id, delegator_id, delegate_id in active[:closure_projects]:
+            for version in range(1, closure_versions + 1):
+                data = random.randbytes(transfer_mb * 1024 * 1024)
+                filename, checksum = write_blob(data)
+                webapp.acquire_blob(db, checksum, len(data))
+                record = webapp.ClosureFile(project_id=project_id, uploader_id=delegate_id, filename=filename,
+                                            original_filename="deliverable.zip", version=version,
+                                            file_size=len(data), checksum=checksum,
+                                            status="pending" if version == closure_versions else "returned")
+                db.add(record)
+                db.flush()
+                closure_files.append((record.id, delegator_id))
+
+        open_projects, closed = active[:-closed_projects], active[-closed_projects:]
+        for project_id, delegator_id, delegate_id in closed:
+            db.query(webapp.Project).filter(webapp.Project.id == project_id).update({"status": "closed"})
+            for reviewer_id, reviewee_id in ((delegator_id, delegate_id), (delegate_id, delegator_id)):
+                dimensions = [random.randint(2, 5) for _ in range(3)]
+                review = webapp.Review(project_id=project_id, reviewer_id=reviewer_id, reviewee_id=reviewee_id,
+                                       dimension_1=dimensions[0], dimension_2=dimensions[1],
+                                       dimension_3=dimensions[2], average_rating=sum(dimensions) / 3.0,
+                                       comment="Synthetic review")
+                db.add(review)
+                db.flush()
+                webapp.apply_review_to_summary(review, db)
+        db.commit()
+
+        pending = db.query(webapp.Project.id, webapp.Project.delegator_id).filter(
+            webapp.Project.status == "pending").all()
+        quotes = db.query(webapp.Quote.id, webapp.Quote.project_id, webapp.Quote.recipient_id).all()
+        quoted = {(project_id, recipient_id) for _, project_id, recipient_id in quotes}
+        users = db.query(webapp.User.id, webapp.User.username).all()
+        open_ids = {project_id for project_id, _, _ in open_projects}
+        last_message = dict(db.query(webapp.Message.project_id, webapp.func.max(webapp.Message.id))
+                            .group_by(webapp.Message.project_id).all())
+    finally:
+        db.close()
+
+    # 尚未報價的 (專案, 乙方) 組合；每個組合只能報價一次，打亂後依序取用
+    new_quotes = [(project_id, recipient_id) for project_id, _ in pending for recipient_id in recipient_ids
+                  if (project_id, recipient_id) not in quoted]
+    random.shuffle(new_quotes)
+    pending_ids = {project_id for project_id, _ in pending}
+    return {
+        "usernames": [username for _, username in users],
+        "open": open_projects,
+        "pending": [tuple(row) for row in pending],
+        "new_quotes": new_quotes,
+        "pending_quotes": [(quote_id, recipient_id) for quote_id, project_id, recipient_id in quotes
+                           if project_id in pending_ids],
+        "closure_files": closure_files,
+        "last_message": {project_id: last_message.get(project_id, 0) for project_id in open_ids},
+        "transfer_bytes": transfer_mb * 1024 * 1024,
+    }
+
+
+def auth_cookies(user_id):
+    return {"access_token": webapp.create_access_token(data={"user_id": user_id})}
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def report(name, latencies, elapsed):
+    """輸出一列延遲統計，並回傳同樣的數值（毫秒）供基準線使用"""
+    ms = [x * 1000 for x in latencies]
+    stats = {"n": len(ms), "rps": len(ms) / elapsed, "p50": percentile(ms, 50), "p95": percentile(ms, 95),
+             "p99": percentile(ms, 99), "mean": statistics.mean(ms) if ms else 0.0}
+    print(f"{name:<28} n={stats['n']:<6} rps={stats['rps']:8.1f}  "
+          f"p50={stats['p50']:7.2f}ms  p95={stats['p95']:7.2f}ms  "
+          f"p99={stats['p99']:7.2f}ms  mean={stats['mean']:7.2f}ms")
+    return stats
+
+
+def pick_mixed(delegator_ids, recipient_ids, active):
+    """混合負載：市場瀏覽、專案列表、訊息讀取與發送"""
+    def pick():
+        roll = random.random()
+        project_id, delegator_id, delegate_id = random.choice(active)
+        if roll < 0.3:
+            return "GET available_projects", "GET", "/api/available_projects", random.choice(recipient_ids), {}
+        if roll < 0.5:
+            return "GET projects", "GET", "/api/projects", random.choice(delegator_ids), {}
+        if roll < 0.8:
+            return "GET messages", "GET", f"/api/projects/{project_id}/messages", delegator_id, {}
+        return "POST messages", "POST", f"/api/projects/{project_id}/messages", delegate_id, {"json": {"content": "ping"}}
+    return pick
+
+
+def pick_write_heavy(delegator_ids, recipient_ids, active):
+    """寫入為主的負載：大量發送訊息與建立專案，少量讀取"""
+    def pick():
+        roll = random.random()
+        project_id, delegator_id, delegate_id = random.choice(active)
+        if roll < 0.6:
+            sender = random.choice([delegator_id, delegate_id])
+            return "POST messages", "POST", f"/api/projects/{project_id}/messages", sender, {"json": {"content": "ping"}}
+        if roll < 0.8:
+            return "POST projects", "POST", "/api/projects", random.choice(delegator_ids), {"json": {
+                "title": "Bench write", "description": "Created under write load"}}
+        return "GET messages", "GET", f"/api/projects/{project_id}/messages", delegator_id, {}
+    return pick
+
+
+def pick_login(delegator_ids, recipient_ids, workload):
+    """登入風暴：用戶以密碼登入，每個請求都是一次完整的密碼哈希驗證"""
+    def pick():
+        credentials = {"username": random.choice(workload["usernames"]), "password": SEED_PASSWORD}
+        return "POST login", "POST", "/login", None, {"json": credentials}
+    return pick
+
+
+def pick_browse(delegator_ids, recipient_ids, workload):
+    """市場瀏覽：乙方以不同排序與篩選翻閱可報價專案、搜尋；甲方查看報價（含報價者評價）與歷史"""
+    def pick():
+        roll = random.random()
+        recipient_id = random.choice(recipient_ids)
+        if roll < 0.35:
+            return "GET available_projects", "GET", "/api/available_projects?limit=20", recipient_id, {}
+        if roll < 0.5:
+            return ("GET available (filter)", "GET",
+                    "/api/available_projects?limit=20&sort=deadline&not_quoted=true", recipient_id, {})
+        if roll < 0.6:
+            return ("GET available (rating)", "GET",
+                    "/api/available_projects?limit=20&min_rating=3.5", recipient_id, {})
+        if roll < 0.75:
+            return "GET search", "GET", "/api/search?q=bench%20project&limit=20", recipient_id, {}
+        project_id, delegator_id = random.choice(workload["pending"])
+        if roll < 0.9:
+            return "GET quotes", "GET", f"/api/projects/{project_id}/quotes", delegator_id, {}
+        return "GET history", "GET", "/api/history", delegator_id, {}
+    return pick
+
+
+def pick_quote(delegator_ids, recipient_ids, workload):
+    """報價：乙方對尚未報價的專案提交報價，並上傳或更換提案 PDF（256KB）"""
+    new_quotes = list(workload["new_quotes"])
+    proposal = b"%PDF-1.4\n" + random.randbytes(256 * 1024)
+
+    def upload():
+        # 每次上傳不同的內容，避免內容存儲去重而略過寫入
+        return {"files": {"file": ("proposal.pdf", os.urandom(16) + proposal, "application/pdf")}}
+
+    def pick():
+        if new_quotes and random.random() < 0.6:
+            project_id, recipient_id = new_quotes.pop()
+            return "POST quote", "POST", f"/api/projects/{project_id}/quote", recipient_id, {
+                "json": {"amount": random.randint(50, 500) * 10.0, "message": "Synthetic quote"}}
+        quote_id, recipient_id = random.choice(workload["pending_quotes"])
+        return "POST upload_proposal", "POST", f"/api/quotes/{quote_id}/upload_proposal", recipient_id, upload
+    return pick
+
+
+def pick_chat(delegator_ids, recipient_ids, workload):
+    """聊天：雙方以 since_id 輪詢新訊息，偶爾發送訊息"""
+    def pick():
+        project_id, delegator_id, delegate_id = random.choice(workload["open"])
+        user_id = random.choice((delegator_id, delegate_id))
+        if random.random() < 0.85:
+            since_id = workload["last_message"][project_id]
+            return ("GET messages (since_id)", "GET",
+                    f"/api/projects/{project_id}/messages?since_id={since_id}&limit=50", user_id, {})
+        return "POST messages", "POST", f"/api/projects/{project_id}/messages", user_id, {"json": {"content": "ping"}}
+    return pick
+
+
+def pick_transfer(delegator_ids, recipient_ids, workload):
+    """大型文件：乙方上傳新的結案文件版本，甲方下載結案文件"""
+    content = random.randbytes(workload["transfer_bytes"])
+
+    def upload():
+        return {"files": {"file": ("deliverable.zip", os.urandom(16) + content[16:], "application/zip")}}
+
+    def pick():
+        if random.random() < 0.3:
+            project_id, delegator_id, delegate_id = random.choice(workload["open"])
+            return "POST upload_closure", "POST", f"/api/projects/{project_id}/upload_closure", delegate_id, upload
+        file_id, delegator_id = random.choice(workload["closure_files"])
+        return ("GET download", "GET", f"/api/files/{file_id}/download?file_type=closure",
+                delegator_id, {})
+    return pick
+
+
+# 委託流程情境：(picker, 請求數為 --requests 的幾分之一)
+WORKFLOW_SCENARIOS = {
+    "login": (pick_login, 10),  # 每個請求都要計算一次密碼哈希
+    "browse": (pick_browse, 1),
+    "quote": (pick_quote, 1),
+    "chat": (pick_chat, 1),
+    "transfer": (pick_transfer, 10),  # 每個請求傳輸 --transfer-mb
+}
+
+
+async def run_load(concurrency, total, pick, base_url=None, timeout=5.0):
+    """以固定並發數執行 total 個請求並輸出延遲統計；指定 base_url 時經由 HTTP 送到該伺服器
+
+    pick() 回傳 (名稱, method, url, user_id, httpx 參數)；user_id 為 None 時不帶登入 cookie。
+    httpx 參數也可以是函數（上傳內容在送出時才產生，避免預先建立的佇列佔用大量記憶體）。
+    回傳 {名稱: 統計}。
+    """
+    transport = None if base_url else httpx.ASGITransport(app=webapp.app, raise_app_exceptions=False)
+    latencies = {}
+    errors = {}
+
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(pick())
+
+    async def worker():
+        async with httpx.AsyncClient(transport=transport, base_url=base_url or "http://bench", timeout=timeout) as client:
+            while True:
+                try:
+                    name, method, url, user_id, request_kwargs = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                client.cookies = auth_cookies(user_id) if user_id is not None else {}
+                if callable(request_kwargs):
+                    request_kwargs = request_kwargs()
+                start = time.perf_counter()
+                response = await client.request(method, url, **request_kwargs)
+                latencies.setdefault(name, []).append(time.perf_counter() - start)
+                if response.status_code >= 400:
+                    errors[response.status_code] = errors.get(response.status_code, 0) + 1
+
+    # 事件循環延遲：每 10ms 睡眠一次，記錄實際多等了多久
+    loop_lag = []
+    done = asyncio.Event()
+
+    async def lag_probe():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            loop_lag.append(max(0.0, time.perf_counter() - start - 0.01))
+
+    probe = asyncio.create_task(lag_probe())
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await probe
+
+    results = {name: report(name, latencies[name], elapsed) for name in sorted(latencies)}
+    results["ALL"] = report("ALL", [x for v in latencies.values() for x in v], elapsed)
+    report("event loop lag" if transport else "client event loop lag", loop_lag, elapsed)
+    if errors:
+        print(f"errors: {errors}", file=sys.stderr)
+    return results
+
+
+def start_server(workers, port):
+    """以 serve.py 啟動使用 bench 數據庫的伺服器，等到可以回應後回傳 (process, base_url)"""
+    process = subprocess.Popen(
+        [sys.executable, "serve.py", "--port", str(port), "--workers", str(workers),
+         "--no-access-log", "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{base_url}/login").status_code == 200:
+                return process, base_url
+        except httpx.TransportError:
+            pass
+        if process.poll() is not None:
+            break
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"serve.py --workers {workers} did not start")
+
+
+def stop_server(process):
+    process.terminate()  # SIGTERM：與正式環境相同的優雅關機流程
+    process.wait(timeout=60)
+
+
+def seed_closure_file(project_id, uploader_id, size_mb):
+    """寫入一個大型結案文件（直接放入內容存儲），回傳文件記錄 id"""
+    data = os.urandom(1024 * 1024)
+    fd, tmp_path = webapp.tempfile.mkstemp(dir=webapp.UPLOAD_FOLDER, prefix=".upload_", suffix=".tmp")
+    digest = webapp.hashlib.sha256()
+    with os.fdopen(fd, "wb") as f:
+        for _ in range(size_mb):
+            f.write(data)
+            digest.update(data)
+    checksum = digest.hexdigest()
+    db = webapp.SessionLocal()
+    try:
+        record = webapp.ClosureFile(
+            project_id=project_id, uploader_id=uploader_id,
+            filename=webapp._place_blob(tmp_path, checksum), original_filename="bench_deck.pptx",
+            file_size=size_mb * 1024 * 1024, checksum=checksum, version=1,
+        )
+        webapp.acquire_blob(db, checksum, record.file_size)
+        db.add(record)
+        db.commit()
+        return record.id
+    finally:
+        db.close()
+
+
+def pick_upload_race(project_id, delegate_id):
+    """同一個專案的並發上傳：約三分之一是相同的內容（共用同一個 blob），其餘各不相同"""
+    shared = random.randbytes(32 * 1024)
+
+    def upload():
+        data = shared if random.random() < 0.33 else random.randbytes(32 * 1024)
+        return {"files": {"file": ("deliverable.zip", data, "application/zip")}}
+
+    def pick():
+        return "POST upload_closure", "POST", f"/api/projects/{project_id}/upload_closure", delegate_id, upload
+    return pick
+
+
+def check_upload_integrity(project_id, expected):
+    """檢查並發上傳後的狀態，回傳不一致的項目數"""
+    db = webapp.SessionLocal()
+    try:
+        versions = [row[0] for row in db.query(webapp.ClosureFile.version).filter(
+            webapp.ClosureFile.project_id == project_id).order_by(webapp.ClosureFile.version).all()]
+        references = Counter(row[0] for model in (webapp.ProposalFile, webapp.ClosureFile)
+                             for row in db.query(model.checksum).filter(model.checksum.isnot(None)).all())
+        ref_counts = dict(db.query(webapp.FileBlob.sha256, webapp.FileBlob.ref_count).all())
+    finally:
+        db.close()
+    on_disk = {name for _, _, files in os.walk(webapp.BLOB_FOLDER) for name in files}
+    temp_files = [name for name in os.listdir(webapp.UPLOAD_FOLDER) if name.startswith(".upload_")]
+    checks = [
+        (f"{expected} 個上傳都有文件記錄", len(versions) == expected),
+        ("版本號為連續且不重複的 1..n", versions == list(range(1, len(versions) + 1))),
+        ("file_blob 引用計數等於實際引用的記錄數",
+         all(ref_counts.get(checksum) == count for checksum, count in references.items())),
+        ("被引用的內容文件都存在", all(checksum in on_disk for checksum in references)),
+        ("沒有未登記的內容文件", on_disk <= set(ref_counts)),
+        ("沒有殘留的臨時文件", not temp_files),
+    ]
+    for name, ok in checks:
+        print(f"{'✓' if ok else '✗'} {name}")
+    print(f"  {len(versions)} 個版本，{len(references)} 個不同內容，存儲目錄 {len(on_disk)} 個文件")
+    return sum(1 for _, ok in checks if not ok)
+
+
+async def download_load(repeat, file_id, delegator_id):
+    """重複下載大型文件：完整下載、帶 ETag 重新驗證 (304)、1MB 區段下載 (206)"""
+    transport = httpx.ASGITransport(app=webapp.app)
+    url = f"/api/files/{file_id}/download?file_type=closure"
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench",
+                                 cookies=auth_cookies(delegator_id)) as client:
+        first = await client.get(url)
+        etag = first.headers.get("etag")
+        cases = [
+            ("full download (200)", {}),
+            ("revalidate (304)", {"If-None-Match": etag} if etag else {}),
+            ("1MB range (206)", {"Range": "bytes=0-1048575"}),
+        ]
+        for name, headers in cases:
+            latencies, transferred = [], 0
+            start = time.perf_counter()
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                response = await client.get(url, headers=headers)
+                latencies.append(time.perf_counter() - t0)
+                transferred += len(response.content)
+            elapsed = time.perf_counter() - start
+            report(name, latencies, elapsed)
+            print(f"{'':<28} status={response.status_code} bytes/request={transferred // repeat}")
+
+
+async def auth_load(repeat, project_id, delegator_id):
+    """輕量路由在驗證快取命中與未命中（每次請求前清空快取）時的延遲，差值即為驗證開銷"""
+    transport = httpx.ASGITransport(app=webapp.app)
+    routes = [("GET dashboard", "/dashboard"),
+              ("GET messages", f"/api/projects/{project_id}/messages?since_id=0&limit=1")]
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench",
+                                 cookies=auth_cookies(delegator_id)) as client:
+        for label, url in routes:
+            means = {}
+            for name, clear in (("cold", True), ("cached", False)):
+                latencies = []
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    if clear:
+                        webapp.token_cache.clear()
+                        webapp.principal_cache.clear()
+                    t0 = time.perf_counter()
+                    await client.get(url)
+                    latencies.append(time.perf_counter() - t0)
+                elapsed = time.perf_counter() - start
+                report(f"{label} ({name})", latencies, elapsed)
+                means[name] = statistics.mean(latencies)
+            print(f"{'':<28} auth overhead ≈ {(means['cold'] - means['cached']) * 1000:.2f}ms "
+                  f"({(means['cold'] - means['cached']) / means['cold']:.0%} of a cold request)")
+
+
+async def poll_load(repeat, project_id, delegator_id, delegate_id):
+    """模擬控制台輪詢列表路由：每個路由先取一次，再重複完整請求與帶 If-None-Match 的請求"""
+    transport = httpx.ASGITransport(app=webapp.app)
+    routes = [
+        ("GET projects", "/api/projects", delegator_id),
+        ("GET history", "/api/history", delegator_id),
+        ("GET my_projects", "/api/my_projects", delegate_id),
+        ("GET closure_files", f"/api/projects/{project_id}/closure_files", delegator_id),
+    ]
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for label, url, user_id in routes:
+            client.cookies = auth_cookies(user_id)
+            etag = (await client.get(url)).headers.get("etag")
+            for name, headers in (("200", {}), ("304", {"If-None-Match": etag} if etag else {})):
+                latencies = []
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    t0 = time.perf_counter()
+                    response = await client.get(url, headers=headers)
+                    latencies.append(time.perf_counter() - t0)
+                report(f"{label} ({response.status_code})" if name == "304" else label,
+                       latencies, time.perf_counter() - start)
+    print(f"response cache: {webapp.response_cache.stats()}")
+
+
+def sample_rows(rows):
+    """建立未存入數據庫的模型物件，回傳 {格式名稱: 產生 dict 列表的函數}"""
+    now = datetime.utcnow()
+    delegator = webapp.User(id=1, username="bench_delegator", role="delegator")
+    recipient = webapp.User(id=2, username="bench_recipient", role="recipient")
+    rating = {"average": 4.3, "count": 12, "reviews": []}
+    projects = [webapp.Project(id=i, title=f"Project {i}", description="Synthetic project " * 4, status="active",
+                               delegator=delegator, delegate=recipient, delegator_id=1, delegate_id=2,
+                               deadline=now, created_at=now, updated_at=now) for i in range(rows)]
+    quotes = [webapp.Quote(id=i, recipient=recipient, recipient_id=2, amount=100.5, message="Quote message",
+                           status="pending", created_at=now,
+                           proposal_file=webapp.ProposalFile(id=i, original_filename="plan.pdf",
+                                                             filename="blobs/ab/abcdef", created_at=now))
+              for i in range(rows)]
+    messages = [webapp.Message(id=i, sender=recipient, sender_id=2, content=f"message {i} 網站設計",
+                               created_at=now) for i in range(rows)]
+    files = [webapp.ClosureFile(id=i, filename="blobs/ab/abcdef", original_filename="deck.pptx", version=1,
+                                status="pending", uploader=recipient, created_at=now) for i in range(rows)]
+    return {
+        "project": lambda: [webapp.serialize_project_summary(p, 3) for p in projects],
+        "market project": lambda: [webapp.serialize_market_project(p, rating, False, 3) for p in projects],
+        "quote": lambda: [webapp.serialize_quote(q, rating) for q in quotes],
+        "message": lambda: [webapp.serialize_message(m) for m in messages],
+        "closure file": lambda: [webapp.serialize_closure_file(f) for f in files],
+    }
+
+
+def serialization_bench(rows, repeat):
+    """比較舊的兩種序列化路徑與 FastJSONResponse（orjson）"""
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse, Response
+
+    paths = {
+        # 直接回傳 list 的路由：FastAPI 先以 jsonable_encoder 轉換，再由 JSONResponse 序列化
+        "encoder+json": lambda build: JSONResponse(content=jsonable_encoder(build())),
+        # 自行回傳 JSONResponse 的路由：只有標準庫 json（datetime 在組 dict 時呼叫 isoformat）
+        "json": lambda build: Response(json.dumps(build(), ensure_ascii=False, separators=(",", ":"),
+                                                  default=webapp._json_default)),
+        "fast": lambda build: webapp.FastJSONResponse(content=build()),
+    }
+    print(f"orjson {'enabled' if webapp.orjson else 'not installed (stdlib fallback)'}; {rows} rows per payload")
+    for shape, build in sample_rows(rows).items():
+        means = {}
+        for name, respond in paths.items():
+            latencies = []
+            start = time.perf_counter()
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                body = respond(build).body
+                latencies.append(time.perf_counter() - t0)
+            report(f"{shape} ({name})", latencies, time.perf_counter() - start)
+            means[name] = statistics.mean(latencies)
+        print(f"{'':<28} {len(body) / 1024:.0f}KB, {means['encoder+json'] / means['fast']:.1f}x / "
+              f"{means['json'] / means['fast']:.1f}x faster than encoder+json / json")
+
+
+MIN_COMPARE_SAMPLES = 100
+
+
+def baseline_params(args):
+    """影響結果的參數；比較時若與基準線不同會先提出警告"""
+    return {"scenario": args.scenario, "target": args.target, "requests": args.requests,
+            "concurrency": args.concurrency, "seed": args.seed, "delegators": args.delegators,
+            "recipients": args.recipients, "projects": args.projects, "transfer_mb": args.transfer_mb,
+            "cpu_count": os.cpu_count()}
+
+
+def save_baseline(path, args, results):
+    with open(path, "w") as f:
+        json.dump({"created_at": datetime.utcnow().isoformat(), "python": sys.version.split()[0],
+                   "params": baseline_params(args), "results": results}, f, indent=2)
+    print(f"\nBaseline saved to {path}")
+
+
+def compare_baseline(path, args, results, tolerance):
+    """與基準線比較：p95 變慢（另加 1ms 容許誤差）或 ALL 的 rps 下降超過 tolerance 即為退步，回傳退步數
+
+    樣本數少於 MIN_COMPARE_SAMPLES 的列 p95 波動太大，只列出不判定。
+    """
+    with open(path) as f:
+        baseline = json.load(f)
+    params = baseline_params(args)
+    changed = {k: (v, params.get(k)) for k, v in baseline["params"].items() if params.get(k) != v}
+    if changed:
+        print(f"\nwarning: parameters differ from the baseline (baseline, now): {changed}", file=sys.stderr)
+    print(f"\nCompared with {path} (created {baseline['created_at']}, tolerance {tolerance:.0%})")
+    regressions = 0
+    for scenario, rows in baseline["results"].items():
+        for name, before in rows.items():
+            after = results.get(scenario, {}).get(name)
+            if after is None:
+                continue
+            judged = min(before["n"], after["n"]) >= MIN_COMPARE_SAMPLES
+            slower = judged and after["p95"] > before["p95"] * (1 + tolerance) + 1.0
+            fewer = name == "ALL" and after["rps"] < before["rps"] * (1 - tolerance)
+            regressions += slower or fewer
+            verdict = "REGRESSION" if slower or fewer else "ok" if judged or name == "ALL" else "-"
+            print(f"{scenario + ' / ' + name:<44} p95 {before['p95']:8.2f} -> {after['p95']:8.2f}ms  "
+                  f"rps {before['rps']:8.1f} -> {after['rps']:8.1f}  {verdict}")
+    print(f"{regressions} regression(s)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="並發效能測試")
+    parser.add_argument("--scenario", default="mixed",
+                        choices=["mixed", "write", "download", "auth", "poll", "serialize", "serve",
+                                 "upload-race", *WORKFLOW_SCENARIOS, "suite"])
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--file-size-mb", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=None,
+                        help="download / auth / poll / serialize 情境中每種請求的次數（預設 20 / 1000 / 500 / 10）")
+    parser.add_argument("--rows", type=int, default=10000, help="serialize 情境中每個回應的筆數")
+    parser.add_argument("--workers", default=f"1,{os.cpu_count() or 1}",
+                        help="serve 情境中依序測試的 worker 數（逗號分隔）")
+    parser.add_argument("--port", type=int, default=5099, help="serve 情境與 --target http 的伺服器埠號")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--delegators", type=int, default=5)
+    parser.add_argument("--recipients", type=int, default=20)
+    parser.add_argument("--projects", type=int, default=200)
+    parser.add_argument("--transfer-mb", type=int, default=5, help="transfer 情境中每個上傳 / 下載文件的大小")
+    parser.add_argument("--uploads", type=int, default=300, help="upload-race 情境中同時送出的上傳數")
+    parser.add_argument("--target", choices=["asgi", "http"], default="asgi",
+                        help="asgi：在本進程內呼叫應用；http：以 serve.py 啟動 uvicorn（--workers 的第一個值）")
+    parser.add_argument("--save-baseline", metavar="PATH", help="把結果存成基準線 JSON")
+    parser.add_argument("--compare", metavar="PATH", help="與基準線比較，有退步時結束碼為 1")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="容許的退步比例（預設 0.25）")
+    args = parser.parse_args(argv)
+    if (args.save_baseline or args.compare) and args.scenario in ("download", "auth", "poll", "serialize",
+                                                                   "upload-race"):
+        parser.error(f"--save-baseline / --compare are not supported for the {args.scenario} scenario")
+
+    random.seed(args.seed)
+    if args.scenario == "serialize":
+        serialization_bench(args.rows, args.repeat or 10)
+        return 0
+    print(f"Seeding benchmark database at {BENCH_DB} ...")
+    delegator_ids, recipient_ids, active = seed(args.delegators, args.recipients, args.projects)
+    if args.scenario == "download":
+        project_id, delegator_id, delegate_id = active[0]
+        file_id = seed_closure_file(project_id, delegate_id, args.file_size_mb)
+        repeat = args.repeat or 20
+        print(f"Downloading a {args.file_size_mb}MB file {repeat} times per case")
+        asyncio.run(download_load(repeat, file_id, delegator_id))
+        return 0
+    if args.scenario == "auth":
+        project_id, delegator_id, delegate_id = active[0]
+        print(f"AUTH_CACHE_TTL={webapp.AUTH_CACHE_TTL} AUTH_TRUST_TOKEN_CLAIMS={webapp.AUTH_TRUST_TOKEN_CLAIMS}")
+        asyncio.run(auth_load(args.repeat or 1000, project_id, delegator_id))
+        return 0
+    if args.scenario == "poll":
+        project_id, delegator_id, delegate_id = active[0]
+        seed_closure_file(project_id, delegate_id, 1)
+        print(f"RESPONSE_CACHE_MAX_ENTRIES={webapp.RESPONSE_CACHE_MAX_ENTRIES}")
+        asyncio.run(poll_load(args.repeat or 500, project_id, delegator_id, delegate_id))
+        return 0
+    if args.scenario == "upload-race":
+        project_id, delegator_id, delegate_id = active[0]
+        process, base_url = (start_server(int(args.workers.split(",")[0]), args.port)
+                             if args.target == "http" else (None, None))
+        try:
+            print(f"\n[upload-race] {args.uploads} simultaneous uploads to project {project_id} "
+                  f"(target={args.target})")
+            # 所有上傳同時送出，排在後面的請求要等待數據庫寫入鎖，放寬客戶端逾時
+            asyncio.run(run_load(args.uploads, args.uploads, pick_upload_race(project_id, delegate_id),
+                                 base_url=base_url, timeout=120))
+        finally:
+            if process is not None:
+                stop_server(process)
+        return 1 if check_upload_integrity(project_id, args.uploads) else 0
+
+    results = {}
+    if args.scenario == "serve":
+        for workers in [int(n) for n in args.workers.split(",")]:
+            process, base_url = start_server(workers, args.port)
+            try:
+                print(f"\nserve.py --workers {workers}: {args.requests} requests with concurrency {args.concurrency}")
+                results[f"serve workers={workers}"] = asyncio.run(run_load(
+                    args.concurrency, args.requests, pick_mixed(delegator_ids, recipient_ids, active),
+                    base_url=base_url))
+            finally:
+                stop_server(process)
+    else:
+        if args.scenario in ("mixed", "write"):
+            runs = [(args.scenario, (pick_write_heavy if args.scenario == "write" else pick_mixed)(
+                delegator_ids, recipient_ids, active), args.requests)]
+        else:
+            workload = seed_workflow(recipient_ids, active, args.transfer_mb)
+            names = list(WORKFLOW_SCENARIOS) if args.scenario == "suite" else [args.scenario]
+            runs = [("mixed", pick_mixed(delegator_ids, recipient_ids, active), args.requests)] \
+                if args.scenario == "suite" else []
+            for name in names:
+                picker, divisor = WORKFLOW_SCENARIOS[name]
+                runs.append((name, picker(delegator_ids, recipient_ids, workload),
+                             max(args.concurrency, args.requests // divisor)))
+        process, base_url = (start_server(int(args.workers.split(",")[0]), args.port)
+                             if args.target == "http" else (None, None))
+        try:
+            for name, pick, total in runs:
+                print(f"\n[{name}] {total} requests with concurrency {args.concurrency} "
+                      f"(DB_PROFILE={webapp.DB_PROFILE}, target={args.target})")
+                results[name] = asyncio.run(run_load(args.concurrency, total, pick, base_url=base_url))
+        finally:
+            if process is not None:
+                stop_server(process)
+
+    if args.save_baseline:
+        save_baseline(args.save_baseline, args, results)
+    if args.compare and compare_baseline(args.compare, args, results, args.tolerance):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,685 @@
+"""管理指令：數據維護相關的命令行工具
+
+用法:
+    python manage.py migrate [--status] [--to VERSION]
+    python manage.py rebuild-ratings [--user-id ID]
+    python manage.py check-ratings
+    python manage.py migrate-blobs
+    python manage.py gc-blobs [--grace-seconds N]
+    python manage.py check-indexes
+    python manage.py rebuild-search
+    python manage.py export PATH [--format ndjson|csv] [--tables user,project,...]
+    python manage.py import PATH [--format ndjson|csv] [--batch-size N] [--append] [--reuse-password-hash]
+    python manage.py run-jobs [--once] [--status]
+    python manage.py apply-retention [--days N] [--dry-run]
+    python manage.py storage-report [--by project|user] [--limit N]
+"""
+import argparse
+import contextlib
+import csv
+import gzip
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import desc, func, select, tuple_, union_all
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from app import (
+    engine,
+    SessionLocal,
+    User,
+    Project,
+    Quote,
+    Message,
+    ProposalFile,
+    ClosureFile,
+    Review,
+    FileBlob,
+    ScheduledJob,
+    get_password_hash,
+    rebuild_rating_summaries,
+    check_rating_summaries,
+    migrate_uploads_to_blobs,
+    collect_garbage_blobs,
+    rebuild_search_index,
+    search_index_ready,
+    schedule_pending_deadlines,
+    run_due_jobs,
+    seconds_until_next_job,
+    apply_closure_retention,
+    run_migrations,
+    pending_migrations,
+    current_schema_version,
+    LATEST_SCHEMA_VERSION,
+    BLOB_GC_GRACE_SECONDS,
+    JOB_POLL_INTERVAL,
+    CLOSURE_RETENTION_DAYS,
+)
+
+
+def cmd_migrate(args):
+    """套用尚未執行的數據庫遷移，或以 --status 列出目前版本與待套用的步驟"""
+    if args.status:
+        with engine.connect() as conn:
+            current = current_schema_version(conn)
+        print(f"目前版本 {current}，最新版本 {LATEST_SCHEMA_VERSION}")
+        pending = pending_migrations()
+        for version, name in pending:
+            print(f"  待套用 {version:04d} {name}")
+        return 1 if pending else 0
+    applied = run_migrations(target=args.to)
+    print(f"✓ 已套用 {applied} 個遷移" if applied else "✓ 數據庫已是最新版本")
+    return 0
+
+
+def cmd_rebuild_ratings(args):
+    """從 review 表重建評價彙總"""
+    db = SessionLocal()
+    try:
+        count = rebuild_rating_summaries(db, user_id=args.user_id)
+        print(f"✓ 已重建 {count} 位用戶的評價彙總")
+    finally:
+        db.close()
+    return 0
+
+
+def cmd_check_ratings(args):
+    """檢查評價彙總是否與 review 表一致"""
+    db = SessionLocal()
+    try:
+        mismatches = check_rating_summaries(db)
+    finally:
+        db.close()
+    if not mismatches:
+        print("✓ 評價彙總與 review 表一致")
+        return 0
+    for m in mismatches:
+        print(f"✗ user {m['user_id']}: expected={m['expected']} actual={m['actual']}")
+    print(f"共 {len(mismatches)} 位用戶不一致，請執行 python manage.py rebuild-ratings")
+    return 1
+
+
+def cmd_migrate_blobs(args):
+    """將舊的上傳文件併入內容定址存儲"""
+    db = SessionLocal()
+    try:
+        migrated, freed = migrate_uploads_to_blobs(db)
+    finally:
+        db.close()
+    print(f"✓ 已遷移 {migrated} 筆文件記錄，去重釋放 {freed} bytes")
+    return 0
+
+
+def cmd_gc_blobs(args):
+    """回收未被引用的內容文件"""
+    db = SessionLocal()
+    try:
+        removed, freed = collect_garbage_blobs(db, grace_seconds=args.grace_seconds)
+    finally:
+        db.close()
+    print(f"✓ 已刪除 {removed} 個文件，釋放 {freed} bytes")
+    return 0
+
+
+def hot_queries():
+    """各路由使用的主要查詢（以固定參數代表）"""
+    now = datetime.utcnow()
+    return {
+        "GET /api/projects": select(Project).where(Project.delegator_id == 1),
+        "GET /api/history (delegator)": select(Project).where(
+            Project.delegator_id == 1, Project.status.in_(["completed", "closed"])),
+        "GET /api/history (recipient)": select(Project).where(
+            Project.delegate_id == 1, Project.status.in_(["completed", "closed"])),
+        "GET /api/my_projects": select(Project).where(Project.delegate_id == 1),
+        "GET /api/available_projects": select(Project).where(
+            Project.status == "pending").order_by(desc(Project.created_at), desc(Project.id)).limit(51),
+        "GET /api/available_projects?sort=deadline": select(Project).where(
+            Project.status == "pending", Project.deadline.isnot(None)).order_by(Project.deadline, Project.id).limit(51),
+        "GET /api/available_projects?sort=deadline (no deadline)": select(Project).where(
+            Project.status == "pending", Project.deadline.is_(None)).order_by(Project.id).limit(51),
+        "GET /api/available_projects (quote counts)": select(Quote.project_id, func.count(Quote.id)).where(
+            Quote.project_id.in_([1, 2, 3])).group_by(Quote.project_id),
+        "GET /api/available_projects (has_quoted)": select(Quote.project_id).where(
+            Quote.recipient_id == 1, Quote.project_id.in_([1, 2, 3])),
+        "GET /api/projects/{id}/quotes": select(Quote).where(Quote.project_id == 1),
+        "POST /api/projects/{id}/quote (duplicate check)": select(Quote).where(
+            Quote.project_id == 1, Quote.recipient_id == 1),
+        "POST /api/quotes/{id}/upload_proposal": select(ProposalFile).where(ProposalFile.quote_id == 1),
+        "GET /api/projects/{id}/messages": select(Message).where(
+            Message.project_id == 1).order_by(Message.created_at),
+        "GET /api/projects/{id}/messages?since_id=": select(Message).where(
+            Message.project_id == 1, tuple_(Message.created_at, Message.id) > (now, 1)
+        ).order_by(Message.created_at, Message.id).limit(200),
+        "GET /api/projects/{id}/closure_files": select(ClosureFile).where(
+            ClosureFile.project_id == 1).order_by(desc(func.coalesce(ClosureFile.version, 0))),
+        "POST /api/projects/{id}/upload_closure (next version)": select(func.max(ClosureFile.version)).where(
+            ClosureFile.project_id == 1),
+        "POST /api/projects/{id}/review (duplicate check)": select(Review).where(
+            Review.project_id == 1, Review.reviewer_id == 1),
+        "rebuild-ratings (recent reviews)": select(Review).where(
+            Review.reviewee_id == 1).order_by(desc(Review.created_at)).limit(5),
+        "run-jobs (due jobs)": select(ScheduledJob.id).where(
+            ScheduledJob.status == "queued", ScheduledJob.run_at <= now).order_by(ScheduledJob.run_at).limit(100),
+        "reap_blobs (proposal references)": select(func.count()).where(ProposalFile.checksum == "0" * 64),
+        "reap_blobs (closure references)": select(func.count()).where(ClosureFile.checksum == "0" * 64),
+    }
+
+
+def explain_hot_queries():
+    """以 EXPLAIN QUERY PLAN 檢查熱門查詢，回傳 {名稱: (是否使用索引, 查詢計劃)}"""
+    results = {}
+    with engine.connect() as conn:
+        for name, stmt in hot_queries().items():
+            sql = str(stmt.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+            plan = [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}").fetchall()]
+            # 「SCAN 表名」且沒有使用索引即為全表掃描
+            full_scan = any(step.startswith("SCAN") and "INDEX" not in step for step in plan)
+            results[name] = (not full_scan, plan)
+    return results
+
+
+def cmd_check_indexes(args):
+    """確認每個熱門查詢都使用索引而不是全表掃描"""
+    failures = 0
+    for name, (uses_index, plan) in explain_hot_queries().items():
+        mark = "✓" if uses_index else "✗"
+        print(f"{mark} {name}: {' | '.join(plan)}")
+        failures += 0 if uses_index else 1
+    if failures:
+        print(f"共 {failures} 個查詢使用全表掃描，請執行 python manage.py migrate 建立索引")
+        return 1
+    return 0
+
+
+def cmd_rebuild_search(args):
+    """從 project / message 表重建全文搜尋索引"""
+    db = SessionLocal()
+    try:
+        projects, messages = rebuild_search_index(db)
+    except OperationalError as e:
+        print(f"✗ 無法建立全文索引（SQLite 可能未啟用 FTS5）: {e}", file=sys.stderr)
+        return 1
+    finally:
+        db.close()
+    print(f"✓ 已重建全文索引：{projects} 個專案、{messages} 則訊息")
+    return 0
+
+
+# 匯入 / 匯出的表，依外鍵相依順序排列：匯出照此順序寫出，匯入時被參照的行一定先出現
+DATA_TABLES = {model.__table__.name: model.__table__
+               for model in (User, Project, Quote, ProposalFile, ClosureFile, Message, Review)}
+FILE_TABLES = ("proposal_file", "closure_file")  # 有 checksum，匯入後要增加 file_blob 的引用計數
+
+
+class DataImportError(Exception):
+    """匯入數據無效；訊息包含出錯的行號"""
+
+
+def open_data_file(path, mode):
+    """'-' 為標準輸入 / 輸出，.gz 結尾的路徑以 gzip 讀寫"""
+    if path == "-":
+        return contextlib.nullcontext(sys.stdin if mode == "r" else sys.stdout)
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def _export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def export_data(path, fmt, tables):
+    """匯出 tables（依 DATA_TABLES 的順序），回傳 {表名: 行數}
+
+    ndjson：寫到單一文件，每行一筆 {"table": 表名, 欄位...}；csv：path 為目錄，每個表一個 <表名>.csv。
+    所有表在同一個讀取交易中讀出，內容是一致的快照；sqlite3 游標逐批取行，不會一次載入整個表。
+    """
+    counts = {}
+    with engine.connect() as conn, conn.begin():
+        if fmt == "csv":
+            os.makedirs(path, exist_ok=True)
+        with open_data_file(path, "w") if fmt == "ndjson" else contextlib.nullcontext() as out:
+            for name in tables:
+                table = DATA_TABLES[name]
+                result = conn.execute(select(table).order_by(table.c.id))
+                columns = list(result.keys())
+                count = 0
+                if fmt == "ndjson":
+                    for row in result:
+                        record = {"table": name}
+                        record.update(zip(columns, map(_export_value, row)))
+                        out.write(json.dumps(record, ensure_ascii=False))
+                        out.write("\n")
+                        count += 1
+                else:
+                    with open(os.path.join(path, f"{name}.csv"), "w", encoding="utf-8", newline="") as f:
+                        writer = csv.writer(f)
+                        writer.writerow(columns)
+                        for row in result:
+                            writer.writerow(["" if value is None else _export_value(value) for value in row])
+                            count += 1
+                counts[name] = count
+    return counts
+
+
+def read_ndjson(path):
+    """逐行讀取 ndjson，產生 (表名, 位置, 欄位 dict)"""
+    with open_data_file(path, "r") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise DataImportError(f"第 {line_no} 行：不是有效的 JSON（{e}）") from e
+            if not isinstance(record, dict):
+                raise DataImportError(f"第 {line_no} 行：每行必須是一個 JSON 物件")
+            yield record.pop("table", None), f"第 {line_no} 行", record
+
+
+def read_csv_dir(path):
+    """依相依順序讀取目錄中的 <表名>.csv（缺少的表略過）；可為空的欄位中空字串視為 NULL"""
+    for name, table in DATA_TABLES.items():
+        file_path = os.path.join(path, f"{name}.csv")
+        if not os.path.exists(file_path):
+            continue
+        nullable = {column.name for column in table.columns if column.nullable}
+        with open(file_path, encoding="utf-8", newline="") as f:
+            for line_no, record in enumerate(csv.DictReader(f), 2):
+                for key in nullable.intersection(record):
+                    if record[key] == "":
+                        record[key] = None
+                yield name, f"{name}.csv 第 {line_no} 行", record
+
+
+def _column_converter(column):
+    """CSV 的值都是字串，依欄位型別轉換；ndjson 只有 datetime 需要轉換"""
+    python_type = column.type.python_type
+    if python_type is datetime:
+        return lambda value: datetime.fromisoformat(value) if isinstance(value, str) else value
+    if python_type in (int, float):
+        return lambda value: python_type(value) if isinstance(value, str) else value
+    return lambda value: value
+
+
+def _column_default(column):
+    """缺少欄位時使用的值：模型的預設值（datetime.utcnow 之類的函數在此呼叫）或 None"""
+    if column.default is None:
+        return lambda: None
+    if column.default.is_callable:
+        return lambda: column.default.arg(None)
+    return lambda: column.default.arg
+
+
+class BulkImporter:
+    """以 executemany 批次寫入；外鍵在寫入前於記憶體中檢查，呼叫端負責交易
+
+    - 一般模式保留原本的 id，可以參照數據庫中已存在的行（例如把專案匯入到已有的用戶下）
+    - append 模式把每個表的 id 與指向它的外鍵都加上該表目前的最大 id，匯入到已有數據的數據庫；
+      此時外鍵只能參照同一份匯入數據中的行
+    - user 行可以用 password（明文）代替 password_hash，由線程池並行計算哈希
+    """
+    def __init__(self, conn, batch_size=5000, append=False, reuse_password_hash=False):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.offsets = {}
+        self.foreign_keys = {}
+        self.columns = {}
+        for name, table in DATA_TABLES.items():
+            self.offsets[name] = (conn.execute(select(func.max(table.c.id))).scalar() or 0) if append else 0
+            self.foreign_keys[name] = [(column.name, fk.column.table.name) for column in table.columns
+                                       for fk in column.foreign_keys if fk.column.table.name in DATA_TABLES]
+            self.columns[name] = [(column.name, _column_converter(column), _column_default(column),
+                                   column.nullable or column.primary_key) for column in table.columns]
+        # 被參照的表記錄可參照的 id（一般模式包含數據庫中已有的行）
+        self.known = {}
+        for target in {target for fks in self.foreign_keys.values() for _, target in fks}:
+            table = DATA_TABLES[target]
+            self.known[target] = set() if append else set(conn.execute(select(table.c.id)).scalars())
+        self.counts = Counter()
+        self.blobs = {}  # checksum -> [size, 引用數]
+        self.password_cache = {} if reuse_password_hash else None
+        self.hash_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+        self.batch = []
+        self.batch_table = None
+        self.batch_start = None
+        self.batch_end = None
+        self.plain_passwords = []  # 目前批次中需要計算哈希的 (行, 明文)
+
+    def add(self, name, where, record):
+        if name not in DATA_TABLES:
+            raise DataImportError(f"{where}：未知的表 {name!r}")
+        if name != self.batch_table or len(self.batch) >= self.batch_size:
+            self.flush()
+            self.batch_table = name
+            self.batch_start = where
+        self.batch.append(self._convert(name, where, record))
+        self.batch_end = where
+
+    def _convert(self, name, where, record):
+        password = record.pop("password", None) if name == "user" else None
+        unknown = set(record).difference(column for column, _, _, _ in self.columns[name])
+        if unknown:
+            raise DataImportError(f"{where}：{name} 沒有欄位 {', '.join(sorted(unknown))}")
+        if record.get("id") is None:
+            raise DataImportError(f"{where}：{name} 缺少 id")
+        row = {}
+        try:
+            for column, convert, default, nullable in self.columns[name]:
+                value = record.get(column)
+                row[column] = default() if value is None else convert(value)
+                if row[column] is None and not nullable and not (column == "password_hash" and password):
+                    raise DataImportError(f"{where}：{name}.{column} 不可為空")
+        except ValueError as e:
+            raise DataImportError(f"{where}：{name}.{column} 的值無效（{e}）") from e
+
+        row["id"] += self.offsets[name]
+        for column, target in self.foreign_keys[name]:
+            if row[column] is None:
+                continue
+            row[column] += self.offsets[target]
+            if row[column] not in self.known[target]:
+                raise DataImportError(f"{where}：{name}.{column}={record[column]} 參照的 {target} 不存在")
+        if name in self.known:
+            self.known[name].add(row["id"])
+        if row.get("password_hash") is None and password:
+            self.plain_passwords.append((row, password))
+        if name in FILE_TABLES and row["checksum"]:
+            blob = self.blobs.setdefault(row["checksum"], [row["file_size"] or 0, 0])
+            blob[1] += 1
+        return row
+
+    def _hash_passwords(self):
+        """並行計算目前批次的密碼哈希（bcrypt / pbkdf2 計算時會釋放 GIL）"""
+        passwords = [password for _, password in self.plain_passwords]
+        if self.password_cache is None:
+            hashes = self.hash_executor.map(get_password_hash, passwords)
+        else:
+            missing = list({password for password in passwords if password not in self.password_cache})
+            self.password_cache.update(zip(missing, self.hash_executor.map(get_password_hash, missing)))
+            hashes = [self.password_cache[password] for password in passwords]
+        for (row, _), password_hash in zip(self.plain_passwords, hashes):
+            row["password_hash"] = password_hash
+        self.plain_passwords = []
+
+    def flush(self):
+        if not self.batch:
+            return
+        if self.plain_passwords:
+            self._hash_passwords()
+        try:
+            self.conn.execute(DATA_TABLES[self.batch_table].insert(), self.batch)
+        except IntegrityError as e:
+            raise DataImportError(
+                f"{self.batch_start}至{self.batch_end}：寫入 {self.batch_table} 失敗（{e.orig}）"
+                + ("；匯入到已有數據的數據庫請使用 --append" if "UNIQUE" in str(e.orig) and ".id" in str(e.orig) else "")
+            ) from e
+        self.counts[self.batch_table] += len(self.batch)
+        self.batch = []
+
+    def finish(self):
+        """寫入剩餘的批次，並增加匯入文件所引用內容的 file_blob 引用計數"""
+        self.flush()
+        self.hash_executor.shutdown()
+        if self.blobs:
+            stmt = sqlite_insert(FileBlob.__table__)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["sha256"],
+                set_={"ref_count": FileBlob.__table__.c.ref_count + stmt.excluded.ref_count})
+            now = datetime.utcnow()
+            self.conn.execute(stmt, [{"sha256": checksum, "size": size, "ref_count": refs, "created_at": now}
+                                     for checksum, (size, refs) in self.blobs.items()])
+
+
+def import_data(path, fmt, batch_size=5000, append=False, reuse_password_hash=False):
+    """匯入 ndjson 文件或 csv 目錄，回傳 {表名: 行數}
+
+    所有行在同一個交易中寫入，任何一行無效時整個匯入回滾。完成後重建評價彙總與全文索引
+    （這兩者由 ORM 事件維護，批次寫入不會觸發），並為有截止期限的 pending 專案排程。
+    上傳文件的內容不在匯出範圍內，需另外複製 uploads/。
+    """
+    records = read_ndjson(path) if fmt == "ndjson" else read_csv_dir(path)
+    with engine.begin() as conn:
+        importer = BulkImporter(conn, batch_size=batch_size, append=append,
+                                reuse_password_hash=reuse_password_hash)
+        try:
+            for name, where, record in records:
+                importer.add(name, where, record)
+            importer.finish()
+            if importer.counts["project"]:
+                schedule_pending_deadlines(conn)
+        finally:
+            importer.hash_executor.shutdown(cancel_futures=True)
+    db = SessionLocal()
+    try:
+        if importer.counts["review"]:
+            rebuild_rating_summaries(db)
+        if (importer.counts["project"] or importer.counts["message"]) and search_index_ready(db.connection()):
+            rebuild_search_index(db)
+    finally:
+        db.close()
+    return importer.counts
+
+
+def _print_counts(counts, elapsed):
+    total = sum(counts.values())
+    for name in DATA_TABLES:
+        if name in counts:
+            print(f"  {name:<14} {counts[name]:>10,}")
+    print(f"共 {total:,} 行，{elapsed:.1f} 秒（{total / max(elapsed, 1e-9):,.0f} 行/秒）")
+
+
+def cmd_export(args):
+    """匯出用戶、專案、報價、文件記錄、訊息與評價"""
+    tables = args.tables.split(",") if args.tables else list(DATA_TABLES)
+    unknown = [name for name in tables if name not in DATA_TABLES]
+    if unknown:
+        print(f"✗ 未知的表：{', '.join(unknown)}（可用：{', '.join(DATA_TABLES)}）", file=sys.stderr)
+        return 1
+    if args.format == "csv" and args.path == "-":
+        print("✗ csv 格式需要輸出目錄", file=sys.stderr)
+        return 1
+    tables = [name for name in DATA_TABLES if name in tables]
+    start = time.perf_counter()
+    counts = export_data(args.path, args.format, tables)
+    if args.path != "-":
+        print(f"✓ 已匯出到 {args.path}")
+        _print_counts(counts, time.perf_counter() - start)
+    return 0
+
+
+def cmd_import(args):
+    """從 export 的輸出（或相同格式的數據）批次匯入"""
+    start = time.perf_counter()
+    try:
+        counts = import_data(args.path, args.format, batch_size=args.batch_size, append=args.append,
+                             reuse_password_hash=args.reuse_password_hash)
+    except DataImportError as e:
+        print(f"✗ 匯入失敗，未寫入任何數據：{e}", file=sys.stderr)
+        return 1
+    print(f"✓ 已從 {args.path} 匯入")
+    _print_counts(counts, time.perf_counter() - start)
+    return 0
+
+
+def cmd_run_jobs(args):
+    """執行到期的背景工作；未使用 --once 時持續執行（搭配 JOB_SCHEDULER=0 取代進程內排程器）"""
+    if args.status:
+        with engine.connect() as conn:
+            counts = dict(conn.execute(select(ScheduledJob.status, func.count())
+                                       .group_by(ScheduledJob.status)).all())
+            failed = conn.execute(select(ScheduledJob).where(ScheduledJob.status == "failed")
+                                  .order_by(ScheduledJob.updated_at).limit(20)).all()
+        print("  ".join(f"{status}={counts.get(status, 0)}" for status in ("queued", "running", "done", "failed")))
+        for job in failed:
+            print(f"✗ {job.kind} #{job.target_id}（{job.attempts} 次）: {job.last_error}")
+        return 1 if failed else 0
+    if args.once:
+        print(f"✓ 已執行 {run_due_jobs()} 個工作")
+        return 0
+    print("執行背景工作中，按 Ctrl+C 停止")
+    try:
+        while True:
+            count = run_due_jobs()
+            if count:
+                print(f"{datetime.now():%Y-%m-%d %H:%M:%S} 已執行 {count} 個工作")
+            time.sleep(seconds_until_next_job(args.poll_interval))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def cmd_apply_retention(args):
+    """刪除超過保留天數、已被新版本取代的結案文件，並排程回收不再被引用的內容"""
+    if args.days <= 0:
+        print("✗ 請以 --days 或 CLOSURE_RETENTION_DAYS 指定保留天數", file=sys.stderr)
+        return 1
+    db = SessionLocal()
+    try:
+        count, size = apply_closure_retention(db, args.days, dry_run=args.dry_run)
+    finally:
+        db.close()
+    if args.dry_run:
+        print(f"✓ 將刪除 {count} 個舊版本結案文件（{_format_bytes(size)}），未做任何變更")
+    else:
+        print(f"✓ 已刪除 {count} 個舊版本結案文件（{_format_bytes(size)}），"
+              f"內容由背景工作回收（或執行 python manage.py run-jobs --once）")
+    return 0
+
+
+def _format_bytes(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def storage_usage(by="project", limit=20):
+    """各專案或用戶的文件數、記錄的 bytes、去重後的 bytes 與訊息數，依文件大小排序"""
+    files = union_all(
+        select(ProposalFile.project_id, ProposalFile.uploader_id.label("user_id"),
+               ProposalFile.checksum, ProposalFile.filename, ProposalFile.file_size),
+        select(ClosureFile.project_id, ClosureFile.uploader_id.label("user_id"),
+               ClosureFile.checksum, ClosureFile.filename, ClosureFile.file_size),
+    ).subquery()
+    key = files.c.project_id if by == "project" else files.c.user_id
+    # 同一專案（用戶）內相同內容只存儲一次；尚未遷移到內容存儲的舊文件以文件名區分
+    unique = select(key.label("key"), func.max(files.c.file_size).label("size")).group_by(
+        key, func.coalesce(files.c.checksum, files.c.filename)).subquery()
+    totals = select(key.label("key"), func.count().label("files"),
+                    func.coalesce(func.sum(files.c.file_size), 0).label("size")).group_by(key).subquery()
+    unique_totals = select(unique.c.key, func.coalesce(func.sum(unique.c.size), 0).label("size")).group_by(
+        unique.c.key).subquery()
+    message_key = Message.project_id if by == "project" else Message.sender_id
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(totals.c.key, totals.c.files, totals.c.size, unique_totals.c.size.label("unique_size"))
+            .join(unique_totals, unique_totals.c.key == totals.c.key)
+            .order_by(desc(totals.c.size), totals.c.key).limit(limit)
+        ).all()
+        keys = [row.key for row in rows]
+        messages = dict(conn.execute(select(message_key, func.count()).where(
+            message_key.in_(keys)).group_by(message_key)).all())
+        if by == "project":
+            labels = dict(conn.execute(select(Project.id, Project.title).where(Project.id.in_(keys))).all())
+        else:
+            labels = dict(conn.execute(select(User.id, User.username).where(User.id.in_(keys))).all())
+        blobs = conn.execute(select(
+            func.count(), func.coalesce(func.sum(FileBlob.size), 0),
+            func.coalesce(func.sum(FileBlob.size).filter(FileBlob.ref_count <= 0), 0),
+        )).one()
+    usage = [{
+        "id": row.key, "label": labels.get(row.key, "?"), "files": row.files, "size": row.size,
+        "unique_size": row.unique_size, "messages": messages.get(row.key, 0),
+    } for row in rows]
+    return usage, {"blobs": blobs[0], "stored": blobs[1], "reclaimable": blobs[2]}
+
+
+def cmd_storage_report(args):
+    """列出使用最多存儲空間的專案或用戶，以及內容存儲的總量與待回收的量"""
+    usage, totals = storage_usage(args.by, args.limit)
+    print(f"{args.by:>8} {'files':>7} {'size':>10} {'unique':>10} {'messages':>9}  name")
+    for row in usage:
+        print(f"{row['id']:>8} {row['files']:>7} {_format_bytes(row['size']):>10} "
+              f"{_format_bytes(row['unique_size']):>10} {row['messages']:>9}  {row['label']}")
+    print(f"內容存儲共 {totals['blobs']} 個文件、{_format_bytes(totals['stored'])}，"
+          f"待回收 {_format_bytes(totals['reclaimable'])}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Project Delegation Platform 管理工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("migrate", help="套用數據庫遷移")
+    p.add_argument("--status", action="store_true", help="只顯示目前版本與待套用的遷移")
+    p.add_argument("--to", type=int, default=None, help="只遷移到指定版本")
+    p.set_defaults(func=cmd_migrate)
+
+    p = sub.add_parser("rebuild-ratings", help="重建用戶評價彙總")
+    p.add_argument("--user-id", type=int, default=None, help="只重建指定用戶")
+    p.set_defaults(func=cmd_rebuild_ratings)
+
+    p = sub.add_parser("check-ratings", help="檢查評價彙總一致性")
+    p.set_defaults(func=cmd_check_ratings)
+
+    p = sub.add_parser("migrate-blobs", help="將舊上傳文件併入內容定址存儲")
+    p.set_defaults(func=cmd_migrate_blobs)
+
+    p = sub.add_parser("gc-blobs", help="回收未被引用的上傳文件")
+    p.add_argument("--grace-seconds", type=int, default=BLOB_GC_GRACE_SECONDS,
+                   help="只回收修改時間早於此秒數的文件")
+    p.set_defaults(func=cmd_gc_blobs)
+
+    p = sub.add_parser("check-indexes", help="以 EXPLAIN QUERY PLAN 檢查熱門查詢是否使用索引")
+    p.set_defaults(func=cmd_check_indexes)
+
+    p = sub.add_parser("rebuild-search", help="重建全文搜尋索引")
+    p.set_defaults(func=cmd_rebuild_search)
+
+    p = sub.add_parser("export", help="匯出數據為 ndjson 或 csv")
+    p.add_argument("path", help="ndjson 文件（- 為標準輸出，.gz 結尾時壓縮）或 csv 輸出目錄")
+    p.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    p.add_argument("--tables", default=None, help=f"只匯出指定的表（逗號分隔：{','.join(DATA_TABLES)}）")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("import", help="從 ndjson 或 csv 批次匯入數據")
+    p.add_argument("path", help="ndjson 文件（- 為標準輸入，.gz 結尾時解壓）或 csv 目錄")
+    p.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    p.add_argument("--batch-size", type=int, default=5000, help="每次 executemany 的行數")
+    p.add_argument("--append", action="store_true",
+                   help="id 加上各表目前的最大 id，匯入到已有數據的數據庫")
+    p.add_argument("--reuse-password-hash", action="store_true",
+                   help="相同的明文密碼只計算一次哈希（共用 salt，只適合測試環境）")
+    p.set_defaults(func=cmd_import)
+
+    p = sub.add_parser("run-jobs", help="執行到期的背景工作（截止期限處理等）")
+    p.add_argument("--once", action="store_true", help="只執行目前到期的工作後結束")
+    p.add_argument("--status", action="store_true", help="顯示各狀態的工作數與失敗的工作")
+    p.add_argument("--poll-interval", type=float, default=JOB_POLL_INTERVAL,
+                   help="沒有更早到期的工作時最長的等待秒數")
+    p.set_defaults(func=cmd_run_jobs)
+
+    p = sub.add_parser("apply-retention", help="刪除超過保留天數的舊版本結案文件")
+    p.add_argument("--days", type=int, default=CLOSURE_RETENTION_DAYS,
+                   help="保留天數（預設 CLOSURE_RETENTION_DAYS）")
+    p.add_argument("--dry-run", action="store_true", help="只顯示會刪除的數量")
+    p.set_defaults(func=cmd_apply_retention)
+
+    p = sub.add_parser("storage-report", help="各專案或用戶的存儲用量")
+    p.add_argument("--by", choices=["project", "user"], default="project")
+    p.add_argument("--limit", type=int, default=20, help="列出的筆數")
+    p.set_defaults(func=cmd_storage_report)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
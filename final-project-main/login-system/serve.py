@@ -0,0 +1,138 @@
+"""正式環境啟動器：多 worker 進程、uvloop/httptools、優雅關機
+
+用法:
+    python serve.py [--host 0.0.0.0] [--port 8000] [--workers N]
+    python serve.py --keep-alive 15 --backlog 2048 --graceful-timeout 30 --max-requests 50000
+
+啟動流程:
+    1. 主進程執行一次 app.run_migrations()，之後才啟動 worker（匯入 app 本身不連線數據庫）
+    2. APP_WORKERS 大於 1 時，SSE 事件與回應快取失效改經由數據庫在 worker 之間傳遞
+    3. 收到 SIGTERM / SIGINT 時停止接受新連線、關閉 SSE 串流（客戶端會自動重連），
+       並等待處理中的請求完成，最多 --graceful-timeout 秒
+    4. 意外結束（或達到 --max-requests）的 worker 會被重新啟動
+    5. 多 worker 時各 worker 的指標寫到 METRICS_DIR，/metrics 回傳所有 worker 的總和
+
+開發時仍可使用 python app.py（單進程、reload=True）。
+"""
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+import uvicorn
+from uvicorn._subprocess import get_subprocess
+from uvicorn.supervisors import Multiprocess
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def default_workers():
+    return int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1))
+
+
+def available(module, name):
+    """已安裝 module 時使用 name，否則交給 uvicorn 自動選擇"""
+    try:
+        __import__(module)
+    except ImportError:
+        return "auto"
+    return name
+
+
+class DrainingServer(uvicorn.Server):
+    """收到關機信號時先關閉 SSE 串流；否則長連線會讓關機一直等到 graceful timeout"""
+
+    def handle_exit(self, sig, frame):
+        webapp = sys.modules.get("app")
+        if webapp is not None and not self.should_exit:
+            webapp.event_broker.close_all()
+        super().handle_exit(sig, frame)
+
+
+class WorkerSupervisor(Multiprocess):
+    """uvicorn 的 Multiprocess 加上 worker 監控：結束的 worker 會被重新啟動"""
+
+    def run(self):
+        self.startup()
+        while not self.should_exit.wait(1.0):
+            for i, process in enumerate(self.processes):
+                if process.is_alive():
+                    continue
+                logger.warning("Worker [%s] exited with code %s, restarting", process.pid, process.exitcode)
+                process = get_subprocess(config=self.config, target=self.target, sockets=self.sockets)
+                process.start()
+                self.processes[i] = process
+        self.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Project Delegation Platform 正式環境啟動器")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8000)))
+    parser.add_argument("--workers", type=int, default=default_workers(),
+                        help="worker 進程數（預設 WEB_CONCURRENCY 或 CPU 數）")
+    parser.add_argument("--keep-alive", type=int, default=15,
+                        help="閒置 keep-alive 連線保留秒數；放在反向代理後面時應大於代理的設定")
+    parser.add_argument("--backlog", type=int, default=2048, help="listen() 等待佇列長度")
+    parser.add_argument("--graceful-timeout", type=int, default=30,
+                        help="關機時等待處理中請求完成的最長秒數")
+    parser.add_argument("--max-requests", type=int, default=None,
+                        help="每個 worker 處理此數量的請求後重新啟動")
+    parser.add_argument("--limit-concurrency", type=int, default=None,
+                        help="每個 worker 同時處理的連線上限，超過時回傳 503")
+    parser.add_argument("--forwarded-allow-ips", default=os.environ.get("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+                        help="信任其 X-Forwarded-* 標頭的代理 IP（逗號分隔）")
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--no-access-log", action="store_true", help="關閉每個請求的存取日誌")
+    args = parser.parse_args(argv)
+
+    # 啟動 worker 前的一次性工作
+    os.environ["APP_WORKERS"] = str(args.workers)
+    metrics_dir = None
+    if os.environ.get("METRICS_DIR"):
+        # 清除上次執行留下的快照，避免舊進程的數據被計入
+        for filename in os.listdir(os.environ["METRICS_DIR"]):
+            if filename.endswith(".json"):
+                os.remove(os.path.join(os.environ["METRICS_DIR"], filename))
+    elif args.workers > 1:
+        # 各 worker 把指標快照寫到同一個目錄，/metrics 由任一 worker 彙總回應
+        metrics_dir = tempfile.mkdtemp(prefix="metrics_")
+        os.environ["METRICS_DIR"] = metrics_dir
+    import app as webapp
+    webapp.run_migrations()
+    webapp.engine.dispose()
+
+    config = uvicorn.Config(
+        "app:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop=available("uvloop", "uvloop"),
+        http=available("httptools", "httptools"),
+        timeout_keep_alive=args.keep_alive,
+        backlog=args.backlog,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        limit_max_requests=args.max_requests,
+        limit_concurrency=args.limit_concurrency,
+        forwarded_allow_ips=args.forwarded_allow_ips,
+        proxy_headers=True,
+        log_level=args.log_level,
+        access_log=not args.no_access_log,
+    )
+    server = DrainingServer(config)
+    try:
+        if args.workers > 1:
+            sock = config.bind_socket()
+            WorkerSupervisor(config, target=server.run, sockets=[sock]).run()
+        else:
+            server.run()
+    finally:
+        if metrics_dir:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
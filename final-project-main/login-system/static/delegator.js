@@ -1,5 +1,37 @@
 let currentProjectId = null;
 let currentView = 'projects';
+const MESSAGE_PAGE_SIZE = 50;
+let lastMessageId = null;
+let olderMessagesCursor = null;
+
+// ### 即時事件：對話框開啟時訂閱專案事件 (Server-Sent Events) ###
+const PROJECT_EVENT_TYPES = ['message.created', 'quote.submitted', 'closure_file.uploaded', 'closure_file.returned', 'delegate.selected', 'project.closed', 'project.deadline_passed'];
+let projectEvents = null;
+let projectEventsProjectId = null;
+let projectEventHandlers = {};
+
+function subscribeProjectEvents(projectId, handlers) {
+    projectEventHandlers = handlers;
+    if (projectEvents && projectEventsProjectId === projectId) return;
+    
+    unsubscribeProjectEvents();
+    projectEventHandlers = handlers;
+    projectEventsProjectId = projectId;
+    projectEvents = new EventSource(`/api/projects/${projectId}/events`);
+    PROJECT_EVENT_TYPES.forEach(type => {
+        projectEvents.addEventListener(type, event => {
+            const handler = projectEventHandlers[type];
+            if (handler) handler(JSON.parse(event.data));
+        });
+    });
+}
+
+function unsubscribeProjectEvents() {
+    if (projectEvents) projectEvents.close();
+    projectEvents = null;
+    projectEventsProjectId = null;
+    projectEventHandlers = {};
+}
 
 // Load projects on page load
 document.addEventListener('DOMContentLoaded', function() {
@@ -26,6 +58,11 @@ function setupEventListeners() {
     
     document.getElementById('projectForm').addEventListener('submit', saveProject);
     document.getElementById('messageForm').addEventListener('submit', sendMessage);
+    document.getElementById('searchForm').addEventListener('submit', function(e) {
+        e.preventDefault();
+        currentView = 'search';
+        runSearch();
+    });
 }
 
 async function loadProjects() {
@@ -58,6 +95,8 @@ function createProjectCard(project) {
     
     const statusText = {
         'pending': '待處理',
+        'awaiting_selection': '待選擇受託人',
+        'expired': '已過期',
         'active': '進行中',
         'completed': '已完成',
         'closed': '已結案'
@@ -75,11 +114,15 @@ function createProjectCard(project) {
         <p><strong>創建時間：</strong> ${new Date(project.created_at).toLocaleDateString()}</p>
         ${project.deadline ? `<p><strong>提案截止期限：</strong> ${new Date(project.deadline).toLocaleString()}</p>` : ''}
         ${project.delegate_name ? `<p><strong>受託人：</strong> ${project.delegate_name}</p>` : ''}
-        ${project.status === 'pending' ? `<p><strong>報價數：</strong> ${project.quote_count}</p>` : ''}
+        ${project.status === 'pending' || project.status === 'awaiting_selection' ? `<p><strong>報價數：</strong> ${project.quote_count}</p>` : ''}
         <div class="project-actions">
-            ${project.status === 'pending' ? `
+            ${project.status === 'pending' || project.status === 'expired' ? `
                 <button class="btn btn-primary" onclick="editProject(${project.id})">編輯</button>
+            ` : ''}
+            ${project.status === 'pending' || project.status === 'awaiting_selection' ? `
                 <button class="btn btn-success" onclick="viewQuotes(${project.id})">查看報價 (${project.quote_count})</button>
+            ` : ''}
+            ${project.status === 'pending' || project.status === 'awaiting_selection' || project.status === 'expired' ? `
                 <button class="btn btn-danger" onclick="deleteProject(${project.id})">刪除</button>
             ` : ''}
             ${project.status === 'active' || project.status === 'closed' ? `
@@ -218,7 +261,7 @@ async function viewQuotes(projectId) {
                 const ratingHtml = `<span style="cursor:pointer; color:#f39c12; font-size:0.9em; margin-left:8px;" onclick='showUserReviews(${JSON.stringify(quote.recipient_rating.reviews)}, ${quote.recipient_rating.count}, ${quote.recipient_rating.average})'>★ ${quote.recipient_rating.average} (${quote.recipient_rating.count})</span>`;
                 
                 quoteCard.innerHTML = `
-                    <h4>來自：${quote.recipient_name} ${ratingHtml}</h4>
+                    <h4>來自：${quote.recipient_name} ${ratingHtml}${quote.shortlist_rank ? ` <span class="status-badge status-shortlisted">推薦 #${quote.shortlist_rank}</span>` : ''}</h4>
                     <p><strong>金額：</strong> ${quote.amount.toFixed(2)} 元</p>
                     ${quote.message ? `<p>${quote.message}</p>` : ''}
                     ${quote.proposal_file ? `
@@ -239,6 +282,10 @@ async function viewQuotes(projectId) {
         }
         
         document.getElementById('quotesModal').style.display = 'block';
+        subscribeProjectEvents(projectId, {
+            'quote.submitted': () => viewQuotes(projectId),
+            'project.deadline_passed': () => { viewQuotes(projectId); loadProjects(); }
+        });
     } catch (error) {
         alert('載入報價時出錯');
         console.error(error);
@@ -272,6 +319,74 @@ async function selectDelegate(projectId, quoteId) {
     }
 }
 
+// ### 全文搜尋：專案標題 / 描述與訊息 ###
+let searchCursor = null;
+
+function createSearchResultElement(result, scope) {
+    const card = document.createElement('div');
+    card.className = 'project-card search-result';
+    const title = document.createElement('h3');
+    const body = document.createElement('p');
+    if (scope === 'messages') {
+        title.textContent = result.project_title;
+        body.innerHTML = result.snippet;  // 伺服器已轉義，只保留 <mark>
+        const meta = document.createElement('p');
+        meta.textContent = `${result.sender_name} · ${new Date(result.created_at).toLocaleString()}`;
+        card.append(title, body, meta);
+        card.style.cursor = 'pointer';
+        card.addEventListener('click', () => viewMessages(result.project_id, result.project_title));
+    } else {
+        title.innerHTML = result.title_snippet;
+        body.innerHTML = result.snippet;
+        const meta = document.createElement('p');
+        meta.textContent = `${result.delegator_name} · ${result.status}`;
+        card.append(title, body, meta);
+    }
+    return card;
+}
+
+async function runSearch(append = false) {
+    const q = document.getElementById('searchQuery').value.trim();
+    if (!q) return;
+    const scope = document.getElementById('searchScope').value;
+    const params = new URLSearchParams({ q, scope });
+    if (append && searchCursor) params.set('cursor', searchCursor);
+    
+    try {
+        const response = await fetch(`/api/search?${params}`);
+        const results = await response.json();
+        if (!response.ok) {
+            alert(results.error || '搜尋時出錯');
+            return;
+        }
+        searchCursor = response.headers.get('X-Next-Cursor');
+        
+        const container = document.getElementById('projectsList');
+        let list = document.getElementById('searchResults');
+        if (!append || !list) {
+            container.innerHTML = '<h2>搜尋結果</h2><div id="searchResults"></div>';
+            list = document.getElementById('searchResults');
+        }
+        if (!append && results.length === 0) {
+            list.innerHTML = '<div class="empty-state"><p>沒有符合的結果。</p></div>';
+        }
+        results.forEach(result => list.appendChild(createSearchResultElement(result, scope)));
+        
+        let button = document.getElementById('loadMoreSearch');
+        if (button) button.remove();
+        if (searchCursor) {
+            button = document.createElement('button');
+            button.id = 'loadMoreSearch';
+            button.className = 'btn btn-secondary';
+            button.textContent = '載入更多結果';
+            button.onclick = () => runSearch(true);
+            list.after(button);
+        }
+    } catch (error) {
+        console.error('Error searching:', error);
+    }
+}
+
 async function viewMessages(projectId, projectTitle) {
     currentProjectId = projectId;
     document.getElementById('messagesTitle').textContent = `訊息 - ${projectTitle}`;
@@ -279,12 +394,48 @@ async function viewMessages(projectId, projectTitle) {
     
     await loadMessages(projectId);
     document.getElementById('messagesModal').style.display = 'block';
+    subscribeProjectEvents(projectId, {
+        'message.created': () => loadNewMessages(projectId)
+    });
 }
 
+function createMessageElement(message) {
+    const messageDiv = document.createElement('div');
+    messageDiv.className = 'message-item';
+    messageDiv.innerHTML = `
+        <div class="message-header">
+            ${message.sender_name}
+            <span class="message-time">${new Date(message.created_at).toLocaleString()}</span>
+        </div>
+        <div class="message-body">${message.content}</div>
+    `;
+    return messageDiv;
+}
+
+function updateOlderMessagesButton(projectId) {
+    const container = document.getElementById('messagesContainer');
+    let button = document.getElementById('loadOlderMessages');
+    if (!olderMessagesCursor) {
+        if (button) button.remove();
+        return;
+    }
+    if (!button) {
+        button = document.createElement('button');
+        button.id = 'loadOlderMessages';
+        button.className = 'btn btn-sm btn-link';
+        button.textContent = '載入更早的訊息';
+        container.prepend(button);
+    }
+    button.onclick = () => loadOlderMessages(projectId);
+}
+
+// 首次載入最近的訊息
 async function loadMessages(projectId) {
     try {
-        const response = await fetch(`/api/projects/${projectId}/messages`);
+        const response = await fetch(`/api/projects/${projectId}/messages?limit=${MESSAGE_PAGE_SIZE}`);
         const messages = await response.json();
+        olderMessagesCursor = response.headers.get('X-Next-Cursor');
+        lastMessageId = messages.length > 0 ? messages[messages.length - 1].id : null;
         
         const container = document.getElementById('messagesContainer');
         container.innerHTML = '';
@@ -292,19 +443,9 @@ async function loadMessages(projectId) {
         if (messages.length === 0) {
             container.innerHTML = '<div class="empty-state"><p>還沒有訊息。開始對話吧！</p></div>';
         } else {
-            messages.forEach(message => {
-                const messageDiv = document.createElement('div');
-                messageDiv.className = 'message-item';
-                messageDiv.innerHTML = `
-                    <div class="message-header">
-                        ${message.sender_name}
-                        <span class="message-time">${new Date(message.created_at).toLocaleString()}</span>
-                    </div>
-                    <div class="message-body">${message.content}</div>
-                `;
-                container.appendChild(messageDiv);
-            });
+            messages.forEach(message => container.appendChild(createMessageElement(message)));
         }
+        updateOlderMessagesButton(projectId);
         
         container.scrollTop = container.scrollHeight;
     } catch (error) {
@@ -312,6 +453,54 @@ async function loadMessages(projectId) {
     }
 }
 
+// 只取得最後一則之後的新訊息並附加到列表
+async function loadNewMessages(projectId) {
+    if (lastMessageId === null) {
+        await loadMessages(projectId);
+        return;
+    }
+    try {
+        const response = await fetch(`/api/projects/${projectId}/messages?since_id=${lastMessageId}`);
+        const messages = await response.json();
+        if (messages.length === 0) return;
+        
+        // 發送訊息與即時事件可能同時觸發，略過已顯示的訊息
+        const unseen = messages.filter(message => lastMessageId === null || message.id > lastMessageId);
+        if (unseen.length === 0) return;
+        
+        const container = document.getElementById('messagesContainer');
+        const emptyState = container.querySelector('.empty-state');
+        if (emptyState) emptyState.remove();
+        unseen.forEach(message => container.appendChild(createMessageElement(message)));
+        lastMessageId = unseen[unseen.length - 1].id;
+        
+        container.scrollTop = container.scrollHeight;
+    } catch (error) {
+        console.error('Error loading messages:', error);
+    }
+}
+
+async function loadOlderMessages(projectId) {
+    if (!olderMessagesCursor) return;
+    try {
+        const cursor = encodeURIComponent(olderMessagesCursor);
+        const response = await fetch(`/api/projects/${projectId}/messages?limit=${MESSAGE_PAGE_SIZE}&before=${cursor}`);
+        const messages = await response.json();
+        olderMessagesCursor = response.headers.get('X-Next-Cursor');
+        
+        const container = document.getElementById('messagesContainer');
+        const previousHeight = container.scrollHeight;
+        const button = document.getElementById('loadOlderMessages');
+        const anchor = button ? button.nextSibling : container.firstChild;
+        messages.forEach(message => container.insertBefore(createMessageElement(message), anchor));
+        updateOlderMessagesButton(projectId);
+        
+        container.scrollTop += container.scrollHeight - previousHeight;
+    } catch (error) {
+        console.error('Error loading messages:', error);
+    }
+}
+
 async function sendMessage(e) {
     e.preventDefault();
     
@@ -331,7 +520,7 @@ async function sendMessage(e) {
         
         if (data.success) {
             document.getElementById('messageContent').value = '';
-            await loadMessages(projectId);
+            await loadNewMessages(projectId);
         } else {
             alert(data.error || '發送訊息時出錯');
         }
@@ -395,10 +584,12 @@ function closeProjectModal() {
 
 function closeQuotesModal() {
     document.getElementById('quotesModal').style.display = 'none';
+    unsubscribeProjectEvents();
 }
 
 function closeMessagesModal() {
     document.getElementById('messagesModal').style.display = 'none';
+    unsubscribeProjectEvents();
 }
 
 async function viewClosureFiles(projectId) {
@@ -451,6 +642,9 @@ async function viewClosureFiles(projectId) {
         const modal = document.getElementById('closureFilesModal');
         if (modal) {
             modal.style.display = 'block';
+            subscribeProjectEvents(projectId, {
+                'closure_file.uploaded': () => viewClosureFiles(projectId)
+            });
         } else {
             console.error('找不到 closureFilesModal 元素');
         }
@@ -514,6 +708,7 @@ async function returnClosureFile(projectId, fileId) {
 
 function closeClosureFilesModal() {
     document.getElementById('closureFilesModal').style.display = 'none';
+    unsubscribeProjectEvents();
 }
 
 // ### 新增功能：評價系統相關邏輯 ###
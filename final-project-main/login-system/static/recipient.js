@@ -1,4 +1,36 @@
 let currentView = 'available';
+const MESSAGE_PAGE_SIZE = 50;
+let lastMessageId = null;
+let olderMessagesCursor = null;
+
+// ### 即時事件：對話框開啟時訂閱專案事件 (Server-Sent Events) ###
+const PROJECT_EVENT_TYPES = ['message.created', 'quote.submitted', 'closure_file.uploaded', 'closure_file.returned', 'delegate.selected', 'project.closed'];
+let projectEvents = null;
+let projectEventsProjectId = null;
+let projectEventHandlers = {};
+
+function subscribeProjectEvents(projectId, handlers) {
+    projectEventHandlers = handlers;
+    if (projectEvents && projectEventsProjectId === projectId) return;
+    
+    unsubscribeProjectEvents();
+    projectEventHandlers = handlers;
+    projectEventsProjectId = projectId;
+    projectEvents = new EventSource(`/api/projects/${projectId}/events`);
+    PROJECT_EVENT_TYPES.forEach(type => {
+        projectEvents.addEventListener(type, event => {
+            const handler = projectEventHandlers[type];
+            if (handler) handler(JSON.parse(event.data));
+        });
+    });
+}
+
+function unsubscribeProjectEvents() {
+    if (projectEvents) projectEvents.close();
+    projectEvents = null;
+    projectEventsProjectId = null;
+    projectEventHandlers = {};
+}
 
 // Load available projects on page load
 document.addEventListener('DOMContentLoaded', function() {
@@ -32,17 +64,96 @@ function setupEventListeners() {
     document.getElementById('quoteForm').addEventListener('submit', submitQuote);
     document.getElementById('messageForm').addEventListener('submit', sendMessage);
     document.getElementById('uploadForm').addEventListener('submit', uploadClosureFile);
+    document.getElementById('searchForm').addEventListener('submit', function(e) {
+        e.preventDefault();
+        currentView = 'search';
+        runSearch();
+    });
+}
+
+// ### 市場列表：伺服器端分頁、篩選與排序 ###
+const AVAILABLE_PAGE_SIZE = 50;
+let availableProjectsCursor = null;
+
+// 切換到其他分頁後 dashboardContent 會被取代，需要時重新建立列表與篩選列
+function ensureAvailableSection() {
+    if (document.getElementById('availableSort')) return;
+    document.getElementById('dashboardContent').innerHTML = `
+        <div class="dashboard-section">
+            <h2>可用項目</h2>
+            <div class="available-filters">
+                <select id="availableSort">
+                    <option value="newest">最新發布</option>
+                    <option value="deadline">截止期限最近</option>
+                </select>
+                <select id="availableMinRating">
+                    <option value="">甲方評價不限</option>
+                    <option value="3">★ 3 以上</option>
+                    <option value="4">★ 4 以上</option>
+                </select>
+                <label>截止於 <input type="date" id="availableDeadlineBefore"> 之前</label>
+                <label><input type="checkbox" id="availableNotQuoted"> 只顯示未報價</label>
+            </div>
+            <div id="availableProjectsList"></div>
+        </div>
+    `;
+}
+
+function bindAvailableFilters() {
+    ['availableSort', 'availableMinRating', 'availableDeadlineBefore', 'availableNotQuoted'].forEach(id => {
+        const element = document.getElementById(id);
+        if (element && !element.dataset.bound) {
+            element.dataset.bound = '1';
+            element.addEventListener('change', () => loadAvailableProjects());
+        }
+    });
+}
+
+function availableProjectsQuery() {
+    const params = new URLSearchParams({
+        limit: AVAILABLE_PAGE_SIZE,
+        sort: document.getElementById('availableSort').value
+    });
+    const minRating = document.getElementById('availableMinRating').value;
+    if (minRating) params.set('min_rating', minRating);
+    const deadlineBefore = document.getElementById('availableDeadlineBefore').value;
+    if (deadlineBefore) params.set('deadline_before', `${deadlineBefore}T23:59:59`);
+    if (document.getElementById('availableNotQuoted').checked) params.set('not_quoted', 'true');
+    return params;
 }
 
-async function loadAvailableProjects() {
+function updateMoreProjectsButton() {
+    const container = document.getElementById('availableProjectsList');
+    let button = document.getElementById('loadMoreProjects');
+    if (!availableProjectsCursor) {
+        if (button) button.remove();
+        return;
+    }
+    if (!button) {
+        button = document.createElement('button');
+        button.id = 'loadMoreProjects';
+        button.className = 'btn btn-secondary';
+        button.textContent = '載入更多項目';
+        button.onclick = () => loadAvailableProjects(true);
+    }
+    container.appendChild(button);
+}
+
+async function loadAvailableProjects(append = false) {
     try {
-        const response = await fetch('/api/available_projects');
+        ensureAvailableSection();
+        bindAvailableFilters();
+        
+        const params = availableProjectsQuery();
+        if (append && availableProjectsCursor) params.set('cursor', availableProjectsCursor);
+        const response = await fetch(`/api/available_projects?${params}`);
         const projects = await response.json();
+        availableProjectsCursor = response.headers.get('X-Next-Cursor');
         
         const container = document.getElementById('availableProjectsList');
-        container.innerHTML = '';
+        if (!append) container.innerHTML = '';
         
-        if (projects.length === 0) {
+        if (!append && projects.length === 0) {
             container.innerHTML = '<div class="empty-state"><p>目前沒有可用項目。</p></div>';
             return;
         }
@@ -51,6 +162,7 @@ async function loadAvailableProjects() {
             const card = createAvailableProjectCard(project);
             container.appendChild(card);
         });
+        updateMoreProjectsButton();
     } catch (error) {
         console.error('Error loading available projects:', error);
     }
@@ -209,18 +321,122 @@ async function submitQuote(e) {
     }
 }
 
+// ### 全文搜尋：專案標題 / 描述與訊息 ###
+let searchCursor = null;
+
+function createSearchResultElement(result, scope) {
+    const card = document.createElement('div');
+    card.className = 'project-card search-result';
+    const title = document.createElement('h3');
+    const body = document.createElement('p');
+    if (scope === 'messages') {
+        title.textContent = result.project_title;
+        body.innerHTML = result.snippet;  // 伺服器已轉義，只保留 <mark>
+        const meta = document.createElement('p');
+        meta.textContent = `${result.sender_name} · ${new Date(result.created_at).toLocaleString()}`;
+        card.append(title, body, meta);
+        card.style.cursor = 'pointer';
+        card.addEventListener('click', () => viewMessages(result.project_id, result.project_title));
+    } else {
+        title.innerHTML = result.title_snippet;
+        body.innerHTML = result.snippet;
+        const meta = document.createElement('p');
+        meta.textContent = `${result.delegator_name} · ${result.status}`;
+        card.append(title, body, meta);
+    }
+    return card;
+}
+
+async function runSearch(append = false) {
+    const q = document.getElementById('searchQuery').value.trim();
+    if (!q) return;
+    const scope = document.getElementById('searchScope').value;
+    const params = new URLSearchParams({ q, scope });
+    if (append && searchCursor) params.set('cursor', searchCursor);
+    
+    try {
+        const response = await fetch(`/api/search?${params}`);
+        const results = await response.json();
+        if (!response.ok) {
+            alert(results.error || '搜尋時出錯');
+            return;
+        }
+        searchCursor = response.headers.get('X-Next-Cursor');
+        
+        const container = document.getElementById('dashboardContent');
+        let list = document.getElementById('searchResults');
+        if (!append || !list) {
+            container.innerHTML = '<div class="dashboard-section"><h2>搜尋結果</h2><div id="searchResults"></div></div>';
+            list = document.getElementById('searchResults');
+        }
+        if (!append && results.length === 0) {
+            list.innerHTML = '<div class="empty-state"><p>沒有符合的結果。</p></div>';
+        }
+        results.forEach(result => list.appendChild(createSearchResultElement(result, scope)));
+        
+        let button = document.getElementById('loadMoreSearch');
+        if (button) button.remove();
+        if (searchCursor) {
+            button = document.createElement('button');
+            button.id = 'loadMoreSearch';
+            button.className = 'btn btn-secondary';
+            button.textContent = '載入更多結果';
+            button.onclick = () => runSearch(true);
+            list.after(button);
+        }
+    } catch (error) {
+        console.error('Error searching:', error);
+    }
+}
+
 async function viewMessages(projectId, projectTitle) {
     document.getElementById('messagesTitle').textContent = `訊息 - ${projectTitle}`;
     document.getElementById('messageProjectId').value = projectId;
     
     await loadMessages(projectId);
     document.getElementById('messagesModal').style.display = 'block';
+    subscribeProjectEvents(projectId, {
+        'message.created': () => loadNewMessages(projectId)
+    });
+}
+
+function createMessageElement(message) {
+    const messageDiv = document.createElement('div');
+    messageDiv.className = 'message-item';
+    messageDiv.innerHTML = `
+        <div class="message-header">
+            ${message.sender_name}
+            <span class="message-time">${new Date(message.created_at).toLocaleString()}</span>
+        </div>
+        <div class="message-body">${message.content}</div>
+    `;
+    return messageDiv;
+}
+
+function updateOlderMessagesButton(projectId) {
+    const container = document.getElementById('messagesContainer');
+    let button = document.getElementById('loadOlderMessages');
+    if (!olderMessagesCursor) {
+        if (button) button.remove();
+        return;
+    }
+    if (!button) {
+        button = document.createElement('button');
+        button.id = 'loadOlderMessages';
+        button.className = 'btn btn-sm btn-link';
+        button.textContent = '載入更早的訊息';
+        container.prepend(button);
+    }
+    button.onclick = () => loadOlderMessages(projectId);
 }
 
+// 首次載入最近的訊息
 async function loadMessages(projectId) {
     try {
-        const response = await fetch(`/api/projects/${projectId}/messages`);
+        const response = await fetch(`/api/projects/${projectId}/messages?limit=${MESSAGE_PAGE_SIZE}`);
         const messages = await response.json();
+        olderMessagesCursor = response.headers.get('X-Next-Cursor');
+        lastMessageId = messages.length > 0 ? messages[messages.length - 1].id : null;
         
         const container = document.getElementById('messagesContainer');
         container.innerHTML = '';
@@ -228,19 +444,36 @@ async function loadMessages(projectId) {
         if (messages.length === 0) {
             container.innerHTML = '<div class="empty-state"><p>還沒有訊息。開始對話吧！</p></div>';
         } else {
-            messages.forEach(message => {
-                const messageDiv = document.createElement('div');
-                messageDiv.className = 'message-item';
-                messageDiv.innerHTML = `
-                    <div class="message-header">
-                        ${message.sender_name}
-                        <span class="message-time">${new Date(message.created_at).toLocaleString()}</span>
-                    </div>
-                    <div class="message-body">${message.content}</div>
-                `;
-                container.appendChild(messageDiv);
-            });
+            messages.forEach(message => container.appendChild(createMessageElement(message)));
         }
+        updateOlderMessagesButton(projectId);
+        
+        container.scrollTop = container.scrollHeight;
+    } catch (error) {
+        console.error('Error loading messages:', error);
+    }
+}
+
+// 只取得最後一則之後的新訊息並附加到列表
+async function loadNewMessages(projectId) {
+    if (lastMessageId === null) {
+        await loadMessages(projectId);
+        return;
+    }
+    try {
+        const response = await fetch(`/api/projects/${projectId}/messages?since_id=${lastMessageId}`);
+        const messages = await response.json();
+        if (messages.length === 0) return;
+        
+        // 發送訊息與即時事件可能同時觸發，略過已顯示的訊息
+        const unseen = messages.filter(message => lastMessageId === null || message.id > lastMessageId);
+        if (unseen.length === 0) return;
+        
+        const container = document.getElementById('messagesContainer');
+        const emptyState = container.querySelector('.empty-state');
+        if (emptyState) emptyState.remove();
+        unseen.forEach(message => container.appendChild(createMessageElement(message)));
+        lastMessageId = unseen[unseen.length - 1].id;
         
         container.scrollTop = container.scrollHeight;
     } catch (error) {
@@ -248,6 +481,27 @@ async function loadMessages(projectId) {
     }
 }
 
+async function loadOlderMessages(projectId) {
+    if (!olderMessagesCursor) return;
+    try {
+        const cursor = encodeURIComponent(olderMessagesCursor);
+        const response = await fetch(`/api/projects/${projectId}/messages?limit=${MESSAGE_PAGE_SIZE}&before=${cursor}`);
+        const messages = await response.json();
+        olderMessagesCursor = response.headers.get('X-Next-Cursor');
+        
+        const container = document.getElementById('messagesContainer');
+        const previousHeight = container.scrollHeight;
+        const button = document.getElementById('loadOlderMessages');
+        const anchor = button ? button.nextSibling : container.firstChild;
+        messages.forEach(message => container.insertBefore(createMessageElement(message), anchor));
+        updateOlderMessagesButton(projectId);
+        
+        container.scrollTop += container.scrollHeight - previousHeight;
+    } catch (error) {
+        console.error('Error loading messages:', error);
+    }
+}
+
 async function sendMessage(e) {
     e.preventDefault();
     
@@ -267,7 +521,7 @@ async function sendMessage(e) {
         
         if (data.success) {
             document.getElementById('messageContent').value = '';
-            await loadMessages(projectId);
+            await loadNewMessages(projectId);
         } else {
             alert(data.error || '發送訊息時出錯');
         }
@@ -285,6 +539,11 @@ async function showUploadModal(projectId) {
     await loadClosureFilesHistory(projectId);
     
     document.getElementById('uploadModal').style.display = 'block';
+    subscribeProjectEvents(projectId, {
+        'closure_file.uploaded': () => loadClosureFilesHistory(projectId),
+        'closure_file.returned': () => loadClosureFilesHistory(projectId),
+        'project.closed': () => loadClosureFilesHistory(projectId)
+    });
 }
 
 async function loadClosureFilesHistory(projectId) {
@@ -386,10 +645,12 @@ function closeQuoteModal() {
 
 function closeMessagesModal() {
     document.getElementById('messagesModal').style.display = 'none';
+    unsubscribeProjectEvents();
 }
 
 function closeUploadModal() {
     document.getElementById('uploadModal').style.display = 'none';
+    unsubscribeProjectEvents();
 }
 
 // ### 新增功能：評價系統相關邏輯 ###
@@ -0,0 +1,67 @@
+"""測試共用設定：每次測試執行使用臨時數據庫與上傳目錄，匯入 app 前設定環境變數"""
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_TMP_DIR = tempfile.mkdtemp(prefix='login_system_tests_')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_TMP_DIR, 'test.db')}"
+os.environ['UPLOAD_FOLDER'] = os.path.join(_TMP_DIR, 'uploads')
+os.environ['JOB_SCHEDULER'] = '0'
+os.environ['QUERY_TRACE'] = '0'
+# templates/ 與 static/ 以相對路徑載入
+os.chdir(APP_DIR)
+sys.path.insert(0, APP_DIR)
+
+import app as webapp  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+_usernames = itertools.count(1)
+
+
+@pytest.fixture(scope='session', autouse=True)
+def migrated_db():
+    webapp.run_migrations()
+    yield
+    webapp.engine.dispose()
+    shutil.rmtree(_TMP_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def db():
+    session = webapp.SessionLocal()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def make_user(db):
+    """直接寫入用戶（不經過 bcrypt），回傳 User"""
+    def factory(role):
+        n = next(_usernames)
+        user = webapp.User(username=f'{role}{n}', email=f'{role}{n}@example.com', password_hash='-', role=role)
+        db.add(user)
+        db.commit()
+        return user
+    return factory
+
+
+@pytest.fixture
+def client_for():
+    """以用戶身分登入的 TestClient（直接簽發 access_token cookie）"""
+    def factory(user):
+        client = TestClient(webapp.app)
+        client.cookies.set('access_token', webapp.create_access_token(
+            data={'user_id': user.id, 'username': user.username, 'role': user.role}))
+        return client
+    return factory
+
+
+@pytest.fixture
+def max_queries():
+    """with max_queries(n): 區塊內（包含 TestClient 的線程）執行超過 n 個查詢時失敗，失敗訊息列出最常執行的語句"""
+    return webapp.assert_max_queries
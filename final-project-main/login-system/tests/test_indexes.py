@@ -0,0 +1,15 @@
+"""熱門查詢在剛遷移完成的數據庫上都使用索引（EXPLAIN QUERY PLAN 沒有全表掃描）"""
+import pytest
+
+from manage import explain_hot_queries, hot_queries
+
+
+@pytest.fixture(scope='module')
+def plans():
+    return explain_hot_queries()
+
+
+@pytest.mark.parametrize('name', sorted(hot_queries()))
+def test_hot_query_uses_index(name, plans):
+    uses_index, plan = plans[name]
+    assert uses_index, f"{name} 使用全表掃描: {' | '.join(plan)}"
@@ -0,0 +1,45 @@
+"""舊版數據庫遷移到最新版本（包含版本號重複的結案文件）"""
+import os
+import shutil
+
+from sqlalchemy import text
+
+import app as webapp
+
+BASELINE_DB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'project_delegation.db')
+
+
+def test_legacy_database_with_duplicate_closure_versions_migrates(tmp_path, monkeypatch):
+    legacy = tmp_path / 'legacy.db'
+    shutil.copy(BASELINE_DB, legacy)
+    engine = webapp.create_db_engine(f'sqlite:///{legacy}')
+    with engine.begin() as conn:
+        # 舊版本以上傳者計算版本號，version 欄位的 DEFAULT 1 也會補出重複的版本號
+        conn.execute(text(
+            "INSERT INTO closure_file (project_id, uploader_id, filename, original_filename, status, created_at, version) "
+            "SELECT project_id, uploader_id, filename, original_filename, status, created_at, version "
+            "FROM closure_file WHERE project_id = 6"
+        ))
+        conn.execute(text(
+            "INSERT INTO closure_file (project_id, uploader_id, filename, original_filename, status, created_at, version) "
+            "SELECT project_id, uploader_id, filename, original_filename, status, created_at, NULL "
+            "FROM closure_file WHERE project_id = 8"
+        ))
+    monkeypatch.setattr(webapp, 'engine', engine)
+    monkeypatch.setattr(webapp, 'search_enabled', None)
+    try:
+        assert webapp.run_migrations() == webapp.LATEST_SCHEMA_VERSION
+        with engine.connect() as conn:
+            assert webapp.current_schema_version(conn) == webapp.LATEST_SCHEMA_VERSION
+            rows = conn.execute(text("SELECT project_id, version FROM closure_file ORDER BY project_id, version")).all()
+            unique = conn.execute(text(
+                "SELECT \"unique\" FROM pragma_index_list('closure_file') WHERE name = 'ix_closure_file_project_version'"
+            )).scalar()
+    finally:
+        engine.dispose()
+    versions = {}
+    for project_id, version in rows:
+        versions.setdefault(project_id, []).append(version)
+    assert versions == {project_id: list(range(1, len(v) + 1)) for project_id, v in versions.items()}
+    assert versions[6] == [1, 2, 3, 4]
+    assert unique == 1
@@ -0,0 +1,31 @@
+"""替換提案文件：內容定址之前的舊文件（checksum 為 NULL）在替換後被刪除"""
+import os
+
+import app as webapp
+
+
+def test_replacing_legacy_proposal_removes_old_file(db, make_user, client_for):
+    delegator, recipient = make_user('delegator'), make_user('recipient')
+    project = webapp.Project(title='legacy', description='-', status='pending',
+                             delegator_id=delegator.id)
+    db.add(project)
+    db.commit()
+    quote = webapp.Quote(project_id=project.id, recipient_id=recipient.id, amount=100)
+    db.add(quote)
+    db.commit()
+    legacy_filename = f'proposal_{quote.id}_legacy.pdf'
+    legacy_path = os.path.join(webapp.UPLOAD_FOLDER, legacy_filename)
+    with open(legacy_path, 'wb') as f:
+        f.write(b'%PDF legacy')
+    db.add(webapp.ProposalFile(quote_id=quote.id, project_id=project.id, uploader_id=recipient.id,
+                               filename=legacy_filename, original_filename='old.pdf', file_size=11))
+    db.commit()
+    
+    response = client_for(recipient).post(f'/api/quotes/{quote.id}/upload_proposal',
+                                          files={'file': ('new.pdf', b'%PDF new', 'application/pdf')})
+    assert response.status_code == 200, response.text
+    assert not os.path.exists(legacy_path)
+    db.expire_all()
+    proposal_file = db.query(webapp.ProposalFile).filter(webapp.ProposalFile.quote_id == quote.id).one()
+    assert proposal_file.checksum is not None
+    assert os.path.exists(os.path.join(webapp.UPLOAD_FOLDER, proposal_file.filename))
@@ -0,0 +1,83 @@
+"""列表路由的查詢數不隨數據量增加（防止 N+1 查詢回歸）
+
+每個路由以 N 與 10·N 筆數據各請求一次（各用新的用戶，回應快取與用戶快取都是冷的），
+10·N 時的查詢數不得超過 N 時的查詢數。
+"""
+import pytest
+
+import app as webapp
+
+N = 3
+
+
+def review(db, project, reviewer, reviewee, score=4):
+    db.add(webapp.Review(project_id=project.id, reviewer_id=reviewer.id, reviewee_id=reviewee.id,
+                         dimension_1=score, dimension_2=score, dimension_3=score, average_rating=score))
+
+
+def seed_quotes(db, make_user, client_for, n):
+    delegator = make_user('delegator')
+    project = webapp.Project(title='quotes', description='-', delegator_id=delegator.id)
+    db.add(project)
+    db.flush()
+    for i in range(n):
+        recipient = make_user('recipient')
+        quote = webapp.Quote(project_id=project.id, recipient_id=recipient.id, amount=100 + i)
+        db.add(quote)
+        db.flush()
+        db.add(webapp.ProposalFile(quote_id=quote.id, project_id=project.id, uploader_id=recipient.id,
+                                   filename=f'proposal_{quote.id}.pdf', original_filename='p.pdf', file_size=1))
+        review(db, project, delegator, recipient)
+    db.commit()
+    return client_for(delegator), f'/api/projects/{project.id}/quotes'
+
+
+def seed_available(db, make_user, client_for, n):
+    recipient = make_user('recipient')
+    for i in range(n):
+        delegator = make_user('delegator')
+        project = webapp.Project(title=f'available {i}', description='-', delegator_id=delegator.id)
+        db.add(project)
+        db.flush()
+        db.add(webapp.Quote(project_id=project.id, recipient_id=recipient.id, amount=10))
+        review(db, project, recipient, delegator)
+    db.commit()
+    return client_for(recipient), f'/api/available_projects?not_quoted=false&limit={webapp.AVAILABLE_PROJECTS_PAGE_MAX}'
+
+
+def seed_my_projects(db, make_user, client_for, n):
+    recipient = make_user('recipient')
+    for i in range(n):
+        delegator = make_user('delegator')
+        db.add(webapp.Project(title=f'assigned {i}', description='-', status='active',
+                              delegator_id=delegator.id, delegate_id=recipient.id))
+    db.commit()
+    return client_for(recipient), '/api/my_projects'
+
+
+def seed_history(db, make_user, client_for, n):
+    delegator = make_user('delegator')
+    for i in range(n):
+        recipient = make_user('recipient')
+        db.add(webapp.Project(title=f'done {i}', description='-', status='closed',
+                              delegator_id=delegator.id, delegate_id=recipient.id))
+    db.commit()
+    return client_for(delegator), '/api/history'
+
+
+@pytest.mark.parametrize('seed', [seed_quotes, seed_available, seed_my_projects, seed_history],
+                         ids=['quotes', 'available_projects', 'my_projects', 'history'])
+def test_query_count_does_not_grow_with_rows(seed, db, make_user, client_for, max_queries):
+    client, url = seed(db, make_user, client_for, N)
+    webapp.rebuild_rating_summaries(db)
+    with webapp.capture_queries() as trace:
+        response = client.get(url)
+    assert response.status_code == 200, response.text
+    baseline = trace.queries
+    
+    client, url = seed(db, make_user, client_for, 10 * N)
+    webapp.rebuild_rating_summaries(db)
+    with max_queries(baseline):
+        response = client.get(url)
+    assert response.status_code == 200, response.text
+    assert len(response.json()) >= 10 * N
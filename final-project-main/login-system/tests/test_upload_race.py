@@ -0,0 +1,95 @@
+"""同一個專案的並發結案文件上傳：版本號連續不重複、引用計數正確、沒有遺留或未登記的文件；版本號衝突時重試"""
+import asyncio
+import hashlib
+import os
+import random
+from collections import Counter
+
+import httpx
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import app as webapp
+
+UPLOADS = int(os.environ.get('UPLOAD_RACE_COUNT', 300))  # 同時送出的上傳數；bench.py --scenario upload-race 也預設 300
+
+
+def test_concurrent_closure_uploads_stay_consistent(db, make_user, client_for):
+    delegator, recipient = make_user('delegator'), make_user('recipient')
+    project = webapp.Project(title='race', description='-', status='active',
+                             delegator_id=delegator.id, delegate_id=recipient.id)
+    db.add(project)
+    db.commit()
+    cookies = dict(client_for(recipient).cookies)
+    # 約三分之一是相同的內容（共用同一個 blob），其餘各不相同
+    shared = random.randbytes(4096)
+    bodies = [shared if i % 3 == 0 else random.randbytes(4096) for i in range(UPLOADS)]
+    
+    async def upload_all():
+        transport = httpx.ASGITransport(app=webapp.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test', cookies=cookies) as client:
+            return await asyncio.gather(*(
+                client.post(f'/api/projects/{project.id}/upload_closure',
+                            files={'file': ('deliverable.zip', body, 'application/zip')})
+                for body in bodies
+            ))
+    
+    responses = asyncio.run(upload_all())
+    assert [r.status_code for r in responses] == [200] * UPLOADS
+    
+    versions = sorted(row[0] for row in db.query(webapp.ClosureFile.version).filter(
+        webapp.ClosureFile.project_id == project.id))
+    assert versions == list(range(1, UPLOADS + 1))
+    assert sorted(r.json()['version'] for r in responses) == versions
+    
+    references = Counter(row[0] for model in (webapp.ProposalFile, webapp.ClosureFile)
+                         for row in db.query(model.checksum).filter(model.checksum.isnot(None)))
+    ref_counts = dict(db.query(webapp.FileBlob.sha256, webapp.FileBlob.ref_count))
+    assert {checksum: ref_counts.get(checksum) for checksum in references} == dict(references)
+    
+    on_disk = {name for _, _, files in os.walk(webapp.BLOB_FOLDER) for name in files}
+    assert set(references) <= on_disk
+    assert on_disk <= set(ref_counts)
+    assert not [name for name in os.listdir(webapp.UPLOAD_FOLDER) if name.startswith('.upload_')]
+
+
+def test_closure_version_conflicts_are_retried(db, make_user, client_for, monkeypatch):
+    """SQLite 上寫入鎖讓版本號不會衝突；模擬其他交易在讀取最大版本號之後搶先寫入相同的版本號"""
+    delegator, recipient = make_user('delegator'), make_user('recipient')
+    project = webapp.Project(title='conflict', description='-', status='active',
+                             delegator_id=delegator.id, delegate_id=recipient.id)
+    db.add(project)
+    db.commit()
+    client = client_for(recipient)
+    conflicts = {'remaining': 0}
+    begin_nested = Session.begin_nested
+    
+    def racing_begin_nested(session):
+        if conflicts['remaining']:
+            conflicts['remaining'] -= 1
+            session.execute(text(
+                "INSERT INTO closure_file (project_id, uploader_id, filename, original_filename, version, status) "
+                "SELECT :p, :u, 'other', 'other', coalesce(max(version), 0) + 1, 'pending' "
+                "FROM closure_file WHERE project_id = :p"
+            ), {'p': project.id, 'u': recipient.id})
+        return begin_nested(session)
+    
+    monkeypatch.setattr(Session, 'begin_nested', racing_begin_nested)
+    url = f'/api/projects/{project.id}/upload_closure'
+    
+    conflicts['remaining'] = 2
+    response = client.post(url, files={'file': ('a.zip', b'retried', 'application/zip')})
+    assert response.status_code == 200, response.text
+    assert response.json()['version'] == 3
+    
+    # 每次重試都衝突：回傳 409，交易回滾，這次放入的內容文件被清除
+    conflicts['remaining'] = webapp.CLOSURE_VERSION_RETRIES
+    body = b'gave up'
+    response = client.post(url, files={'file': ('a.zip', body, 'application/zip')})
+    assert response.status_code == 409
+    versions = sorted(row[0] for row in db.query(webapp.ClosureFile.version).filter(
+        webapp.ClosureFile.project_id == project.id))
+    assert versions == [1, 2, 3]
+    checksum = hashlib.sha256(body).hexdigest()
+    assert db.query(webapp.FileBlob).filter(webapp.FileBlob.sha256 == checksum).first() is None
+    assert not os.path.exists(os.path.join(webapp.UPLOAD_FOLDER, webapp.blob_path(checksum)))